@@ -0,0 +1,55 @@
+"""
+Memory of N ownership/runtime records as plain dicts vs bot's slotted classes.
+
+    python bench/bench_records.py [N]     (default 10000)
+"""
+import os
+import secrets
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# bot.py opens its stores and scripts/ relative to the cwd at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bot-bench-"))
+
+from bot import AppRecord, RuntimeEntry  # noqa: E402
+
+
+def measure(make, n: int) -> int:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objs = [make(i) for i in range(n)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    del objs
+    return size
+
+
+def app_dict(i):
+    return {"owner": 100000 + i, "type": "file", "key": secrets.token_urlsafe(16), "last_run": True,
+            "entry": f"bot{i}.py", "created_at": 1700000000 + i}
+
+
+def app_rec(i):
+    return AppRecord.from_dict(app_dict(i))
+
+
+def rt_dict(i):
+    return {"process": None, "log": f"scripts/u{i}_bot.py.log", "started_at": time.time(), "last_alert": 0}
+
+
+def rt_rec(i):
+    return RuntimeEntry(None, f"scripts/u{i}_bot.py.log", time.time(), 0)
+
+
+def main(n: int):
+    for name, make in (("ownership dict", app_dict), ("AppRecord", app_rec), ("runtime dict", rt_dict), ("RuntimeEntry", rt_rec)):
+        size = measure(make, n)
+        print(f"{name:<16} {size / 1024:9.1f} KiB total  {size / n:7.1f} B/record  (n={n})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
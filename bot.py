@@ -1,4 +1,5 @@
 import os
+import atexit
 import logging
 import asyncio
 import subprocess
@@ -9,8 +10,17 @@ import threading
 import shutil
 import time
 import secrets
+import math
+import random
+import re
+import shlex
+import socket
+import sqlite3
 from urllib.parse import quote, unquote
 from pathlib import Path
+from collections import deque
+from contextlib import contextmanager
+from types import MappingProxyType
 
 import psutil
 from flask import Flask, request, render_template_string, jsonify
@@ -41,13 +51,71 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 USERS_FILE = "allowed_users.json"
 OWNERSHIP_FILE = "ownership.json"
+OWNER_WEIGHTS_FILE = "owner_weights.json"
+
+# json (default) | journal | sqlite
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json").lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "hosting.db")
+
+# journal mode: group fsync + compaction into ownership.json
+JOURNAL_FSYNC_BATCH = int(os.environ.get("JOURNAL_FSYNC_BATCH", "64"))
+JOURNAL_FSYNC_INTERVAL_SEC = float(os.environ.get("JOURNAL_FSYNC_INTERVAL_SEC", "0.5"))
+JOURNAL_COMPACT_BYTES = int(os.environ.get("JOURNAL_COMPACT_BYTES", str(1024 * 1024)))
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
-running_processes = {}  # {target_id: {"process": Popen, "log": path, "started_at": epoch, "last_alert": epoch}}
+
+class ProcessTable:
+    """
+    running_processes, published copy-on-write.
+    The bot loop swaps in a new mapping on every add/remove; the Flask thread
+    reads whatever mapping is current without locking.
+    """
+
+    def __init__(self):
+        self._snap = MappingProxyType({})
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        return self._snap
+
+    def __getitem__(self, tid):
+        return self._snap[tid]
+
+    def __contains__(self, tid):
+        return tid in self._snap
+
+    def __iter__(self):
+        return iter(self._snap)
+
+    def __len__(self):
+        return len(self._snap)
+
+    def get(self, tid, default=None):
+        return self._snap.get(tid, default)
+
+    def keys(self):
+        return self._snap.keys()
+
+    def items(self):
+        return self._snap.items()
+
+    def __setitem__(self, tid, entry):
+        with self._lock:
+            snap = dict(self._snap)
+            snap[tid] = entry
+            self._snap = MappingProxyType(snap)
+
+    def __delitem__(self, tid):
+        with self._lock:
+            snap = dict(self._snap)
+            del snap[tid]
+            self._snap = MappingProxyType(snap)
+
+running_processes = ProcessTable()  # {target_id: RuntimeEntry}
 
 # ---------- ALERT/HEALTH SETTINGS (Feature F) ----------
 ENABLE_ALERTS = os.environ.get("ENABLE_ALERTS", "1") == "1"
@@ -58,6 +126,73 @@ ALERT_COOLDOWN_SEC = int(os.environ.get("ALERT_COOLDOWN_SEC", "180"))
 CPU_ALERT_PERCENT = float(os.environ.get("CPU_ALERT_PERCENT", "85"))
 RAM_ALERT_MB = float(os.environ.get("RAM_ALERT_MB", "350"))
 
+# auto-restart backoff: base * 2^attempt (+jitter), capped; N restarts within M sec => crash-looping
+RESTART_BACKOFF_BASE_SEC = float(os.environ.get("RESTART_BACKOFF_BASE_SEC", "2"))
+RESTART_BACKOFF_MAX_SEC = float(os.environ.get("RESTART_BACKOFF_MAX_SEC", "300"))
+RESTART_BACKOFF_JITTER = float(os.environ.get("RESTART_BACKOFF_JITTER", "0.2"))
+CRASH_LOOP_RESTARTS = int(os.environ.get("CRASH_LOOP_RESTARTS", "5"))
+CRASH_LOOP_WINDOW_SEC = float(os.environ.get("CRASH_LOOP_WINDOW_SEC", "120"))
+
+# stop: SIGTERM, wait up to the app's grace period, then SIGKILL and wait this long
+STOP_GRACE_SEC = float(os.environ.get("STOP_GRACE_SEC", "10"))
+STOP_KILL_WAIT_SEC = float(os.environ.get("STOP_KILL_WAIT_SEC", "5"))
+
+# staged boot / Restart ALL: apps per batch, and how long a fresh app must stay up to count as ready
+BOOT_CONCURRENCY = max(1, int(os.environ.get("BOOT_CONCURRENCY", "4")))
+BOOT_READY_SEC = float(os.environ.get("BOOT_READY_SEC", "3"))
+# json/journal stores: while apps start, their record writes are flushed together at most this often
+BOOT_STORE_FLUSH_SEC = float(os.environ.get("BOOT_STORE_FLUSH_SEC", "0.5"))
+# readiness of every start (apps can configure port / log regex / alive signals); time-to-ready kept per app
+READY_TIMEOUT_SEC = float(os.environ.get("READY_TIMEOUT_SEC", "60"))
+READY_HISTORY = int(os.environ.get("READY_HISTORY", "50"))
+# ready_log: tenant regexes are matched in a child python that is killed when one poll's
+# lines take longer than READY_LOG_MATCH_SEC; pattern and matched line lengths are bounded too
+READY_LOG_MAX_PATTERN = 200
+READY_LOG_MAX_LINE = 500
+READY_LOG_MATCH_SEC = float(os.environ.get("READY_LOG_MATCH_SEC", "2"))
+
+# cgroup v2 limits per app (0 = unlimited); apps run unconfined when the tree isn't writable
+ENABLE_CGROUPS = os.environ.get("ENABLE_CGROUPS", "1") == "1"
+CGROUP_ROOT = os.environ.get("CGROUP_ROOT", "/sys/fs/cgroup/mega-hosting")
+APP_CPU_MAX_PERCENT = float(os.environ.get("APP_CPU_MAX_PERCENT", "100"))
+APP_MEMORY_MAX_MB = int(os.environ.get("APP_MEMORY_MAX_MB", "512"))
+APP_MEMORY_HIGH_MB = int(os.environ.get("APP_MEMORY_HIGH_MB", "0"))  # 0 = 90% of max
+APP_PIDS_MAX = int(os.environ.get("APP_PIDS_MAX", "256"))
+# per-owner parent group cpu.weight (1..10000); owners share CPU by weight, not by app count
+DEFAULT_OWNER_CPU_WEIGHT = int(os.environ.get("DEFAULT_OWNER_CPU_WEIGHT", "100"))
+# per-owner parent group caps over all of an owner's apps/replicas (0 = unlimited)
+OWNER_MEMORY_MAX_MB = int(os.environ.get("OWNER_MEMORY_MAX_MB", "2048"))
+OWNER_PIDS_MAX = int(os.environ.get("OWNER_PIDS_MAX", "1024"))
+
+# zygote mode: python apps are forked from a warm process (zygote.py) that preloaded these modules
+ZYGOTE_ENABLED = os.environ.get("ZYGOTE_ENABLED", "0") == "1"
+ZYGOTE_PYTHON = os.environ.get("ZYGOTE_PYTHON", "python")
+ZYGOTE_PRELOAD = os.environ.get("ZYGOTE_PRELOAD", "telegram,telegram.ext,requests,aiohttp")
+ZYGOTE_SPAWN_TIMEOUT_SEC = float(os.environ.get("ZYGOTE_SPAWN_TIMEOUT_SEC", "10"))
+
+# package.json "start": exec the command directly instead of keeping an npm process around;
+# the npm wrapper's RSS is estimated with this until one has been measured
+NPM_DIRECT_EXEC = os.environ.get("NPM_DIRECT_EXEC", "1") == "1"
+NPM_WRAPPER_RSS_MB = float(os.environ.get("NPM_WRAPPER_RSS_MB", "60"))
+
+# apps with a port: the bot proxies PROXY_HOST:port to the live instance; restarts are blue/green
+PROXY_HOST = os.environ.get("PROXY_HOST", "0.0.0.0")
+# public ports owners may give their apps (admin: any unprivileged port); below the kernel's ephemeral range
+PUBLIC_PORT_MIN = int(os.environ.get("PUBLIC_PORT_MIN", "10000"))
+PUBLIC_PORT_MAX = int(os.environ.get("PUBLIC_PORT_MAX", "19999"))
+BLUE_GREEN_READY_TIMEOUT_SEC = float(os.environ.get("BLUE_GREEN_READY_TIMEOUT_SEC", "60"))
+# on-demand web apps: default idle period before scaling to zero; how long a cold start may take
+ON_DEMAND_IDLE_SEC = float(os.environ.get("ON_DEMAND_IDLE_SEC", "900"))
+COLD_START_TIMEOUT_SEC = float(os.environ.get("COLD_START_TIMEOUT_SEC", "60"))
+
+# cpus="auto" apps: move one app per watchdog pass once the busiest and idlest core differ by this much (% of a core)
+SPREAD_IMBALANCE_PERCENT = float(os.environ.get("SPREAD_IMBALANCE_PERCENT", "50"))
+
+# Procfile apps: upper bound for one process type's replica count, and for all Procfile
+# instances of one (non-admin) owner
+MAX_REPLICAS = int(os.environ.get("MAX_REPLICAS", "16"))
+OWNER_MAX_INSTANCES = int(os.environ.get("OWNER_MAX_INSTANCES", "8"))
+
 
 # ================= ID HELPERS =================
 def is_user_file_id(tid: str) -> bool:
@@ -72,6 +207,22 @@ def is_user_file_id(tid: str) -> bool:
 def is_repo_id(tid: str) -> bool:
     return ("|" in tid) and (not is_user_file_id(tid))
 
+# one process of a Procfile app: "<app id>#<type>.<n>"
+INSTANCE_RE = re.compile(r"^(.+)#([A-Za-z0-9_-]+)\.(\d+)$")
+
+def instance_key(tid: str, ptype: str, n: int) -> str:
+    return f"{tid}#{ptype}.{n}"
+
+def app_id(key: str) -> str:
+    """The app an instance key belongs to (any other id is returned as is)."""
+    m = INSTANCE_RE.match(key)
+    return m.group(1) if m else key
+
+def instance_name(key: str):
+    """"worker.2" for an instance key, None for a plain app id."""
+    m = INSTANCE_RE.match(key)
+    return f"{m.group(2)}.{m.group(3)}" if m else None
+
 def safe_q(s: str) -> str:
     return quote(s, safe="")
 
@@ -79,6 +230,150 @@ def safe_status_url(tid: str, key: str) -> str:
     return f"{BASE_URL}/status?script={safe_q(tid)}&key={safe_q(key)}"
 
 
+# ================= RECORDS =================
+class AppRecord:
+    """
+    One ownership entry. Stores hold these; JSON dicts only exist at the
+    store boundary (to_dict/from_dict). Unknown keys ride along in `extra`.
+    Treated as immutable: use replace() to derive a changed copy.
+    OPTIONAL fields are only written out when set.
+    """
+
+    __slots__ = (
+        "owner", "type", "key", "last_run", "entry", "created_at",
+        "pid", "pgid", "started_at", "create_time",
+        "restart_policy", "stop_grace_sec",
+        "priority", "start_after",
+        "cpu_max", "memory_max_mb", "memory_high_mb", "pids_max",
+        "nice", "ionice", "cpus",
+        "port", "health_path", "backend_port",
+        "on_demand", "idle_stop_sec",
+        "ready_port", "ready_log", "ready_after_sec", "ready_timeout_sec",
+        "procfile", "scale", "instances",
+        "extra",
+    )
+    FIELDS = ("owner", "type", "key", "last_run", "entry", "created_at")
+    OPTIONAL = (
+        # last launched process, so a restarted bot can adopt it instead of relaunching
+        "pid", "pgid", "started_at", "create_time",
+        # always | on-failure | never (None = always)
+        "restart_policy",
+        # SIGTERM -> SIGKILL grace (None = STOP_GRACE_SEC)
+        "stop_grace_sec",
+        # staged boot/Restart ALL: higher priority first; start only after these app ids
+        "priority", "start_after",
+        # cgroup limits (None = APP_* env default): % of one core, MB, MB, tasks
+        "cpu_max", "memory_max_mb", "memory_high_mb", "pids_max",
+        # scheduling at spawn: nice -20..19, "idle" | "be[:0-7]" | "rt[:0-7]", [core, ...] | "auto[:N]"
+        "nice", "ionice", "cpus",
+        # web apps: public port served by the bot's proxy, HTTP readiness path (None = TCP connect),
+        # and the private port ($PORT) the current instance listens on
+        "port", "health_path", "backend_port",
+        # scale-to-zero for web apps: stop after idle_stop_sec without connections, start on the next one
+        "on_demand", "idle_stop_sec",
+        # readiness signals, all must pass (none set = alive for BOOT_READY_SEC): TCP port accepting
+        # connections, regex matching a log line of this start, alive seconds; timeout (None = default)
+        "ready_port", "ready_log", "ready_after_sec", "ready_timeout_sec",
+        # Procfile apps: False = run the entry file instead, {type: replicas} (default 1), and the
+        # launched instances {instance key: [pid, started_at, create_time]} for adoption
+        "procfile", "scale", "instances",
+    )
+
+    def __init__(self, owner=None, type=None, key=None, last_run=False, entry=None, created_at=None, extra=None, **optional):
+        self.owner = owner
+        self.type = type
+        self.key = key
+        self.last_run = last_run
+        self.entry = entry
+        self.created_at = created_at
+        for f in self.OPTIONAL:
+            setattr(self, f, optional.pop(f, None))
+        if optional:
+            raise TypeError(f"Unknown AppRecord fields: {sorted(optional)}")
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "AppRecord":
+        known = cls.FIELDS + cls.OPTIONAL
+        extra = {k: v for k, v in d.items() if k not in known}
+        return cls(
+            d.get("owner"), d.get("type"), d.get("key"), d.get("last_run", False),
+            d.get("entry"), d.get("created_at"), extra,
+            **{f: d[f] for f in cls.OPTIONAL if f in d},
+        )
+
+    def to_dict(self) -> dict:
+        d = {f: getattr(self, f) for f in self.FIELDS}
+        for f in self.OPTIONAL:
+            v = getattr(self, f)
+            if v is not None:
+                d[f] = v
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    def replace(self, **fields) -> "AppRecord":
+        d = self.to_dict()
+        d.update(fields)
+        return AppRecord.from_dict(d)
+
+    def opt(self, name: str, default=None):
+        return self.extra.get(name, default) if self.extra else default
+
+    def __eq__(self, other):
+        return isinstance(other, AppRecord) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"AppRecord({self.to_dict()!r})"
+
+class RuntimeEntry:
+    """running_processes value for one launched app."""
+
+    __slots__ = ("process", "log", "started_at", "last_alert", "exit_code")
+
+    def __init__(self, process, log: str, started_at: float, last_alert: float = 0):
+        self.process = process
+        self.log = log
+        self.started_at = started_at
+        self.last_alert = last_alert
+        self.exit_code = None  # set by ExitWatcher the moment the process dies
+
+class ExitEvent:
+    __slots__ = ("tid", "pid", "returncode", "at")
+
+    def __init__(self, tid: str, pid: int, returncode):
+        self.tid = tid
+        self.pid = pid
+        self.returncode = returncode
+        self.at = time.time()
+
+    def describe(self) -> str:
+        rc = self.returncode
+        if rc is None:
+            return "exited"
+        if rc < 0:
+            try:
+                return f"killed by {signal.Signals(-rc).name}"
+            except ValueError:
+                return f"killed by signal {-rc}"
+        return f"exit code {rc}"
+
+class AppUsage:
+    """Resource totals for one app (all of its processes), from UsageSampler."""
+
+    __slots__ = ("cpu_percent", "rss_mb", "pss_mb", "memory_mb", "threads", "fds", "procs", "source")
+
+    def __init__(self, cpu_percent=0.0, rss_mb=0.0, pss_mb=None, memory_mb=0.0, threads=0, fds=0, procs=0, source="tree"):
+        self.cpu_percent = cpu_percent
+        self.rss_mb = rss_mb
+        self.pss_mb = pss_mb      # only for full samples (reads smaps)
+        self.memory_mb = memory_mb  # what alerts use: cgroup memory.current, else summed RSS
+        self.threads = threads
+        self.fds = fds
+        self.procs = procs
+        self.source = source
+
+
 # ================= JSON STORE =================
 def _read_json(path: str, default):
     if not os.path.exists(path):
@@ -95,53 +390,648 @@ def _write_json(path: str, obj):
         json.dump(obj, f, ensure_ascii=False)
     os.replace(tmp, path)
 
-def get_allowed_users():
-    return _read_json(USERS_FILE, [])
+class UserStore:
+    """allowed_users.json: a plain list of user ids."""
 
-def save_allowed_user(uid: int) -> bool:
-    users = get_allowed_users()
-    if uid not in users:
+    def __init__(self, path: str):
+        self.path = path
+
+    def all(self) -> list:
+        return _read_json(self.path, [])
+
+    def add(self, uid: int) -> bool:
+        users = self.all()
+        if uid in users:
+            return False
         users.append(uid)
-        _write_json(USERS_FILE, users)
+        _write_json(self.path, users)
         return True
-    return False
 
-def remove_allowed_user(uid: int) -> bool:
-    users = get_allowed_users()
-    if uid in users:
+    def remove(self, uid: int) -> bool:
+        users = self.all()
+        if uid not in users:
+            return False
         users.remove(uid)
-        _write_json(USERS_FILE, users)
+        _write_json(self.path, users)
         return True
-    return False
+
+    def stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+class OwnerWeights:
+    """owner_weights.json: {owner id: cpu.weight}; owners not listed get DEFAULT_OWNER_CPU_WEIGHT."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def all(self) -> dict:
+        return {int(k): int(v) for k, v in _read_json(self.path, {}).items()}
+
+    def get(self, owner) -> int:
+        return self.all().get(owner, DEFAULT_OWNER_CPU_WEIGHT) if owner is not None else DEFAULT_OWNER_CPU_WEIGHT
+
+    def set(self, owner: int, weight):
+        weights = self.all()
+        if weight is None or weight == DEFAULT_OWNER_CPU_WEIGHT:
+            weights.pop(owner, None)
+        else:
+            weights[owner] = int(weight)
+        _write_json(self.path, {str(k): v for k, v in weights.items()})
+
+owner_weights = OwnerWeights(OWNER_WEIGHTS_FILE)
+
+class OwnershipStore:
+    """
+    In-memory view of ownership.json.
+    - lookups are served from the parsed map (no re-read per call)
+    - the cache is dropped when the file's mtime/size changes on disk
+    - every mutation bumps `version` and goes through _write_json here
+    - secondary indexes (owner -> ids, last_run ids) are kept in step with each mutation
+    - state is published copy-on-write: readers (Flask thread) grab the current
+      (data, by_owner, last_run) tuple without locking and never see a half-applied
+      change; writers serialize on one lock. Records are never mutated in place.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.version = 0
+        self._snap = None  # (data, by_owner {owner: {tid: None}}, last_run {tid: None})
+        self._sig = None
+        self._loaded_version = -1
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._pending = []
+        self._defer_depth = 0
+        self._flush_timer = None
+
+    def _file_sig(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _load(self) -> dict:
+        return {tid: AppRecord.from_dict(d) for tid, d in _read_json(self.path, {}).items()}
+
+    def _dump(self) -> dict:
+        return {tid: rec.to_dict() for tid, rec in self._snap[0].items()}
+
+    def _fresh(self) -> bool:
+        return (
+            self._snap is not None
+            and self._loaded_version == self.version
+            and (self._batch_depth or self._pending or self._file_sig() == self._sig)
+        )
+
+    def _state(self):
+        snap = self._snap
+        if snap is not None and self._fresh():
+            return snap
+        # a writer holding the lock (e.g. mid disk write, before it records the new
+        # file sig) has already published its map: readers take that instead of waiting
+        if not self._lock.acquire(blocking=snap is None):
+            return snap
+        try:
+            if not self._fresh():
+                sig = self._file_sig()
+                data = self._load()
+                by_owner, last_run = {}, {}
+                for tid, rec in data.items():
+                    by_owner.setdefault(rec.owner, {})[tid] = None
+                    if rec.last_run is True:
+                        last_run[tid] = None
+                self._snap = (data, by_owner, last_run)
+                self._sig = sig
+                self._loaded_version = self.version
+            return self._snap
+        finally:
+            self._lock.release()
+
+    def _ensure(self) -> dict:
+        return self._state()[0]
+
+    def _set(self, tid: str, record):
+        # caller holds self._lock; copies only the containers the change touches
+        data, by_owner, last_run = self._state()
+        old = data.get(tid)
+        data = dict(data)
+        if record is None:
+            data.pop(tid, None)
+        else:
+            data[tid] = record
+
+        old_owner = old.owner if old else None
+        new_owner = record.owner if record else None
+        if old is None or record is None or old_owner != new_owner:
+            by_owner = dict(by_owner)
+            if old is not None:
+                ids = dict(by_owner.get(old_owner, {}))
+                ids.pop(tid, None)
+                if ids:
+                    by_owner[old_owner] = ids
+                else:
+                    by_owner.pop(old_owner, None)
+            if record is not None:
+                ids = dict(by_owner.get(new_owner, {}))
+                ids[tid] = None
+                by_owner[new_owner] = ids
+
+        was_last = tid in last_run
+        is_last = record is not None and record.last_run is True
+        if was_last != is_last:
+            last_run = dict(last_run)
+            if is_last:
+                last_run[tid] = None
+            else:
+                del last_run[tid]
+
+        self._snap = (data, by_owner, last_run)
+
+    def _commit(self, changes):
+        # changes: [(target_id, record or None)]
+        if self._batch_depth:
+            self._pending.extend(changes)
+            return
+        if self._defer_depth:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None  # another thread: write now, along with whatever is pending
+            if loop is not None:
+                self._pending.extend(changes)
+                if self._flush_timer is None:
+                    self._flush_timer = loop.call_later(self._defer_delay, self._flush_deferred)
+                return
+            changes, self._pending = self._pending + changes, []
+        self._write_changes(changes)
+
+    def _flush_deferred(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._pending and not self._batch_depth:
+                changes, self._pending = self._pending, []
+                self._write_changes(changes)
+
+    def _write_changes(self, changes):
+        # the plain store rewrites the whole map
+        _write_json(self.path, self._dump())
+        self.version += 1
+        self._sig = self._file_sig()
+        self._loaded_version = self.version
+
+    @contextmanager
+    def batch(self):
+        """Group mutations: nothing hits disk until the outermost batch exits, then one write."""
+        with self._lock:
+            self._state()
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._pending:
+                    changes, self._pending = self._pending, []
+                    self._write_changes(changes)
+
+    @contextmanager
+    def deferred(self, delay: float = BOOT_STORE_FLUSH_SEC):
+        """
+        Coalesce writes made from the bot loop, e.g. while a stage of apps starts:
+        changes are visible at once and written together at most every `delay`
+        seconds and on exit. Unlike batch() no lock is held, so it may span awaits.
+        """
+        self._defer_depth += 1
+        self._defer_delay = delay
+        try:
+            yield self
+        finally:
+            self._defer_depth -= 1
+            if not self._defer_depth:
+                self._flush_deferred()
+
+    def all(self) -> dict:
+        return dict(self._state()[0])
+
+    def get(self, target_id: str):
+        return self._state()[0].get(target_id)
+
+    def put(self, target_id: str, record: AppRecord):
+        with self._lock:
+            self._set(target_id, record)
+            self._commit([(target_id, record)])
+
+    def update(self, target_id: str, **fields):
+        with self._lock:
+            data = self._ensure()
+            if target_id in data:
+                record = data[target_id].replace(**fields)
+                if record == data[target_id]:
+                    return
+                self._set(target_id, record)
+                self._commit([(target_id, record)])
+
+    def delete(self, target_id: str):
+        with self._lock:
+            if target_id in self._ensure():
+                self._set(target_id, None)
+                self._commit([(target_id, None)])
+
+    def rename(self, old_id: str, new_id: str, **fields) -> bool:
+        with self._lock:
+            data = self._ensure()
+            if old_id not in data:
+                return False
+            record = data[old_id].replace(**fields)
+            self._set(old_id, None)
+            self._set(new_id, record)
+            self._commit([(old_id, None), (new_id, record)])
+            return True
+
+    def count(self) -> int:
+        return len(self._state()[0])
+
+    def ids_for_owner(self, owner_id: int) -> list:
+        return list(self._state()[1].get(owner_id, ()))
+
+    def last_run_ids(self) -> list:
+        return list(self._state()[2])
+
+
+class JournaledOwnershipStore(OwnershipStore):
+    """
+    ownership.json as snapshot + ownership.json.journal (one JSON line per change).
+    - every change is a full record or a delete, so replay is idempotent
+    - lines are flushed immediately and fsynced in groups by a background thread
+    - once the journal passes JOURNAL_COMPACT_BYTES it is folded into the snapshot
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.journal_path = path + ".journal"
+        self._journal = None
+        self._unsynced = 0
+        self._thread = None
+
+    def _load(self) -> dict:
+        data = super()._load()
+        if not os.path.exists(self.journal_path):
+            return data
+        good = 0  # end of the last complete line
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("no newline")
+                    op = json.loads(line)
+                except ValueError:
+                    break  # torn tail from a crash mid-append
+                if op.get("r") is None:
+                    data.pop(op["t"], None)
+                else:
+                    data[op["t"]] = AppRecord.from_dict(op["r"])
+                good += len(line)
+        if good < os.path.getsize(self.journal_path):
+            # cut the torn tail, or the next append would be glued onto it and lost on replay
+            logger.warning(f"{self.journal_path}: dropping a torn tail after {good} bytes")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good)
+        return data
+
+    def _write_changes(self, changes):
+        with self._lock:
+            if self._journal is None:
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+            for tid, rec in changes:
+                rec = rec.to_dict() if rec is not None else None
+                self._journal.write(json.dumps({"t": tid, "r": rec}, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            self._unsynced += len(changes)
+            if self._unsynced >= JOURNAL_FSYNC_BATCH:
+                self._fsync()
+        self.version += 1
+        self._loaded_version = self.version
+        self._start_background()
+
+    def _fsync(self):
+        if self._journal is not None and self._unsynced:
+            os.fsync(self._journal.fileno())
+            self._unsynced = 0
+
+    def compact(self):
+        with self._lock:
+            self._ensure()
+            _write_json(self.path, self._dump())
+            self._sig = self._file_sig()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            with open(self.journal_path, "w", encoding="utf-8"):
+                pass
+            self._unsynced = 0
+
+    def flush(self):
+        with self._lock:
+            self._fsync()
+
+    def _start_background(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._background, name="ownership-journal", daemon=True)
+            self._thread.start()
+
+    def _background(self):
+        while True:
+            time.sleep(JOURNAL_FSYNC_INTERVAL_SEC)
+            try:
+                self.flush()
+                if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) >= JOURNAL_COMPACT_BYTES:
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Journal maintenance failed: {e}")
+
+
+# ================= SQLITE STORE =================
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS apps (
+    tid      TEXT PRIMARY KEY,
+    owner    INTEGER,
+    type     TEXT,
+    last_run INTEGER NOT NULL DEFAULT 0,
+    record   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_apps_owner ON apps(owner);
+CREATE INDEX IF NOT EXISTS idx_apps_last_run ON apps(last_run);
+CREATE INDEX IF NOT EXISTS idx_apps_type ON apps(type);
+CREATE TABLE IF NOT EXISTS users (
+    uid      INTEGER NOT NULL UNIQUE,
+    added_at INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class SqliteDB:
+    """
+    WAL mode: one writer connection behind `lock`, plus a small pool of read
+    connections shared by all threads (bot loop, Flask request threads) so
+    reads never wait on a writer.
+    """
+
+    READ_POOL = 4  # idle read connections kept open; extra ones are closed after use
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._depth = 0
+        self._tx_thread = None
+        self._idle = []  # pooled read connections, guarded by _pool_lock
+        self._pool_lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        """Re-entrant: only the outermost block issues BEGIN/COMMIT."""
+        with self.lock:
+            self._depth += 1
+            if self._depth == 1:
+                self.conn.execute("BEGIN")
+                self._tx_thread = threading.get_ident()
+            try:
+                yield
+            except Exception:
+                self._depth -= 1
+                if not self._depth:
+                    self._tx_thread = None
+                    self.conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if not self._depth:
+                self._tx_thread = None
+                self.conn.execute("COMMIT")
+
+    def query(self, sql: str, params=()):
+        # inside our own transaction we must read through the writer to see its changes
+        if self._tx_thread == threading.get_ident():
+            return self.conn.execute(sql, params).fetchall()
+        with self._pool_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            with self._pool_lock:
+                keep = len(self._idle) < self.READ_POOL
+                if keep:
+                    self._idle.append(conn)
+            if not keep:
+                conn.close()
+
+    def execute(self, sql: str, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).rowcount
+
+    def data_version(self) -> int:
+        """Changes when another connection commits. Read on the writer: the value is per connection."""
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get_meta(self, key: str):
+        rows = self.query("SELECT value FROM meta WHERE key=?", (key,))
+        return rows[0][0] if rows else None
+
+def _app_row(target_id: str, record: AppRecord):
+    return (
+        target_id,
+        record.owner,
+        record.type,
+        1 if record.last_run is True else 0,
+        json.dumps(record.to_dict(), ensure_ascii=False),
+    )
+
+class SqliteOwnershipStore:
+    """Same interface as OwnershipStore, backed by the `apps` table."""
+
+    def __init__(self, db: SqliteDB):
+        self.db = db
+
+    def all(self) -> dict:
+        rows = self.db.query("SELECT tid, record FROM apps ORDER BY rowid")
+        return {tid: AppRecord.from_dict(json.loads(rec)) for tid, rec in rows}
+
+    def get(self, target_id: str):
+        rows = self.db.query("SELECT record FROM apps WHERE tid=?", (target_id,))
+        return AppRecord.from_dict(json.loads(rows[0][0])) if rows else None
+
+    def put(self, target_id: str, record: AppRecord):
+        self.db.execute(
+            "INSERT INTO apps(tid, owner, type, last_run, record) VALUES (?,?,?,?,?) "
+            "ON CONFLICT(tid) DO UPDATE SET owner=excluded.owner, type=excluded.type, "
+            "last_run=excluded.last_run, record=excluded.record",
+            _app_row(target_id, record),
+        )
+
+    def update(self, target_id: str, **fields):
+        with self.db.lock:
+            rec = self.get(target_id)
+            if rec and rec.replace(**fields) != rec:
+                self.put(target_id, rec.replace(**fields))
+
+    def delete(self, target_id: str):
+        self.db.execute("DELETE FROM apps WHERE tid=?", (target_id,))
+
+    def rename(self, old_id: str, new_id: str, **fields) -> bool:
+        with self.db.lock:
+            rec = self.get(old_id)
+            if not rec:
+                return False
+            with self.db.transaction():
+                self.delete(old_id)
+                self.put(new_id, rec.replace(**fields))
+            return True
+
+    def batch(self):
+        return self.db.transaction()
+
+    @contextmanager
+    def deferred(self, delay: float = BOOT_STORE_FLUSH_SEC):
+        yield self  # every write is one row already
+
+    def count(self) -> int:
+        return self.db.query("SELECT COUNT(*) FROM apps")[0][0]
+
+    def ids_for_owner(self, owner_id: int) -> list:
+        return [r[0] for r in self.db.query("SELECT tid FROM apps WHERE owner=? ORDER BY rowid", (owner_id,))]
+
+    def last_run_ids(self) -> list:
+        return [r[0] for r in self.db.query("SELECT tid FROM apps WHERE last_run=1 ORDER BY rowid")]
+
+class SqliteUserStore:
+    """Same interface as UserStore, backed by the `users` table."""
+
+    def __init__(self, db: SqliteDB):
+        self.db = db
+
+    def all(self) -> list:
+        return [r[0] for r in self.db.query("SELECT uid FROM users ORDER BY rowid")]
+
+    def add(self, uid: int) -> bool:
+        return self.db.execute("INSERT OR IGNORE INTO users(uid, added_at) VALUES (?,?)", (uid, int(time.time()))) > 0
+
+    def remove(self, uid: int) -> bool:
+        return self.db.execute("DELETE FROM users WHERE uid=?", (uid,)) > 0
+
+    def stamp(self):
+        # bumps when another connection commits; our own writes invalidate explicitly
+        return self.db.data_version()
+
+def migrate_json_to_sqlite(db: SqliteDB):
+    """One-time import of ownership.json / allowed_users.json (files are left in place)."""
+    if db.get_meta("json_migrated"):
+        return
+    apps = _read_json(OWNERSHIP_FILE, {})
+    users = _read_json(USERS_FILE, [])
+    with db.transaction():
+        db.conn.executemany(
+            "INSERT OR REPLACE INTO apps(tid, owner, type, last_run, record) VALUES (?,?,?,?,?)",
+            [_app_row(tid, AppRecord.from_dict(rec)) for tid, rec in apps.items()],
+        )
+        db.conn.executemany(
+            "INSERT OR IGNORE INTO users(uid, added_at) VALUES (?,?)",
+            [(uid, int(time.time())) for uid in users],
+        )
+        db.conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('json_migrated', ?)", (str(int(time.time())),))
+    logger.info(f"Migrated {len(apps)} apps and {len(users)} users from JSON into {db.path}.")
+
+
+# ================= STORAGE BACKEND =================
+def open_storage(backend: str):
+    if backend == "sqlite":
+        db = SqliteDB(SQLITE_PATH)
+        migrate_json_to_sqlite(db)
+        return SqliteOwnershipStore(db), SqliteUserStore(db)
+    if backend == "journal":
+        store = JournaledOwnershipStore(OWNERSHIP_FILE)
+        atexit.register(store.flush)
+        return store, UserStore(USERS_FILE)
+    if backend != "json":
+        logger.warning(f"Unknown STORAGE_BACKEND={backend!r}, using json.")
+    return OwnershipStore(OWNERSHIP_FILE), UserStore(USERS_FILE)
+
+ownership_store, users_store = open_storage(STORAGE_BACKEND)
+
+class AllowedUsersCache:
+    """frozenset of allowed ids for `restricted`; rebuilt on add/remove or when the backend stamp changes."""
+
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.reloads = 0
+        self._users = None
+        self._stamp = None
+
+    def invalidate(self):
+        self._users = None
+
+    def users(self) -> frozenset:
+        stamp = self.store.stamp()
+        if self._users is None or stamp != self._stamp:
+            self._users = frozenset(self.store.all())
+            self._stamp = stamp
+            self.reloads += 1
+        else:
+            self.hits += 1
+        return self._users
+
+    def is_allowed(self, uid: int) -> bool:
+        return uid in self.users()
+
+allowed_users_cache = AllowedUsersCache(users_store)
+
+def get_allowed_users():
+    return users_store.all()
+
+def save_allowed_user(uid: int) -> bool:
+    added = users_store.add(uid)
+    allowed_users_cache.invalidate()
+    return added
+
+def remove_allowed_user(uid: int) -> bool:
+    removed = users_store.remove(uid)
+    allowed_users_cache.invalidate()
+    return removed
 
 def load_ownership():
-    return _read_json(OWNERSHIP_FILE, {})
+    return ownership_store.all()
 
-def save_ownership_record(target_id: str, record: dict):
-    data = load_ownership()
-    data[target_id] = record
-    _write_json(OWNERSHIP_FILE, data)
+def save_ownership_record(target_id: str, record: AppRecord):
+    ownership_store.put(target_id, record)
 
 def delete_ownership(target_id: str):
-    data = load_ownership()
-    if target_id in data:
-        del data[target_id]
-        _write_json(OWNERSHIP_FILE, data)
+    ownership_store.delete(target_id)
 
 def get_owner(target_id: str):
-    return load_ownership().get(target_id, {}).get("owner")
+    rec = ownership_store.get(app_id(target_id))
+    return rec.owner if rec else None
 
 def get_app_key(target_id: str):
-    return load_ownership().get(target_id, {}).get("key")
-
-def set_last_run(target_id: str, value: bool):
-    data = load_ownership()
-    if target_id in data:
-        data[target_id]["last_run"] = bool(value)
-        _write_json(OWNERSHIP_FILE, data)
+    rec = ownership_store.get(app_id(target_id))
+    return rec.key if rec else None
 
 def get_entry(target_id: str):
-    return load_ownership().get(target_id, {}).get("entry")
+    rec = ownership_store.get(target_id)
+    return rec.entry if rec else None
 
 
 # ================= PATH RESOLUTION =================
@@ -204,7 +1094,127 @@ def list_files_safe(work_dir: str, max_files: int = 400):
 
 
 # ================= RUN COMMAND DETECTION =================
+class RunCommandCache:
+    """
+    resolve_run_command results per (work_dir, entry), reused while a cheap
+    fingerprint is unchanged: mtime_ns of the directory, package.json and the
+    entry file. Uploads, dependency installs and clones also invalidate the
+    work_dir explicitly, for changes the fingerprint can't see (nested files).
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}  # {(work_dir, entry): (fingerprint, (cmd, chosen))}
+
+    @staticmethod
+    def fingerprint(work_dir: str, script_rel):
+        def mtime(path):
+            try:
+                return os.stat(path).st_mtime_ns
+            except OSError:
+                return None
+
+        return (
+            mtime(work_dir),
+            mtime(os.path.join(work_dir, "package.json")),
+            mtime(os.path.join(work_dir, script_rel)) if script_rel else None,
+        )
+
+    def resolve(self, work_dir: str, script_rel):
+        key = (os.path.abspath(work_dir), script_rel)
+        fp = self.fingerprint(work_dir, script_rel)
+        hit = self._cache.get(key)
+        if hit is None or hit[0] != fp:
+            self.misses += 1
+            hit = (fp, _resolve_run_command(work_dir, script_rel))
+            self._cache[key] = hit
+        else:
+            self.hits += 1
+        cmd, chosen = hit[1]
+        return (list(cmd) if cmd else cmd), chosen  # callers get their own argv list
+
+    def invalidate(self, work_dir: str = None):
+        if work_dir is None:
+            self._cache.clear()
+            return
+        work_dir = os.path.abspath(work_dir)
+        for key in [k for k in self._cache if k[0] == work_dir]:
+            del self._cache[key]
+
+run_command_cache = RunCommandCache()
+
 def resolve_run_command(work_dir: str, script_rel: str | None):
+    return run_command_cache.resolve(work_dir, script_rel)
+
+# anything a plain argv can't express; such commands need a shell (or `npm start`)
+SHELL_CHARS = set("|&;<>()$`\\*?[]#~{}!\n")
+NPM_RUNNERS = ("npm", "npx", "yarn", "pnpm")
+
+def plain_argv(work_dir: str, command: str, reject: tuple = ()):
+    """
+    The argv a shell would exec for `command`, with node_modules/.bin resolved,
+    or None if it needs a shell, runs one of `reject`, or the program isn't found.
+    Leading VAR=value assignments go through `env`, which execs the command
+    (no process stays behind).
+    """
+    if any(c in SHELL_CHARS for c in command):
+        return None
+    try:
+        tokens = shlex.split(command)
+    except ValueError:
+        return None
+
+    assigns = []
+    while tokens and "=" in tokens[0] and tokens[0].split("=", 1)[0].isidentifier():
+        assigns.append(tokens.pop(0))
+    if not tokens or tokens[0] in reject:
+        return None
+
+    prog = tokens[0]
+    if "/" not in prog:
+        local = os.path.join(work_dir, "node_modules", ".bin", prog)
+        if os.path.exists(local):
+            tokens[0] = os.path.abspath(local)
+        elif shutil.which(prog) is None:
+            return None
+    return (["env"] + assigns + tokens) if assigns else tokens
+
+def npm_start_argv(work_dir: str, scripts: dict) -> list:
+    """
+    Reduce scripts.start to the argv npm would end up exec'ing (see plain_argv).
+    Hooks, shell syntax, nested runners and unknown programs fall back to
+    ["npm", "start"], which also lets npm report a missing program.
+    """
+    if not NPM_DIRECT_EXEC or "prestart" in scripts or "poststart" in scripts:
+        return ["npm", "start"]
+    return plain_argv(work_dir, scripts.get("start") or "", reject=NPM_RUNNERS) or ["npm", "start"]
+
+def npm_script_env(work_dir: str, base_path: str) -> dict:
+    """The environment `npm start` would add (lifecycle vars, node_modules/.bin on PATH)."""
+    pkg = os.path.join(work_dir, "package.json")
+    pkgj = _read_json(pkg, {})
+    return {
+        "PATH": os.path.abspath(os.path.join(work_dir, "node_modules", ".bin")) + os.pathsep + base_path,
+        "npm_command": "start",
+        "npm_lifecycle_event": "start",
+        "npm_lifecycle_script": (pkgj.get("scripts") or {}).get("start", ""),
+        "npm_package_name": str(pkgj.get("name", "")),
+        "npm_package_version": str(pkgj.get("version", "")),
+        "npm_package_json": os.path.abspath(pkg),
+        "INIT_CWD": os.path.abspath(work_dir),
+    }
+
+npm_launches = {}  # {tid: "direct" | "npm"} for apps started from package.json
+npm_wrapper_rss_mb = deque(maxlen=50)  # measured RSS of npm processes wrapping apps
+
+def npm_saving_mb() -> float:
+    """Estimated RSS of the npm process a direct launch avoids."""
+    if npm_wrapper_rss_mb:
+        return sum(npm_wrapper_rss_mb) / len(npm_wrapper_rss_mb)
+    return NPM_WRAPPER_RSS_MB
+
+def _resolve_run_command(work_dir: str, script_rel: str | None):
     pkg = os.path.join(work_dir, "package.json")
     if os.path.exists(pkg):
         try:
@@ -212,7 +1222,7 @@ def resolve_run_command(work_dir: str, script_rel: str | None):
                 pkgj = json.load(f)
             scripts = pkgj.get("scripts", {})
             if "start" in scripts and (script_rel is None or script_rel.endswith(".js")):
-                return ["npm", "start"], None
+                return npm_start_argv(work_dir, scripts), None
         except Exception:
             pass
 
@@ -239,6 +1249,771 @@ def resolve_run_command(work_dir: str, script_rel: str | None):
     return None, None
 
 
+# ================= PROCFILE =================
+formations = {}  # {tid: [instance key, ...]} launched for Procfile apps
+
+def parse_procfile(work_dir: str) -> dict:
+    """{process type: command} from work_dir/Procfile (`type: command` lines), in file order."""
+    types = {}
+    try:
+        with open(os.path.join(work_dir, "Procfile"), encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or ":" not in line:
+                    continue
+                name, cmd = (part.strip() for part in line.split(":", 1))
+                if re.fullmatch(r"[A-Za-z0-9_-]+", name) and cmd:
+                    types[name] = cmd
+    except OSError:
+        pass
+    return types
+
+def procfile_types(tid: str) -> dict:
+    """Process types of a repo app with a Procfile; {} = it runs its entry file."""
+    if not is_repo_id(tid) or app_id(tid) != tid:
+        return {}
+    rec = ownership_store.get(tid)
+    if rec is None or rec.procfile is False:
+        return {}
+    return parse_procfile(resolve_paths(tid)[0])
+
+def replica_count(tid: str, ptype: str) -> int:
+    rec = ownership_store.get(tid)
+    return int(((rec.scale if rec else None) or {}).get(ptype, 1))
+
+def desired_instances(tid: str) -> list:
+    """Instance keys the app's Procfile and scale ask for."""
+    return [
+        instance_key(tid, ptype, n)
+        for ptype in procfile_types(tid)
+        for n in range(1, replica_count(tid, ptype) + 1)
+    ]
+
+def owner_instances(owner, tid: str = None, scale: dict = None) -> int:
+    """Procfile instances the owner's apps ask for, counting `scale` for tid instead of its record."""
+    total = 0
+    for app in ownership_store.ids_for_owner(owner):
+        rec = ownership_store.get(app)
+        app_scale = scale if app == tid else ((rec.scale if rec else None) or {})
+        total += sum(int(app_scale.get(ptype, 1)) for ptype in procfile_types(app))
+    return total
+
+def app_process_keys(tid: str) -> list:
+    """running_processes keys the app is supervised under."""
+    return formations.get(tid) or [tid]
+
+def procfile_argv(work_dir: str, command: str) -> list:
+    """A Procfile command as argv: exec'd directly when plain, else through sh."""
+    return plain_argv(work_dir, command) or ["/bin/sh", "-c", command]
+
+
+# ================= CGROUPS =================
+class CgroupManager:
+    """
+    Two levels under CGROUP_ROOT: owner-<id> (cpu.weight from owner_weights,
+    OWNER_MEMORY_MAX_MB / OWNER_PIDS_MAX over all of the owner's apps)
+    holding one app-<id> leaf per app (limits from the app record), so under
+    contention each owner gets a share by weight however many apps they run.
+    setup() decides once whether the tree is usable; if not, every method is a
+    no-op and apps run exactly as before (only watchdog alerts, no limits).
+    """
+
+    CONTROLLERS = ("cpu", "memory", "pids")
+    CPU_PERIOD_USEC = 100000
+
+    def __init__(self, root: str, enabled: bool = True):
+        self.root = root
+        self.enabled = enabled
+        self.controllers = set()
+        self._ready = None
+        self._cpu_samples = {}  # {tid: (usage_usec, monotonic)}
+        self.overlapping = set()  # tids whose leaf holds two generations (blue/green)
+
+    @staticmethod
+    def _read(path: str) -> str:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+
+    @staticmethod
+    def _write(path: str, value: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(value)
+
+    def _enable_controllers(self, path: str):
+        available = set(self._read(os.path.join(path, "cgroup.controllers")).split())
+        for c in self.CONTROLLERS:
+            if c in available:
+                try:
+                    self._write(os.path.join(path, "cgroup.subtree_control"), f"+{c}")
+                except OSError:
+                    pass  # e.g. the parent still holds processes (no-internal-process rule)
+
+    def setup(self) -> bool:
+        if self._ready is not None:
+            return self._ready
+        self._ready = False
+        if not self.enabled:
+            return False
+        parent = os.path.dirname(self.root.rstrip("/"))
+        try:
+            if not os.path.exists(os.path.join(parent, "cgroup.controllers")):
+                raise OSError(f"{parent} is not a cgroup v2 directory")
+            self._enable_controllers(parent)
+            os.makedirs(self.root, exist_ok=True)
+            self._enable_controllers(self.root)
+            self.controllers = set(self._read(os.path.join(self.root, "cgroup.subtree_control")).split())
+            self._ready = True
+            logger.info(f"cgroups: {self.root} (controllers: {' '.join(sorted(self.controllers)) or 'none'})")
+        except OSError as e:
+            logger.warning(f"cgroups unavailable ({e}); apps run without resource limits.")
+        return self._ready
+
+    def owner_path(self, owner) -> str:
+        return os.path.join(self.root, f"owner-{owner if owner is not None else 'none'}")
+
+    def path(self, tid: str) -> str:
+        return os.path.join(self.owner_path(get_owner(tid)), "app-" + safe_q(tid))
+
+    def apply_owner_weight(self, owner):
+        """Create/refresh the owner's parent group; returns its path or None."""
+        if not self.setup():
+            return None
+        path = self.owner_path(owner)
+        try:
+            os.makedirs(path, exist_ok=True)
+            self._enable_controllers(path)
+        except OSError as e:
+            logger.error(f"cgroup for owner {owner} not created: {e}")
+            return None
+        settings = {
+            "cpu.weight": str(owner_weights.get(owner)),
+            "memory.max": str(OWNER_MEMORY_MAX_MB * 1024 * 1024) if OWNER_MEMORY_MAX_MB else "max",
+            "pids.max": str(OWNER_PIDS_MAX) if OWNER_PIDS_MAX else "max",
+        }
+        for name, value in settings.items():
+            if name.split(".", 1)[0] not in self.controllers:
+                continue
+            try:
+                self._write(os.path.join(path, name), value)
+            except OSError as e:
+                logger.error(f"{name} for owner {owner} failed: {e}")
+        return path
+
+    def limits_for(self, tid: str) -> dict:
+        rec = ownership_store.get(app_id(tid))
+
+        def pick(field, default):
+            value = getattr(rec, field) if rec else None
+            return default if value is None else value
+
+        cpu = pick("cpu_max", APP_CPU_MAX_PERCENT)
+        mem = pick("memory_max_mb", APP_MEMORY_MAX_MB)
+        high = pick("memory_high_mb", APP_MEMORY_HIGH_MB)
+        pids = pick("pids_max", APP_PIDS_MAX)
+        if not high and mem:
+            high = int(mem * 0.9)  # throttle/reclaim before the OOM killer steps in
+        if tid in self.overlapping:
+            cpu, mem, high, pids = cpu * 2, mem * 2, high * 2, pids * 2
+        return {
+            "cpu.max": f"{int(cpu * self.CPU_PERIOD_USEC / 100)} {self.CPU_PERIOD_USEC}" if cpu else f"max {self.CPU_PERIOD_USEC}",
+            "memory.max": str(int(mem) * 1024 * 1024) if mem else "max",
+            "memory.high": str(int(high) * 1024 * 1024) if high else "max",
+            "pids.max": str(int(pids)) if pids else "max",
+        }
+
+    def prepare(self, tid: str):
+        """Create/refresh the app's leaf and return its cgroup.procs path (None = unconfined)."""
+        owner_path = self.apply_owner_weight(get_owner(tid))
+        if owner_path is None:
+            return None
+        path = self.path(tid)
+        try:
+            os.makedirs(path, exist_ok=True)
+            leaf_controllers = set(self._read(os.path.join(owner_path, "cgroup.subtree_control")).split())
+        except OSError as e:
+            logger.error(f"cgroup for {tid} not created: {e}")
+            return None
+        self._write_limits(tid, path, leaf_controllers)
+        self._cpu_samples.pop(tid, None)
+        return os.path.join(path, "cgroup.procs")
+
+    def _write_limits(self, tid: str, path: str, leaf_controllers: set):
+        for name, value in self.limits_for(tid).items():
+            if name.split(".", 1)[0] not in leaf_controllers:
+                continue
+            try:
+                self._write(os.path.join(path, name), value)
+            except OSError as e:
+                logger.error(f"cgroup {name}={value} for {tid} failed: {e}")
+
+    @contextmanager
+    def overlap(self, tid: str):
+        """
+        Blue/green: the new instance joins the running one's leaf, so its limits
+        are doubled until the block exits (the owner's memory.max / pids.max still
+        cap the pair); otherwise the switch itself could throttle or OOM-kill the app.
+        """
+        self.overlapping.add(tid)
+        try:
+            yield
+        finally:
+            self.overlapping.discard(tid)
+            path = self.path(tid)
+            if self._ready and os.path.isdir(path):
+                try:
+                    leaf_controllers = set(self._read(os.path.join(os.path.dirname(path), "cgroup.subtree_control")).split())
+                except OSError as e:
+                    logger.error(f"cgroup limits for {tid} not restored: {e}")
+                else:
+                    self._write_limits(tid, path, leaf_controllers)
+
+    def contains(self, tid: str, pid: int) -> bool:
+        try:
+            return str(pid) in self._read(os.path.join(self.path(tid), "cgroup.procs")).split()
+        except OSError:
+            return False
+
+    def usage(self, tid: str):
+        """{"cpu_percent", "memory_mb", "pids", "procs"} from the leaf's files; None without a leaf or memory accounting."""
+        if not self._ready or "memory" not in self.controllers:
+            return None
+        path = self.path(tid)
+        try:
+            stat = dict(line.split() for line in self._read(os.path.join(path, "cpu.stat")).splitlines())
+            usec, now = int(stat["usage_usec"]), time.monotonic()
+            mem = int(self._read(os.path.join(path, "memory.current")))
+            pids = int(self._read(os.path.join(path, "pids.current"))) if "pids" in self.controllers else None
+            procs = len(self._read(os.path.join(path, "cgroup.procs")).split())
+        except (OSError, KeyError, ValueError):
+            return None
+        prev = self._cpu_samples.get(tid)
+        self._cpu_samples[tid] = (usec, now)
+        cpu = 0.0
+        if prev and now > prev[1]:
+            cpu = (usec - prev[0]) / ((now - prev[1]) * 1e6) * 100
+        return {"cpu_percent": cpu, "memory_mb": mem / (1024 * 1024), "pids": pids, "procs": procs}
+
+    def remove(self, tid: str):
+        self._cpu_samples.pop(tid, None)
+        if not self._ready:
+            return
+        path = self.path(tid)
+        try:
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"cgroup for {tid} not removed: {e}")
+            return
+        try:
+            os.rmdir(os.path.dirname(path))  # owner group, once its last app is gone
+        except OSError:
+            pass
+
+cgroups = CgroupManager(CGROUP_ROOT, ENABLE_CGROUPS)
+
+
+# ================= SCHEDULING =================
+IONICE_CLASSES = {"rt": psutil.IOPRIO_CLASS_RT, "be": psutil.IOPRIO_CLASS_BE, "idle": psutil.IOPRIO_CLASS_IDLE}
+
+class CoreSpreader:
+    """
+    Core placement for apps with cpus="auto[:N]": new apps go to the least
+    loaded cores, and rebalance() moves one app per watchdog pass from the
+    hottest to the coldest core. Load is an EWMA of the watchdog's CPU samples,
+    split evenly over an app's cores. Apps with an explicit CPU list count
+    toward their cores' load but are never moved.
+    """
+
+    def __init__(self, alpha: float = 0.5):
+        self.alpha = alpha
+        self.load = {}       # {tid: cpu % (100 = one core)}
+        self.placement = {}  # {tid: [core, ...]}
+        self.fixed = set()
+
+    @staticmethod
+    def cores() -> list:
+        return sorted(os.sched_getaffinity(0))
+
+    def core_loads(self, exclude=None) -> dict:
+        loads = {c: [0.0, 0] for c in self.cores()}
+        for tid, cores in self.placement.items():
+            if tid == exclude:
+                continue
+            share = self.load.get(tid, 0.0) / len(cores)
+            for c in cores:
+                if c in loads:
+                    loads[c][0] += share
+                    loads[c][1] += 1
+        return loads
+
+    def place(self, tid: str, n: int = 1) -> list:
+        loads = self.core_loads(exclude=tid)
+        # by load, then by app count so a cold start doesn't stack everything on core 0
+        chosen = sorted(loads, key=lambda c: (loads[c][0], loads[c][1], c))[:max(1, n)]
+        self.placement[tid] = sorted(chosen)
+        self.fixed.discard(tid)
+        return self.placement[tid]
+
+    def pin(self, tid: str, cores: list):
+        self.placement[tid] = list(cores)
+        self.fixed.add(tid)
+
+    def sample(self, tid: str, cpu_percent: float):
+        if tid in self.placement:
+            prev = self.load.get(tid)
+            self.load[tid] = cpu_percent if prev is None else prev + self.alpha * (cpu_percent - prev)
+
+    def forget(self, tid: str):
+        self.placement.pop(tid, None)
+        self.load.pop(tid, None)
+        self.fixed.discard(tid)
+
+    def rebalance(self) -> list:
+        """Returns [(tid, new cores)] to apply; at most one move per call."""
+        loads = {c: v[0] for c, v in self.core_loads().items()}
+        if len(loads) < 2:
+            return []
+        hot, cold = max(loads, key=loads.get), min(loads, key=loads.get)
+        gap = loads[hot] - loads[cold]
+        if gap < SPREAD_IMBALANCE_PERCENT:
+            return []
+        best = None
+        for tid, cores in self.placement.items():
+            if tid in self.fixed or hot not in cores or cold in cores:
+                continue
+            share = self.load.get(tid, 0.0) / len(cores)
+            if not 0 < share < gap:
+                continue  # moving it wouldn't narrow the gap
+            score = abs(gap / 2 - share)
+            if best is None or score < best[0]:
+                best = (score, tid)
+        if best is None:
+            return []
+        tid = best[1]
+        self.placement[tid] = sorted(cold if c == hot else c for c in self.placement[tid])
+        return [(tid, self.placement[tid])]
+
+core_spreader = CoreSpreader()
+
+def get_sched_settings(tid: str):
+    """(nice, ionice, cores) for the next launch of tid; None = inherit from the bot."""
+    rec = ownership_store.get(app_id(tid))
+    if rec is None:
+        return None, None, None
+    cpus, cores = rec.cpus, None
+    if cpus is None and instance_name(tid) and replica_count(app_id(tid), instance_name(tid).split(".")[0]) > 1:
+        cpus = "auto"  # replicas of one type go to different cores
+    if isinstance(cpus, str) and cpus.startswith("auto"):
+        cores = core_spreader.place(tid, int(cpus.split(":", 1)[1]) if ":" in cpus else 1)
+    elif cpus:
+        available = set(core_spreader.cores())
+        cores = [c for c in cpus if c in available]
+        if cores:
+            core_spreader.pin(tid, cores)
+        else:
+            logger.warning(f"{tid}: none of cpus {cpus} are available to the bot; not pinning.")
+    if not cores:
+        core_spreader.forget(tid)
+    return rec.nice, rec.ionice, cores
+
+def apply_ionice(pid: int, spec: str):
+    cls, _, level = spec.partition(":")
+    try:
+        if cls == "idle":
+            psutil.Process(pid).ionice(IONICE_CLASSES[cls])
+        else:
+            psutil.Process(pid).ionice(IONICE_CLASSES[cls], value=int(level or 4))
+    except (psutil.Error, OSError, ValueError, KeyError) as e:
+        logger.warning(f"ionice {spec} for pid {pid} failed: {e}")
+
+def set_app_affinity(tid: str, cores: list):
+    """Re-pin a running app and all its descendants."""
+    rp = running_processes.get(tid)
+    if rp is None:
+        return
+    try:
+        leader = psutil.Process(rp.process.pid)
+        procs = [leader] + leader.children(recursive=True)
+    except psutil.Error:
+        return
+    for p in procs:
+        try:
+            p.cpu_affinity(cores)
+        except psutil.Error:
+            pass
+
+def make_preexec(cgroup_procs: str = None, nice: int = None, cores: list = None):
+    """
+    Child-side setup between fork and exec: own session, join the app's cgroup,
+    then priority and affinity (inherited by everything the app forks).
+    Failures are swallowed: the parent logs what it can check, and a launch
+    should not fail over a placement hint.
+    """
+    def preexec():
+        os.setsid()
+        if cgroup_procs:
+            try:
+                with open(cgroup_procs, "w") as f:
+                    f.write(str(os.getpid()))
+            except OSError:
+                pass
+        if nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, nice)
+            except OSError:
+                pass  # lowering nice needs CAP_SYS_NICE
+        if cores:
+            try:
+                os.sched_setaffinity(0, cores)
+            except OSError:
+                pass
+    return preexec
+
+
+# ================= PROXY =================
+class AppProxy:
+    """
+    Public port of a web app -> 127.0.0.1:backend. The backend is read per
+    connection, so switching it moves new connections at once while the open
+    ones finish on the instance they started with.
+    Without a backend the app is asleep (scaled to zero): the next connection
+    wakes it and is held, like any connection arriving during a cold start,
+    until `ready` (the start's readiness probe) completes.
+    """
+
+    def __init__(self, tid: str, port: int, backend: int = None):
+        self.tid = tid
+        self.port = port
+        self.backend = backend
+        self.server = None
+        self.active = 0
+        self.total = 0
+        self.last_activity = time.time()
+        self.ready = None  # future/task of a start or stop in progress
+
+    @property
+    def sleeping(self) -> bool:
+        return self.backend is None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, PROXY_HOST, self.port, reuse_address=True)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    async def _handle(self, reader, writer):
+        self.active += 1
+        self.total += 1
+        self.last_activity = time.time()
+        upstream = None
+        try:
+            if self.ready is not None and not self.ready.done():
+                await asyncio.shield(self.ready)  # going to sleep or starting up
+            if self.sleeping:
+                await wake_app(self.tid)
+                if self.ready is not None:
+                    await asyncio.shield(self.ready)
+            if self.sleeping:
+                return
+            try:
+                up_reader, upstream = await asyncio.open_connection("127.0.0.1", self.backend)
+            except OSError:
+                return
+            await asyncio.gather(_pipe(reader, upstream), _pipe(up_reader, writer))
+        finally:
+            self.active -= 1
+            self.last_activity = time.time()
+            for w in (upstream, writer):
+                if w is not None:
+                    w.close()
+
+async def _pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()  # half-close, e.g. the client finished its request body
+    except (ConnectionError, OSError, RuntimeError):
+        pass
+
+proxies = {}  # {target_id: AppProxy}
+
+def port_taken(tid: str, port: int):
+    """Who already uses `port` (the bot's web server, or another app's public/backend port), or None."""
+    if port == int(os.environ.get("PORT", 8080)):
+        return "the bot's web server"
+    for other, rec in ownership_store.all().items():
+        if other != tid and port in (rec.port, rec.backend_port):
+            return other
+    return None
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def ensure_proxy(tid: str, backend: int):
+    """Point the app's proxy at backend (None = asleep), (re)binding the public port if needed."""
+    rec = ownership_store.get(tid)
+    port = rec.port if rec else None
+    px = proxies.get(tid)
+    if px is not None and px.port != port:
+        await close_proxy(tid)
+        px = None
+    if not port:
+        return None
+    if px is None:
+        px = AppProxy(tid, port, backend)
+        try:
+            await px.start()
+        except OSError as e:
+            logger.error(f"Proxy for {tid} could not listen on {PROXY_HOST}:{port}: {e}")
+            return None
+        proxies[tid] = px
+    if backend is not None and px.sleeping:
+        px.last_activity = time.time()  # idle clock restarts when the app comes up
+    px.backend = backend
+    return px
+
+async def close_proxy(tid: str):
+    px = proxies.pop(tid, None)
+    if px is not None:
+        await px.close()
+
+async def restore_proxies():
+    """Boot: re-open proxies for adopted web apps (their backend port is in the record)."""
+    for tid in list(running_processes.keys()):
+        rec = ownership_store.get(tid)
+        if rec and rec.port and rec.backend_port:
+            await ensure_proxy(tid, rec.backend_port)
+
+def is_on_demand(tid: str) -> bool:
+    rec = ownership_store.get(tid)
+    return bool(rec and rec.on_demand and rec.port and not procfile_types(tid))
+
+def is_sleeping(tid: str) -> bool:
+    px = proxies.get(tid)
+    return px is not None and px.sleeping
+
+async def probe_ready(proc, port: int, path: str = None, timeout: float = BLUE_GREEN_READY_TIMEOUT_SEC) -> bool:
+    """Wait until 127.0.0.1:port accepts a connection (and answers `path` with a status < 500)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), 2)
+            try:
+                if not path:
+                    return True
+                writer.write(f"GET {path} HTTP/1.0\r\nHost: localhost\r\n\r\n".encode())
+                await writer.drain()
+                status = (await asyncio.wait_for(reader.readline(), 5)).split()
+                if len(status) >= 2 and status[1].isdigit() and int(status[1]) < 500:
+                    return True
+            finally:
+                writer.close()
+        except (OSError, asyncio.TimeoutError):
+            pass
+        await asyncio.sleep(0.25)
+    return False
+
+
+# ================= READINESS =================
+ready_times = {}     # {tid: deque of seconds from launch to ready}
+ready_failures = {}  # {tid: number of starts that never became ready}
+ready_waits = {}     # {tid: task} readiness check of the app's current start
+
+def percentile(values, p: float) -> float:
+    """Nearest-rank percentile of a non-empty sequence."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def ready_summary(tid: str) -> str:
+    times = ready_times.get(tid)
+    fails = ready_failures.get(tid, 0)
+    if not times:
+        return f"never ready ({fails} failed)" if fails else ""
+    text = (
+        f"last {times[-1]:.2f}s · p50 {percentile(times, 50):.2f}s · "
+        f"p95 {percentile(times, 95):.2f}s (n={len(times)})"
+    )
+    return text + (f", {fails} failed" if fails else "")
+
+def app_log_offset(tid: str) -> int:
+    """Current size of the app's log, so a readiness check only reads what the new start writes."""
+    try:
+        return os.path.getsize(os.path.join(UPLOAD_DIR, f"{tid.replace('|','_')}.log"))
+    except OSError:
+        return 0
+
+LOG_MATCHER_SCRIPT = (
+    "import json, re, sys\n"
+    "regex = re.compile(sys.argv[1])\n"
+    "for batch in sys.stdin:\n"
+    "    print(int(any(regex.search(line) for line in json.loads(batch))), flush=True)\n"
+)
+
+class LogMatcher:
+    """
+    A ready_log regex run in a child python. re can backtrack for seconds
+    on a bad pattern and holds the GIL meanwhile, so no thread of the bot
+    may run it; the child is killed when a batch outlasts READY_LOG_MATCH_SEC.
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.proc = None
+
+    async def _exchange(self, batch: bytes) -> bytes:
+        self.proc.stdin.write(batch)
+        await self.proc.stdin.drain()
+        return await self.proc.stdout.readline()
+
+    async def search(self, lines: list) -> bool:
+        """True if any line matches; ValueError if the pattern is too slow (the matcher is gone then)."""
+        if self.proc is None:
+            self.proc = await asyncio.create_subprocess_exec(
+                sys.executable, "-I", "-c", LOG_MATCHER_SCRIPT, self.pattern,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        try:
+            reply = await asyncio.wait_for(self._exchange(json.dumps(lines).encode() + b"\n"), READY_LOG_MATCH_SEC)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise ValueError(f"matching took over {READY_LOG_MATCH_SEC:g}s")
+        except (BrokenPipeError, ConnectionResetError):
+            reply = b""
+        if reply.strip() not in (b"0", b"1"):
+            await self.close()
+            raise ValueError("matcher exited")
+        return reply.strip() == b"1"
+
+    async def close(self):
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+            await self.proc.wait()
+
+async def wait_for_log(proc, log_path: str, offset: int, pattern: str, deadline: float) -> bool:
+    """Wait for a log line after `offset` that matches pattern."""
+    try:
+        _regex(pattern)  # also re-checks patterns stored before the limits existed
+    except ValueError as e:
+        logger.error(f"ready_log {pattern!r} not used: {e}")
+        return False
+    matcher = LogMatcher(pattern)
+    try:
+        return await _wait_for_log(proc, log_path, offset, matcher, deadline)
+    except ValueError as e:
+        logger.error(f"ready_log {pattern!r} not used: {e}")
+        return False
+    finally:
+        await matcher.close()
+
+async def _wait_for_log(proc, log_path: str, offset: int, matcher: LogMatcher, deadline: float) -> bool:
+    loop = asyncio.get_running_loop()
+    pending = ""
+    while loop.time() < deadline:
+        try:
+            with open(log_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < offset:
+                    offset = 0  # log was cleared
+                f.seek(offset)
+                chunk = f.read(1 << 20)
+        except OSError:
+            chunk = b""
+        offset += len(chunk)
+        *lines, pending = (pending + chunk.decode("utf-8", errors="ignore")).split("\n")
+        pending = pending[-READY_LOG_MAX_LINE:]
+        lines = [line[:READY_LOG_MAX_LINE] for line in lines]
+        if lines and await matcher.search(lines):
+            return True
+        if proc.poll() is not None:
+            return False
+        await asyncio.sleep(0.25)
+    return False
+
+async def wait_alive(proc, until: float, deadline: float) -> bool:
+    """True if proc is still running at wall-clock time `until` (given up at loop time `deadline`)."""
+    loop = asyncio.get_running_loop()
+    while time.time() < until:
+        if proc.poll() is not None or loop.time() >= deadline:
+            return False
+        await asyncio.sleep(0.2)
+    return proc.poll() is None
+
+async def wait_ready(tid: str, proc, log_path: str, log_offset: int, t0: float,
+                     backend: int = None, timeout: float = READY_TIMEOUT_SEC) -> bool:
+    """
+    Every configured signal must pass within the app's ready_timeout_sec (or timeout):
+    the web app's $PORT (backend, plus health_path), ready_port, ready_log and
+    ready_after_sec. An app with none of them is ready once alive for BOOT_READY_SEC.
+    """
+    rec = ownership_store.get(app_id(tid))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ((rec.ready_timeout_sec if rec else None) or timeout)
+    if backend and not await probe_ready(proc, backend, rec.health_path if rec else None, deadline - loop.time()):
+        return False
+    ready_port = rec.ready_port if rec and (instance_name(tid) or "web.").startswith("web.") else None
+    if ready_port and not await probe_ready(proc, ready_port, None, deadline - loop.time()):
+        return False
+    if rec and rec.ready_log and not await wait_for_log(proc, log_path, log_offset, rec.ready_log, deadline):
+        return False
+    alive = rec.ready_after_sec if rec else None
+    if alive is None and not (backend or ready_port or (rec and rec.ready_log)):
+        alive = BOOT_READY_SEC
+    if alive and not await wait_alive(proc, t0 + alive, deadline):
+        return False
+    return proc.poll() is None
+
+async def track_ready(tid: str, proc, log_path: str, log_offset: int, t0: float,
+                      backend: int = None, timeout: float = READY_TIMEOUT_SEC):
+    """
+    Readiness check of one start (run as ready_waits[tid]): seconds from launch to
+    ready, recorded in the app's history, or None. Checks of starts that were
+    stopped or replaced meanwhile don't count as failures.
+    """
+    ok = await wait_ready(tid, proc, log_path, log_offset, t0, backend, timeout)
+    why = f"exited with code {proc.poll()}" if proc.poll() is not None else "timed out"
+    return record_ready(tid, ok, t0, f"pid {proc.pid} {why}")
+
+async def track_formation_ready(tid: str, launches: dict, t0: float):
+    """track_ready for a Procfile app: ready once every launched instance is."""
+    results = await asyncio.gather(*(
+        wait_ready(key, proc, log_path, log_offset, t0)
+        for key, (proc, log_path, log_offset) in launches.items()
+    ))
+    not_ready = [instance_name(key) for key, ok in zip(launches, results) if not ok]
+    return record_ready(tid, not not_ready, t0, f"{', '.join(not_ready)} not ready")
+
+def record_ready(tid: str, ok: bool, t0: float, why: str):
+    if ok:
+        elapsed = time.time() - t0
+        ready_times.setdefault(tid, deque(maxlen=READY_HISTORY)).append(elapsed)
+        logger.info(f"{tid}: ready in {elapsed:.2f}s")
+        return elapsed
+    if ready_waits.get(tid) is asyncio.current_task():
+        ready_failures[tid] = ready_failures.get(tid, 0) + 1
+        logger.error(f"{tid}: never became ready ({why})")
+    return None
+
+def start_ready_check(tid: str, proc, log_path: str, log_offset: int, t0: float,
+                      backend: int = None, timeout: float = READY_TIMEOUT_SEC):
+    task = spawn_background(track_ready(tid, proc, log_path, log_offset, t0, backend, timeout))
+    ready_waits[tid] = task
+    return task
+
+
 # ================= PROCESS MANAGEMENT =================
 def build_env(env_path: str):
     custom_env = os.environ.copy()
@@ -252,19 +2027,506 @@ def build_env(env_path: str):
                 custom_env[k.strip()] = v.strip().strip('"').strip("'")
     return custom_env
 
-def restart_process_background(target_id: str):
-    work_dir, script_path, env_path, _, _ = resolve_paths(target_id)
+class AdoptedProcess:
+    """
+    Popen-like handle for an app process left running by a previous bot instance.
+    It is not our child, so the real exit status is unknown; poll() reports 255
+    once it is gone (same convention asyncio uses for unknown statuses).
+    """
+
+    def __init__(self, proc: "psutil.Process"):
+        self._proc = proc
+        self.pid = proc.pid
+        self.returncode = None
 
-    # stop previous
-    if target_id in running_processes:
+    def poll(self):
+        if self.returncode is None:
+            try:
+                gone = not self._proc.is_running() or self._proc.status() == psutil.STATUS_ZOMBIE
+            except psutil.Error:
+                gone = True
+            if gone:
+                self.returncode = 255
+        return self.returncode
+
+    def wait(self, timeout=None):
         try:
-            os.killpg(os.getpgid(running_processes[target_id]["process"].pid), signal.SIGTERM)
-        except Exception:
+            self._proc.wait(timeout)
+        except psutil.NoSuchProcess:
+            pass
+        except psutil.TimeoutExpired:
+            raise subprocess.TimeoutExpired(str(self.pid), timeout)
+        self.returncode = 255 if self.returncode is None else self.returncode
+        return self.returncode
+
+def adopt_running_apps() -> int:
+    """
+    Boot: re-attach to last_run apps whose recorded process is still alive.
+    A pid only counts if its create_time and process group match what we saved,
+    so a recycled pid is never mistaken for the app.
+    """
+    def adoptable(pid, pgid, create_time):
+        try:
+            proc = psutil.Process(pid)
+            if abs(proc.create_time() - (create_time or 0)) > 0.01:
+                return None
+            if os.getpgid(pid) != pgid or proc.status() == psutil.STATUS_ZOMBIE:
+                return None
+        except (psutil.Error, OSError):
+            return None
+        return proc
+
+    def adopt(key, proc, started_at):
+        log_path = os.path.join(UPLOAD_DIR, f"{key.replace('|','_')}.log")
+        handle = AdoptedProcess(proc)
+        running_processes[key] = RuntimeEntry(handle, log_path, started_at or time.time())
+        exit_watcher.watch(key, handle)
+
+    adopted = 0
+    for tid in ownership_store.last_run_ids():
+        rec = ownership_store.get(tid)
+        if not rec or tid in running_processes:
+            continue
+        if rec.instances:
+            # Procfile app: instances that died meanwhile are restarted by the watchdog
+            formations[tid] = list(rec.instances)
+            for key, (pid, started_at, create_time) in rec.instances.items():
+                proc = adoptable(pid, pid, create_time)
+                if proc is not None:
+                    adopt(key, proc, started_at)
+                    adopted += 1
+            continue
+        if not rec.pid:
+            continue
+        proc = adoptable(rec.pid, rec.pgid, rec.create_time)
+        if proc is None:
+            continue
+        adopt(tid, proc, rec.started_at)
+        adopted += 1
+    if adopted:
+        logger.info(f"Adopted {adopted} running app(s) from the previous instance.")
+    return adopted
+
+class ExitWatcher:
+    """
+    Delivers an ExitEvent the moment a launched app dies, instead of waiting for
+    the next poll() scan. Uses os.pidfd_open + loop.add_reader per process; when
+    pidfds aren't available it falls back to a SIGCHLD handler (children only).
+    Processes launched before the loop runs (boot) are attached in start().
+    Handles with reports_exit=True (zygote children) skip the pidfd: their
+    owner calls notify_exit() once the real exit status is known.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.use_pidfd = hasattr(os, "pidfd_open")
+        self._watched = {}  # pid -> [tid, proc, pidfd or None]
+        self._listeners = []
+
+    def start(self, loop):
+        self.loop = loop
+        if self.use_pidfd:
+            for pid, (_, proc, _) in list(self._watched.items()):
+                if not getattr(proc, "reports_exit", False):
+                    self._attach(pid)
+        else:
+            loop.add_signal_handler(signal.SIGCHLD, self._on_sigchld)
+        logger.info(f"Exit watcher started ({'pidfd' if self.use_pidfd else 'SIGCHLD'}).")
+
+    def subscribe(self, callback):
+        """callback(ExitEvent), called on the loop thread."""
+        self._listeners.append(callback)
+
+    def watch(self, tid: str, proc):
+        self._watched[proc.pid] = [tid, proc, None]
+        if getattr(proc, "reports_exit", False):
+            if proc.poll() is not None and self.loop is not None:
+                self.loop.call_soon(self._on_exit, proc.pid)  # exited before we got here
+        elif self.loop is not None and self.use_pidfd:
+            self._attach(proc.pid)
+
+    def notify_exit(self, pid: int):
+        self._on_exit(pid)
+
+    def reattach(self, pid: int):
+        """The handle stopped reporting its own exit; fall back to a pidfd."""
+        w = self._watched.get(pid)
+        if w is not None and w[2] is None and self.loop is not None and self.use_pidfd:
+            self._attach(pid)
+
+    def watching(self, proc) -> bool:
+        """True if an exit of `proc` will be reported without polling."""
+        w = self._watched.get(proc.pid)
+        if w is None or w[1] is not proc or self.loop is None:
+            return False
+        return w[2] is not None or isinstance(proc, subprocess.Popen) or getattr(proc, "reports_exit", False)
+
+    def unwatch(self, pid: int):
+        w = self._watched.pop(pid, None)
+        if w and w[2] is not None:
+            self.loop.remove_reader(w[2])
+            os.close(w[2])
+
+    def _attach(self, pid: int):
+        try:
+            fd = os.pidfd_open(pid)
+        except OSError:
+            # already gone (or not permitted): report now
+            self._on_exit(pid)
+            return
+        self._watched[pid][2] = fd
+        self.loop.add_reader(fd, self._on_exit, pid)
+
+    def _on_sigchld(self):
+        for pid, (tid, proc, _) in list(self._watched.items()):
+            if isinstance(proc, subprocess.Popen) and proc.poll() is not None:
+                self._on_exit(pid)
+
+    def _on_exit(self, pid: int):
+        w = self._watched.get(pid)
+        if w is None:
+            return
+        tid, proc, _ = w
+        self.unwatch(pid)
+        rc = proc.poll()  # reaps Popen children
+        rp = running_processes.get(tid)
+        if rp is not None and rp.process is proc:
+            rp.exit_code = rc
+        ev = ExitEvent(tid, pid, rc)
+        for cb in self._listeners:
+            try:
+                cb(ev)
+            except Exception as e:
+                logger.error(f"Exit listener failed for {tid}: {e}")
+
+exit_watcher = ExitWatcher()
+
+class ZygoteProcess(AdoptedProcess):
+    """
+    Handle for an app forked by the zygote. The zygote is the real parent: it
+    reaps the app and sends the exit status, which ZygoteClient stores in
+    returncode before notifying exit_watcher. If the zygote itself goes away
+    the handle degrades to AdoptedProcess behaviour (pidfd, 255).
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode = None
+        self.reports_exit = True
+        try:
+            self._proc = psutil.Process(pid)
+        except psutil.Error:
+            self._proc = None
+
+    def poll(self):
+        if self.returncode is None and not self.reports_exit:
+            if self._proc is None:
+                self.returncode = 255
+            return super().poll()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self._proc is None:
+            return self.poll()
+        return super().wait(timeout)
+
+class ZygoteClient:
+    """
+    Bot side of zygote.py: started on first use, requests/replies as JSON lines,
+    reply and exit events read with loop.add_reader. Restarted lazily if it dies;
+    its orphaned apps keep running and are watched via pidfd instead.
+    """
+
+    def __init__(self):
+        self.proc = None
+        self.children = {}  # pid -> ZygoteProcess
+        self._pending = {}  # request id -> future
+        self._next_id = 0
+        self._buf = b""
+        self.spawns = 0
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        env = os.environ.copy()
+        env["ZYGOTE_PRELOAD"] = ZYGOTE_PRELOAD
+        self.proc = subprocess.Popen(
+            [ZYGOTE_PYTHON, "-u", os.path.join(os.path.dirname(os.path.abspath(__file__)), "zygote.py")],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+        self._buf = b""
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        asyncio.get_running_loop().add_reader(self.proc.stdout.fileno(), self._on_readable)
+        logger.info(f"Zygote started (pid {self.proc.pid}, preload: {ZYGOTE_PRELOAD}).")
+
+    def _on_readable(self):
+        try:
+            chunk = os.read(self.proc.stdout.fileno(), 65536)
+        except BlockingIOError:
+            return
+        if not chunk:
+            self._on_eof()
+            return
+        self._buf += chunk
+        while b"\n" in self._buf:
+            line, self._buf = self._buf.split(b"\n", 1)
+            try:
+                self._on_message(json.loads(line))
+            except Exception as e:
+                logger.error(f"Zygote message failed: {e}")
+
+    def _on_message(self, msg: dict):
+        if msg.get("event") == "exit":
+            child = self.children.pop(msg["pid"], None)
+            if child is not None:
+                child.returncode = msg["returncode"]
+                exit_watcher.notify_exit(child.pid)
+            return
+        fut = self._pending.pop(msg.get("id"), None)
+        if fut is None or fut.done():
+            return
+        if "pid" in msg:
+            # register before anything else reads the stream: its exit may be next
+            child = ZygoteProcess(msg["pid"])
+            self.children[child.pid] = child
+            fut.set_result(child)
+        else:
+            fut.set_exception(RuntimeError(msg.get("error", "zygote error")))
+
+    def _on_eof(self):
+        asyncio.get_running_loop().remove_reader(self.proc.stdout.fileno())
+        try:
+            self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+        logger.warning(f"Zygote exited ({self.proc.returncode}); {len(self.children)} app(s) fall back to pidfd watching.")
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(RuntimeError("zygote exited"))
+        self._pending.clear()
+        for child in self.children.values():
+            child.reports_exit = False
+            exit_watcher.reattach(child.pid)
+        self.children.clear()
+        self.proc = None
+
+    async def spawn(self, script: str, cwd: str, env: dict, log: str, cgroup_procs=None, nice=None, cores=None):
+        if not self.alive():
+            self.start()
+        self._next_id += 1
+        rid = self._next_id
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        req = {
+            "id": rid, "op": "spawn", "script": script, "cwd": cwd, "env": env, "log": log,
+            "cgroup_procs": cgroup_procs, "nice": nice, "cores": cores,
+        }
+        try:
+            self.proc.stdin.write((json.dumps(req) + "\n").encode())
+            self.proc.stdin.flush()
+            child = await asyncio.wait_for(fut, ZYGOTE_SPAWN_TIMEOUT_SEC)
+        finally:
+            self._pending.pop(rid, None)
+        self.spawns += 1
+        return child
+
+    def stop(self):
+        if self.alive():
+            self.proc.stdin.close()  # EOF: the zygote exits, apps keep running
+
+zygote = ZygoteClient()
+
+def zygote_script(cmd: list):
+    """The script path if cmd is a plain `python -u script.py` the zygote can run."""
+    if ZYGOTE_ENABLED and len(cmd) == 3 and cmd[0] == "python" and cmd[1] == "-u" and cmd[2].endswith(".py"):
+        return cmd[2]
+    return None
+
+RESTART_POLICIES = ("always", "on-failure", "never")
+
+class RestartState:
+    """Auto-restart bookkeeping for one app (in memory; a bot restart gives a fresh start)."""
+
+    __slots__ = ("restarts", "attempt", "next_at", "quarantined", "task")
+
+    def __init__(self):
+        self.restarts = deque()  # timestamps of recent auto-restarts
+        self.attempt = 0
+        self.next_at = 0.0
+        self.quarantined = False
+        self.task = None  # pending delayed restart
+
+restart_states = {}  # {target_id: RestartState}
+
+def reset_restart_state(target_id: str):
+    """Manual start/stop: forget backoff and lift a crash-loop quarantine (of every instance)."""
+    for key in [target_id] + formations.get(target_id, []):
+        st = restart_states.pop(key, None)
+        if st and st.task:
+            st.task.cancel()
+
+def get_restart_policy(target_id: str) -> str:
+    rec = ownership_store.get(app_id(target_id))
+    policy = rec.restart_policy if rec else None
+    return policy if policy in RESTART_POLICIES else "always"
+
+def backoff_delay(attempt: int) -> float:
+    delay = min(RESTART_BACKOFF_MAX_SEC, RESTART_BACKOFF_BASE_SEC * (2 ** attempt))
+    return delay * (1 + random.uniform(0, RESTART_BACKOFF_JITTER))
+
+class LifecycleQueue:
+    """
+    Runs each app's lifecycle operations (start/restart/wake/sleep/stop/delete)
+    one at a time, in order. Asking for the same op as the last queued one joins
+    it instead of adding another, so a burst of requests runs it once. The
+    running op is never joined: it may have read the state the new request
+    changed, so the request queues behind it. A stop or delete drops queued
+    starts, which then report False.
+    """
+
+    SUPERSEDED_BY = {
+        "stop": {"start", "restart", "wake", "sleep"},
+        "delete": {"start", "restart", "wake", "sleep", "stop"},
+    }
+
+    def __init__(self):
+        self.current = {}  # {tid: (op, future)} being run
+        self.queued = {}   # {tid: deque[(op, fn, future)]}
+        self.workers = {}  # {tid: task} draining that app's queue
+
+    def busy(self, tid: str) -> bool:
+        return tid in self.current or bool(self.queued.get(tid))
+
+    def describe(self, tid: str) -> str:
+        ops = []
+        if tid in self.current:
+            ops.append(f"{self.current[tid][0]} (running)")
+        ops += [op for op, _, _ in self.queued.get(tid) or ()]
+        return " → ".join(ops)
+
+    async def run(self, tid: str, op: str, fn):
+        """Queue fn (a coroutine function) as op for tid and await its result."""
+        q = self.queued.setdefault(tid, deque())
+        if q and q[-1][0] == op:
+            fut = q[-1][2]
+        else:
+            drop = self.SUPERSEDED_BY.get(op, ())
+            for item in [item for item in q if item[0] in drop]:
+                q.remove(item)
+                item[2].set_result(False)
+            fut = asyncio.get_running_loop().create_future()
+            q.append((op, fn, fut))
+            if tid not in self.workers:
+                self.workers[tid] = spawn_background(self._drain(tid))
+        # the op carries on even if the caller (e.g. a Telegram handler) is cancelled
+        return await asyncio.shield(fut)
+
+    async def _drain(self, tid: str):
+        q = self.queued[tid]
+        try:
+            while q:
+                op, fn, fut = q.popleft()
+                self.current[tid] = (op, fut)
+                try:
+                    if op != "delete" and ownership_store.get(tid) is None:
+                        result = False  # deleted while this was queued
+                    else:
+                        result = await fn()
+                except Exception as e:
+                    logger.error(f"{tid}: {op} failed: {e}")
+                    result = False
+                finally:
+                    self.current.pop(tid, None)
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            self.workers.pop(tid, None)
+            if not q:
+                self.queued.pop(tid, None)
+
+lifecycle = LifecycleQueue()
+
+def is_running(target_id: str) -> bool:
+    rp = running_processes.get(target_id)
+    if rp is None:
+        # a Procfile app runs while any of its instances does
+        return any(is_running(key) for key in formations.get(target_id, ()))
+    if exit_watcher.watching(rp.process):
+        return rp.exit_code is None
+    return rp.process.poll() is None
+
+def _proc_gone(p: "psutil.Process") -> bool:
+    # reaps the zombie if it happens to be our child (e.g. orphans when we run as PID 1)
+    try:
+        if p.status() != psutil.STATUS_ZOMBIE:
+            return not p.is_running()
+    except psutil.NoSuchProcess:
+        return True
+    try:
+        os.waitpid(p.pid, os.WNOHANG)
+    except ChildProcessError:
+        pass
+    return True
+
+async def _wait_group_gone(proc, members: list, timeout: float) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        members = [p for p in members if not _proc_gone(p)]
+        if proc.poll() is not None and not members:
+            return True
+        if loop.time() >= deadline:
+            return False
+        await asyncio.sleep(0.1)
+
+def _signal_group(pgid: int, members: list, sig):
+    try:
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+    # descendants that left the group (their own setsid) still belong to the app
+    for p in members:
+        try:
+            p.send_signal(sig)
+        except psutil.Error:
             pass
 
+async def terminate_app_process(proc, grace: float) -> bool:
+    """
+    SIGTERM the app's process group, wait up to `grace`, escalate to SIGKILL,
+    and reap everything. Returns True once the leader and all descendants are gone.
+    """
+    pgid = proc.pid  # apps run under setsid, so the leader's pid is the group id
+    try:
+        members = psutil.Process(proc.pid).children(recursive=True)
+    except psutil.Error:
+        members = []
+    _signal_group(pgid, members, signal.SIGTERM)
+    if await _wait_group_gone(proc, members, grace):
+        return True
+    logger.warning(f"pid {proc.pid} still alive {grace:.0f}s after SIGTERM; sending SIGKILL")
+    _signal_group(pgid, members, signal.SIGKILL)
+    return await _wait_group_gone(proc, members, STOP_KILL_WAIT_SEC)
+
+def get_stop_grace(target_id: str) -> float:
+    rec = ownership_store.get(app_id(target_id))
+    grace = rec.stop_grace_sec if rec else None
+    return STOP_GRACE_SEC if grace is None else float(grace)
+
+async def spawn_app(target_id: str, extra_env: dict = None):
+    """Launch a new instance without registering it. Returns (proc, log_path, started_at) or None."""
+    work_dir, script_path, env_path, _, _ = resolve_paths(target_id)
     entry = get_entry(target_id)
+    name = instance_name(target_id)
 
-    if is_repo_id(target_id):
+    if name:
+        command = procfile_types(app_id(target_id)).get(name.split(".")[0])
+        cmd, chosen = (procfile_argv(work_dir, command) if command else None), ""
+        extra_env = {"DYNO": name, **(extra_env or {})}
+    elif is_repo_id(target_id):
         cmd, chosen = resolve_run_command(work_dir, entry)
     elif is_user_file_id(target_id):
         cmd, chosen = resolve_run_command(work_dir, script_path)
@@ -273,61 +2535,355 @@ def restart_process_background(target_id: str):
 
     if not cmd:
         logger.error("No runnable entry found.")
-        return
+        return None
 
     # persist chosen for repo
-    if is_repo_id(target_id):
-        data = load_ownership()
-        if target_id in data:
-            data[target_id]["entry"] = chosen
-            _write_json(OWNERSHIP_FILE, data)
+    if is_repo_id(target_id) and not name:
+        ownership_store.update(target_id, entry=chosen)
 
     os.makedirs(work_dir, exist_ok=True)
     custom_env = build_env(env_path)
+    if chosen is None:  # package.json start script
+        npm_launches[target_id] = "npm" if cmd[0] == "npm" else "direct"
+        if cmd[0] != "npm":
+            custom_env.update(npm_script_env(work_dir, custom_env.get("PATH", "")))
+    custom_env.update(extra_env or {})
 
     log_path = os.path.join(UPLOAD_DIR, f"{target_id.replace('|','_')}.log")
     log_file = open(log_path, "a", encoding="utf-8")
+    cgroup_procs = cgroups.prepare(target_id)
+    nice, ionice, cores = get_sched_settings(target_id)
 
     try:
-        proc = subprocess.Popen(
-            cmd,
-            env=custom_env,
-            stdout=log_file,
-            stderr=subprocess.STDOUT,
-            cwd=work_dir,
-            preexec_fn=os.setsid,
-        )
-        running_processes[target_id] = {
-            "process": proc,
-            "log": log_path,
-            "started_at": time.time(),
-            "last_alert": 0,
-        }
-        set_last_run(target_id, True)
+        proc = None
+        script = zygote_script(cmd)
+        if script:
+            try:
+                proc = await zygote.spawn(
+                    script, os.path.abspath(work_dir), custom_env, os.path.abspath(log_path), cgroup_procs, nice, cores,
+                )
+            except Exception as e:
+                logger.error(f"Zygote spawn of {target_id} failed ({e}); starting it directly.")
+        if proc is None:
+            proc = subprocess.Popen(
+                cmd,
+                env=custom_env,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                cwd=work_dir,
+                preexec_fn=make_preexec(cgroup_procs, nice, cores),
+            )
+        started_at = time.time()
+        if ionice:
+            apply_ionice(proc.pid, ionice)
+        if cgroup_procs and not cgroups.contains(target_id, proc.pid):
+            logger.warning(f"{target_id} (pid {proc.pid}) could not join its cgroup; running unconfined.")
+        return proc, log_path, started_at
     except Exception as e:
         logger.error(f"Failed to start: {e}")
+        return None
+    finally:
+        log_file.close()
+
+def register_instance(target_id: str, proc, log_path: str, started_at: float, backend_port: int = None):
+    """Make proc the app's live instance: process table, exit watching, persisted pid."""
+    running_processes[target_id] = RuntimeEntry(proc, log_path, started_at)
+    exit_watcher.watch(target_id, proc)
+    try:
+        create_time = psutil.Process(proc.pid).create_time()
+    except psutil.Error:
+        create_time = None
+    tid = app_id(target_id)
+    if tid != target_id:
+        rec = ownership_store.get(tid)
+        instances = dict((rec.instances if rec else None) or {})
+        instances[target_id] = [proc.pid, started_at, create_time]
+        ownership_store.update(tid, last_run=True, instances=instances)
+        return
+    ownership_store.update(
+        target_id, last_run=True,
+        pid=proc.pid, pgid=proc.pid, started_at=started_at, create_time=create_time,
+        backend_port=backend_port,
+    )
+
+async def blue_green_restart(target_id: str, old) -> bool:
+    """
+    Web apps: start the new instance on a fresh $PORT next to the old one, wait
+    for its readiness probe, switch the proxy, then stop the old process group.
+    If the probe fails the new instance is killed and the old one keeps serving.
+    Both share the app's cgroup leaf meanwhile, with its limits doubled.
+    """
+    with cgroups.overlap(target_id):
+        backend = free_port()
+        t0, log_offset = time.time(), app_log_offset(target_id)
+        launched = await spawn_app(target_id, {"PORT": str(backend)})
+        if launched is None:
+            return False
+        proc, log_path, started_at = launched
+        check = start_ready_check(target_id, proc, log_path, log_offset, t0, backend, BLUE_GREEN_READY_TIMEOUT_SEC)
+        if not await asyncio.shield(check):
+            logger.error(f"{target_id}: new instance (pid {proc.pid}) not ready on port {backend}; rolling back.")
+            ready_waits.pop(target_id, None)  # the old instance is still the ready one
+            await terminate_app_process(proc, get_stop_grace(target_id))
+            return False
+
+        exit_watcher.unwatch(old.process.pid)
+        await ensure_proxy(target_id, backend)  # new connections go to the new instance from here
+        register_instance(target_id, proc, log_path, started_at, backend)
+        logger.info(f"{target_id}: switched to pid {proc.pid} on port {backend}; stopping pid {old.process.pid}.")
+        if not await terminate_app_process(old.process, get_stop_grace(target_id)):
+            logger.error(f"Old instance of {target_id} (pid {old.process.pid}) survived SIGKILL.")
+        return True
+
+async def restart_process_background(target_id: str) -> bool:
+    """(Re)start the app; True once a new instance is live."""
+    return await lifecycle.run(target_id, "restart", lambda: _restart_app(target_id))
+
+async def _restart_app(target_id: str) -> bool:
+    if instance_name(target_id):
+        return await start_instance(target_id) is not None
+    if procfile_types(target_id):
+        await stop_entry_process(target_id)  # was running its entry file until now
+        return await restart_formation(target_id)
+    await stop_formation(target_id)  # Procfile removed or switched off
+    rec = ownership_store.get(target_id)
+    port = rec.port if rec else None
+    rp = running_processes.get(target_id)
+    if port and rp is not None and is_running(target_id):
+        return await blue_green_restart(target_id, rp)
+
+    # stop previous, and don't start the new instance until it is really gone
+    ready_waits.pop(target_id, None)
+    if rp is not None:
+        exit_watcher.unwatch(rp.process.pid)
+        if not await terminate_app_process(rp.process, get_stop_grace(target_id)):
+            logger.error(f"Previous instance of {target_id} (pid {rp.process.pid}) would not die; not starting a new one.")
+            return False
+
+    backend = free_port() if port else None
+    t0, log_offset = time.time(), app_log_offset(target_id)
+    launched = await spawn_app(target_id, {"PORT": str(backend)} if backend else None)
+    if launched is None:
+        return False
+    register_instance(target_id, *launched, backend_port=backend)
+    check = start_ready_check(
+        target_id, launched[0], launched[1], log_offset, t0,
+        backend, COLD_START_TIMEOUT_SEC if port else READY_TIMEOUT_SEC,
+    )
+    if port:
+        px = await ensure_proxy(target_id, backend)
+        if px is not None:
+            # connections arriving before the app listens wait for this instead of being refused
+            px.ready = check
+    return True
+
+async def start_instance(key: str):
+    """(Re)start one instance of a Procfile app. Returns (proc, log_path, log_offset) or None."""
+    rp = running_processes.get(key)
+    if rp is not None:
+        exit_watcher.unwatch(rp.process.pid)
+        if not await terminate_app_process(rp.process, get_stop_grace(key)):
+            logger.error(f"Previous {key} (pid {rp.process.pid}) would not die; not starting a new one.")
+            return None
+    log_offset = app_log_offset(key)
+    launched = await spawn_app(key)
+    if launched is None:
+        return None
+    register_instance(key, *launched)
+    return launched[0], launched[1], log_offset
+
+async def stop_instance(key: str):
+    """Stop one instance and forget it (table, persisted pid, cgroup, placement)."""
+    st = restart_states.pop(key, None)
+    if st and st.task:
+        st.task.cancel()
+    rp = running_processes.get(key)
+    if rp is not None:
+        exit_watcher.unwatch(rp.process.pid)
+        if not await terminate_app_process(rp.process, get_stop_grace(key)):
+            logger.error(f"{key} (pid {rp.process.pid}) survived SIGKILL.")
+        if running_processes.get(key) is rp:
+            del running_processes[key]
+    tid = app_id(key)
+    rec = ownership_store.get(tid)
+    if rec and rec.instances and key in rec.instances:
+        instances = {k: v for k, v in rec.instances.items() if k != key}
+        ownership_store.update(tid, instances=instances or None)
+    cgroups.remove(key)
+    core_spreader.forget(key)
+    usage_sampler.forget(key)
+
+async def launch_instances(tid: str, keys: list) -> bool:
+    """Start keys of a Procfile app and track their readiness as one start of the app."""
+    t0 = time.time()
+    results = await asyncio.gather(*(start_instance(key) for key in keys))
+    launches = {key: r for key, r in zip(keys, results) if r is not None}
+    if not launches:
+        return not keys
+    ready_waits[tid] = spawn_background(track_formation_ready(tid, launches, t0))
+    return True
+
+async def restart_formation(tid: str) -> bool:
+    """Procfile app: (re)start the instances its Procfile and scale ask for, stop any others."""
+    ready_waits.pop(tid, None)
+    wanted = desired_instances(tid)
+    if not wanted:
+        # every type scaled to 0: nothing to supervise, so the app is stopped rather than "down"
+        logger.warning(f"{tid}: every Procfile process type is scaled to 0; not starting it.")
+        await _stop_app(tid)
+        return False
+    await asyncio.gather(*(stop_instance(key) for key in set(formations.get(tid, [])) - set(wanted)))
+    formations[tid] = wanted
+    return await launch_instances(tid, wanted)
+
+async def scale_app(tid: str) -> bool:
+    """Apply a changed scale to a running Procfile app; untouched instances keep running."""
+    return await lifecycle.run(tid, "scale", lambda: _scale_app(tid))
+
+async def _scale_app(tid: str) -> bool:
+    wanted = desired_instances(tid)
+    if not is_running(tid) or formations.get(tid) == wanted:
+        return True
+    if not wanted:
+        await _stop_app(tid)  # scaled to nothing: stopped (last_run off), not crashed
+        return True
+    await asyncio.gather(*(stop_instance(key) for key in formations.get(tid, []) if key not in wanted))
+    formations[tid] = wanted
+    return await launch_instances(tid, [key for key in wanted if not is_running(key)])
+
+async def retire_instance(key: str):
+    """An instance that exited for good (restart policy): drop it; the app stops with its last one."""
+    tid = app_id(key)
+
+    async def retire():
+        await stop_instance(key)
+        formations[tid] = [k for k in formations.get(tid, []) if k != key]
+        if not formations[tid]:
+            await _stop_app(tid)
+        return True
+
+    return await lifecycle.run(tid, f"stop {instance_name(key)}", retire)
 
-def stop_process(target_id: str):
-    if target_id in running_processes:
+async def wake_app(tid: str) -> bool:
+    """Start a sleeping app; a burst of connections joins the same wake."""
+    return await lifecycle.run(tid, "wake", lambda: _wake_app(tid))
+
+async def _wake_app(tid: str) -> bool:
+    if not is_sleeping(tid):
+        return is_running(tid)  # woken (or stopped) meanwhile
+    logger.info(f"{tid}: connection while asleep; starting it")
+    reset_restart_state(tid)
+    return await _restart_app(tid)
+
+async def sleep_app(tid: str) -> bool:
+    """
+    Scale to zero: stop the process but keep last_run and the listening proxy,
+    so the next connection starts it again.
+    """
+    return await lifecycle.run(tid, "sleep", lambda: _sleep_app(tid))
+
+async def _sleep_app(tid: str) -> bool:
+    px = proxies.get(tid) or await ensure_proxy(tid, None)
+    if px is None:
+        return False
+    done = asyncio.get_running_loop().create_future()
+    px.ready = done  # connections arriving meanwhile wait, then wake it again
+    try:
+        px.backend = None
+        reset_restart_state(tid)
+        ready_waits.pop(tid, None)
+        rp = running_processes.get(tid)
+        if rp is not None:
+            exit_watcher.unwatch(rp.process.pid)
+            if not await terminate_app_process(rp.process, get_stop_grace(tid)):
+                logger.error(f"{tid} (pid {rp.process.pid}) survived SIGKILL.")
+            if running_processes.get(tid) is rp:
+                del running_processes[tid]
+        ownership_store.update(tid, pid=None, pgid=None, started_at=None, create_time=None, backend_port=None)
+        cgroups.remove(tid)
+        core_spreader.forget(tid)
+        usage_sampler.forget(tid)
+    finally:
+        done.set_result(None)
+    return True
+
+async def stop_process(target_id: str):
+    return await lifecycle.run(target_id, "stop", lambda: _stop_app(target_id))
+
+async def _stop_app(target_id: str):
+    # mark stopped first so the watchdog doesn't race us with a restart
+    reset_restart_state(target_id)
+    ready_waits.pop(target_id, None)
+    ownership_store.update(
+        target_id, last_run=False, pid=None, pgid=None, started_at=None, create_time=None, backend_port=None,
+    )
+    await stop_formation(target_id)
+    await stop_entry_process(target_id)
+    return True
+
+async def stop_formation(tid: str):
+    """Stop every Procfile instance of the app and forget its formation."""
+    await asyncio.gather(*(stop_instance(key) for key in formations.pop(tid, [])))
+    rec = ownership_store.get(tid)
+    if rec and rec.instances:
+        ownership_store.update(tid, instances=None)
+
+async def stop_entry_process(tid: str):
+    """Stop the app's single (entry file) process; forget its pid, cgroup, placement and proxy."""
+    rp = running_processes.get(tid)
+    if rp is not None:
+        exit_watcher.unwatch(rp.process.pid)
+        if not await terminate_app_process(rp.process, get_stop_grace(tid)):
+            logger.error(f"{tid} (pid {rp.process.pid}) survived SIGKILL.")
+        if running_processes.get(tid) is rp:
+            del running_processes[tid]
+    rec = ownership_store.get(tid)
+    if rec and rec.pid:
+        ownership_store.update(tid, pid=None, pgid=None, started_at=None, create_time=None, backend_port=None)
+    cgroups.remove(tid)
+    core_spreader.forget(tid)
+    usage_sampler.forget(tid)
+    await close_proxy(tid)
+
+async def delete_app(target_id: str):
+    """Stop the app, drop its record and remove its files."""
+    return await lifecycle.run(target_id, "delete", lambda: _delete_app(target_id))
+
+async def _delete_app(target_id: str):
+    await _stop_app(target_id)
+    delete_ownership(target_id)
+    ready_times.pop(target_id, None)
+    ready_failures.pop(target_id, None)
+
+    work_dir, script_path, _, _, _ = resolve_paths(target_id)
+    if is_repo_id(target_id):
+        shutil.rmtree(work_dir, ignore_errors=True)
+    elif is_user_file_id(target_id):
         try:
-            os.killpg(os.getpgid(running_processes[target_id]["process"].pid), signal.SIGTERM)
+            os.remove(os.path.join(work_dir, script_path))
         except Exception:
             pass
+    else:
         try:
-            del running_processes[target_id]
+            os.remove(os.path.join(UPLOAD_DIR, target_id))
         except Exception:
             pass
-    set_last_run(target_id, False)
+    return True
 
 def clear_log(target_id: str):
-    log_path = os.path.join(UPLOAD_DIR, f"{target_id.replace('|','_')}.log")
-    try:
-        with open(log_path, "w", encoding="utf-8") as f:
-            f.write("")
-    except Exception:
-        pass
+    for key in [target_id] + (formations.get(target_id) or desired_instances(target_id)):
+        log_path = os.path.join(UPLOAD_DIR, f"{key.replace('|','_')}.log")
+        try:
+            with open(log_path, "w", encoding="utf-8") as f:
+                f.write("")
+        except Exception:
+            pass
 
 def tail_log(target_id: str, lines: int = 50) -> str:
+    keys = formations.get(target_id) or desired_instances(target_id)
+    if keys:
+        # Procfile app: each instance logs to its own file
+        return "\n\n".join(f"── {instance_name(key)} ──\n{tail_log(key, lines)}" for key in keys)
     log_path = os.path.join(UPLOAD_DIR, f"{target_id.replace('|','_')}.log")
     if not os.path.exists(log_path):
         return "(no log file)"
@@ -338,14 +2894,94 @@ def tail_log(target_id: str, lines: int = 50) -> str:
     except Exception:
         return "(failed to read log)"
 
-def auto_start_last_run_apps():
-    data = load_ownership()
-    for tid, meta in data.items():
-        if meta.get("last_run") is True:
-            try:
-                restart_process_background(tid)
-            except Exception as e:
-                logger.error(f"Auto-start failed for {tid}: {e}")
+async def wait_until_ready(target_id: str) -> bool:
+    """Await the readiness check of the app's current start (see wait_ready)."""
+    check = ready_waits.get(target_id)
+    if check is None:
+        return is_running(target_id)
+    return await asyncio.shield(check) is not None
+
+def plan_start_batches(tids: list) -> list:
+    """
+    Split tids into batches of at most BOOT_CONCURRENCY: an app is only
+    scheduled once everything in its start_after (within tids) was scheduled in an
+    earlier batch; among those that are eligible, higher priority goes first.
+    Dependency cycles are broken by priority rather than blocking the boot.
+    """
+    recs = {tid: ownership_store.get(tid) for tid in tids}
+    order = {tid: i for i, tid in enumerate(tids)}
+    deps = {
+        tid: {d for d in ((rec.start_after or []) if rec else []) if d in recs and d != tid}
+        for tid, rec in recs.items()
+    }
+
+    def rank(tid):
+        rec = recs[tid]
+        return (-(rec.priority or 0) if rec else 0, order[tid])
+
+    batches, done, pending = [], set(), set(tids)
+    while pending:
+        ready = sorted((t for t in pending if deps[t] <= done), key=rank)
+        if not ready:
+            ready = sorted(pending, key=rank)  # cycle
+        batch = ready[:BOOT_CONCURRENCY]
+        batches.append(batch)
+        done.update(batch)
+        pending.difference_update(batch)
+    return batches
+
+# apps waiting for their turn in a staged start; the watchdog leaves them alone
+staged_pending = set()
+
+async def staged_start(tids: list, progress=None) -> tuple:
+    """
+    Start apps batch by batch; the next batch starts once the current one passed
+    its readiness check. progress(done, total, failed) is awaited after each batch.
+    """
+    batches = plan_start_batches(tids)
+    total, done, failed = len(tids), 0, []
+    staged_pending.update(tids)
+
+    async def start_one(tid):
+        staged_pending.discard(tid)
+        reset_restart_state(tid)
+        try:
+            await restart_process_background(tid)
+        except Exception as e:
+            logger.error(f"Auto-start failed for {tid}: {e}")
+            return False
+        return await wait_until_ready(tid)
+
+    try:
+        # one store write per BOOT_STORE_FLUSH_SEC instead of one per launch (no lock held
+        # across the awaits, unlike batch()); a crash loses at most that much of adoptable pids
+        with ownership_store.deferred():
+            for batch in batches:
+                results = await asyncio.gather(*(start_one(tid) for tid in batch))
+                done += len(batch)
+                failed += [tid for tid, ok in zip(batch, results) if not ok]
+                if progress:
+                    try:
+                        await progress(done, total, failed)
+                    except Exception as e:
+                        logger.error(f"Start progress report failed: {e}")
+    finally:
+        staged_pending.difference_update(tids)
+    return done, failed
+
+async def auto_start_last_run_apps(skip_running: bool = False, progress=None):
+    tids = [tid for tid in ownership_store.last_run_ids() if not (skip_running and is_running(tid))]
+    # stopped on-demand apps only get their listening proxy; the first connection starts them
+    sleepers = [tid for tid in tids if is_on_demand(tid) and not is_running(tid)]
+    for tid in sleepers:
+        await sleep_app(tid)
+    tids = [tid for tid in tids if tid not in sleepers]
+    if not tids:
+        return 0, []
+    logger.info(f"Starting {len(tids)} app(s), {BOOT_CONCURRENCY} at a time.")
+    done, failed = await staged_start(tids, progress)
+    logger.info(f"Started {done - len(failed)}/{done} app(s); not ready: {failed or 'none'}")
+    return done, failed
 
 
 # ================= DEP INSTALL =================
@@ -382,13 +3018,15 @@ async def install_dependencies(work_dir: str, update: Update):
     except Exception as e:
         if msg:
             await msg.edit_text(f"❌ Error: {e}")
+    finally:
+        run_command_cache.invalidate(work_dir)
 
 
 # ================= TELEGRAM DECORATORS =================
 def restricted(func):
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         uid = update.effective_user.id
-        if uid != ADMIN_ID and uid not in get_allowed_users():
+        if uid != ADMIN_ID and not allowed_users_cache.is_allowed(uid):
             await update.message.reply_text("⛔ Access Denied.")
             return
         return await func(update, context, *args, **kwargs)
@@ -439,7 +3077,9 @@ def status():
     if not real_key or key != real_key:
         return "⛔ Forbidden", 403
 
-    if script in running_processes and running_processes[script]["process"].poll() is None:
+    snap = running_processes.snapshot()
+    procs = [rp for key, rp in snap.items() if key == script or app_id(key) == script]
+    if any(rp.process.poll() is None for rp in procs):
         return f"✅ {script} is running.", 200
     return f"❌ {script} is stopped.", 404
 
@@ -514,6 +3154,127 @@ def run_flask():
 
 
 # ================= HEALTHCHECK + ALERTS (Feature F) =================
+class UsageSampler:
+    """
+    Whole-app totals instead of the leader pid alone: every process in the
+    app's session (apps run under setsid, so the leader's pid is the sid) plus
+    descendants that started their own session. CPU and memory come from the
+    app's cgroup when it has one, and then the processes are not walked at all
+    (threads from pids.current, FDs unknown); full samples always walk them.
+    """
+
+    def __init__(self):
+        self._cpu = {}  # {tid: ({pid: (create_time, cpu seconds)}, monotonic)}
+
+    @staticmethod
+    def sessions() -> tuple:
+        """
+        ({sid: [psutil.Process]}, {ppid: [psutil.Process]}), one /proc pass
+        shared by all apps in a sample round.
+        """
+        by_sid, by_ppid = {}, {}
+        for p in psutil.process_iter(["ppid"]):
+            try:
+                by_sid.setdefault(os.getsid(p.pid), []).append(p)
+            except OSError:
+                continue
+            by_ppid.setdefault(p.info["ppid"], []).append(p)
+        return by_sid, by_ppid
+
+    @staticmethod
+    def members(leader_pid: int, scan: tuple) -> list:
+        """The leader's session plus its descendants, from the scan (no further /proc walks)."""
+        by_sid, by_ppid = scan
+        procs = {p.pid: p for p in by_sid.get(leader_pid, [])}
+        if leader_pid not in procs:
+            try:
+                procs[leader_pid] = psutil.Process(leader_pid)  # not a session leader
+            except psutil.Error:
+                pass
+        todo = [leader_pid] if leader_pid in procs else []
+        while todo:
+            for child in by_ppid.get(todo.pop(), []):
+                if child.pid not in procs:
+                    procs[child.pid] = child
+                    todo.append(child.pid)
+        return list(procs.values())
+
+    def _cpu_percent(self, tid: str, cpu_now: dict, commit: bool = True) -> float:
+        now = time.monotonic()
+        prev = self._cpu.get(tid)
+        if commit:
+            self._cpu[tid] = (cpu_now, now)
+        if prev is None or now <= prev[1]:
+            return 0.0
+        before = prev[0]
+        used = 0.0
+        for pid, (created, total) in cpu_now.items():
+            old = before.get(pid)
+            # processes born since the last sample count in full; exited ones drop out
+            used += total - old[1] if old and old[0] == created else total
+        return max(0.0, used) / (now - prev[1]) * 100
+
+    @staticmethod
+    def from_cgroup(tid: str):
+        """AppUsage from the app's cgroup files alone; None if it has no leaf."""
+        cg = cgroups.usage(tid)
+        if cg is None or not cg["procs"]:
+            return None
+        return AppUsage(
+            cpu_percent=cg["cpu_percent"], memory_mb=cg["memory_mb"],
+            threads=cg["pids"], fds=None, procs=cg["procs"], source="cgroup",
+        )
+
+    def sample(self, tid: str, pid: int, scan: tuple = None, full: bool = False):
+        """
+        full=True adds PSS and leaves the CPU baseline alone, so an on-demand
+        read (server_stats) reports CPU since the last watchdog sample.
+        """
+        if not full:
+            u = self.from_cgroup(tid)
+            if u is not None:
+                return u
+        return self.tree(tid, pid, scan, full)
+
+    def tree(self, tid: str, pid: int, scan: tuple = None, full: bool = False):
+        """Totals from walking the app's processes (see sample)."""
+        if scan is None:
+            scan = self.sessions()
+        procs = self.members(pid, scan)
+        if not procs:
+            return None
+        rss = pss = 0
+        threads = fds = 0
+        cpu_now = {}
+        for p in procs:
+            try:
+                with p.oneshot():
+                    t = p.cpu_times()
+                    cpu_now[p.pid] = (p.create_time(), t.user + t.system)
+                    if full:
+                        mem = p.memory_full_info()
+                        pss += mem.pss
+                    else:
+                        mem = p.memory_info()
+                    rss += mem.rss
+                    threads += p.num_threads()
+                    fds += p.num_fds()
+            except psutil.Error:
+                continue
+        u = AppUsage(
+            cpu_percent=self._cpu_percent(tid, cpu_now, commit=not full),
+            rss_mb=rss / (1024 * 1024),
+            pss_mb=pss / (1024 * 1024) if full else None,
+            threads=threads, fds=fds, procs=len(cpu_now),
+        )
+        u.memory_mb = u.rss_mb
+        return u
+
+    def forget(self, tid: str):
+        self._cpu.pop(tid, None)
+
+usage_sampler = UsageSampler()
+
 async def send_alert(bot, chat_id: int, text: str):
     try:
         await bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=True)
@@ -521,72 +3282,183 @@ async def send_alert(bot, chat_id: int, text: str):
         logger.error(f"Failed to send alert to {chat_id}: {e}")
 
 def can_alert(tid: str) -> bool:
-    meta = running_processes.get(tid, {})
-    last = meta.get("last_alert", 0)
+    rp = running_processes.get(tid)
+    last = rp.last_alert if rp else 0
     return (time.time() - last) >= ALERT_COOLDOWN_SEC
 
 def mark_alerted(tid: str):
     if tid in running_processes:
-        running_processes[tid]["last_alert"] = time.time()
+        running_processes[tid].last_alert = time.time()
+
+async def alert_app_down(app_bot, tid: str, reason: str = "", action: str = "Restarting now...", title: str = "⚠️ App DOWN"):
+    if not can_alert(tid):
+        return
+    owner_id = get_owner(tid) or ADMIN_ID
+    msg = (
+        f"{title}\n"
+        f"App: {tid}\n"
+        f"Owner: {owner_id}\n"
+        + (f"Reason: {reason}\n" if reason else "")
+        + f"Action: {action}"
+    )
+    await send_alert(app_bot.bot, ADMIN_ID, msg)
+    if owner_id and owner_id != ADMIN_ID:
+        await send_alert(app_bot.bot, owner_id, msg)
+    mark_alerted(tid)
+
+async def handle_app_down(app_bot, tid: str, returncode=None, reason: str = ""):
+    """
+    Apply the app's restart policy to an unexpected exit:
+    - never / on-failure with exit 0 -> mark stopped
+    - otherwise restart after an exponential backoff (reset once it stayed up a full window)
+    - CRASH_LOOP_RESTARTS restarts within CRASH_LOOP_WINDOW_SEC -> quarantine until a manual start
+    """
+    rec = ownership_store.get(app_id(tid))
+    if not rec or rec.last_run is not True:
+        return
+    st = restart_states.setdefault(tid, RestartState())
+    if st.quarantined or st.task:
+        return
+
+    policy = get_restart_policy(tid)
+    if policy == "never" or (policy == "on-failure" and returncode == 0):
+        await alert_app_down(app_bot, tid, reason, action=f"None (restart policy: {policy})")
+        if instance_name(tid):
+            await retire_instance(tid)
+        else:
+            await stop_process(tid)
+        return
+
+    now = time.time()
+    rp = running_processes.get(tid)
+    if rp and now - rp.started_at >= CRASH_LOOP_WINDOW_SEC:
+        st.attempt = 0  # it had been healthy for a while
+    while st.restarts and now - st.restarts[0] > CRASH_LOOP_WINDOW_SEC:
+        st.restarts.popleft()
+    if len(st.restarts) >= CRASH_LOOP_RESTARTS:
+        st.quarantined = True
+        logger.warning(f"{tid} is crash-looping; auto-restart paused.")
+        await alert_app_down(
+            app_bot, tid, reason, title="⛔ App CRASH-LOOPING",
+            action=f"Auto-restart paused ({len(st.restarts)} restarts in {CRASH_LOOP_WINDOW_SEC:.0f}s). Use Run/Restart once fixed.",
+        )
+        return
+
+    delay = backoff_delay(st.attempt)
+    st.attempt += 1
+    st.next_at = now + delay
+    await alert_app_down(app_bot, tid, reason, action=f"Restarting in {delay:.0f}s...")
+    st.task = spawn_background(delayed_restart(tid, delay))
+
+async def delayed_restart(tid: str, delay: float):
+    await asyncio.sleep(delay)
+    st = restart_states.get(tid)
+    if st is None:
+        return
+    st.task = None
+    op = f"start {instance_name(tid)}" if instance_name(tid) else "start"
+    await lifecycle.run(app_id(tid), op, lambda: _auto_restart(tid))
+
+async def _auto_restart(tid: str) -> bool:
+    # re-checked here: a manual start/stop may have run while this was queued
+    rec = ownership_store.get(app_id(tid))
+    if not (rec and rec.last_run is True) or is_running(tid) or is_sleeping(tid):
+        return False
+    if instance_name(tid) and tid not in formations.get(app_id(tid), []):
+        return False  # scaled away meanwhile
+    st = restart_states.get(tid)
+    if st:
+        st.restarts.append(time.time())
+    return await _restart_app(tid)
+
+async def handle_app_exit(app_bot, ev: ExitEvent):
+    """React to an ExitWatcher event: the app died on its own (stops unwatch first)."""
+    rp = running_processes.get(ev.tid)
+    if rp is None or rp.process.pid != ev.pid:
+        return  # stale: already replaced or stopped
+    logger.warning(f"{ev.tid} (pid {ev.pid}) {ev.describe()}")
+    await handle_app_down(app_bot, ev.tid, ev.returncode, ev.describe())
+
+async def idle_sweep_loop():
+    """Every HEALTHCHECK_INTERVAL_SEC: scale on-demand apps without connections for idle_stop_sec to zero."""
+    while True:
+        try:
+            now = time.time()
+            for tid, px in list(proxies.items()):
+                if px.sleeping or px.active or (px.ready is not None and not px.ready.done()):
+                    continue
+                rec = ownership_store.get(tid)
+                if not is_on_demand(tid) or lifecycle.busy(tid):
+                    continue
+                idle = rec.idle_stop_sec or ON_DEMAND_IDLE_SEC
+                if now - px.last_activity >= idle:
+                    logger.info(f"{tid}: no connections for {idle:.0f}s; scaling to zero")
+                    await sleep_app(tid)
+        except Exception as e:
+            logger.error(f"Idle sweep error: {e}")
+
+        await asyncio.sleep(HEALTHCHECK_INTERVAL_SEC)
 
 async def watchdog_loop(app_bot):
     """
-    - If app stopped/crashed -> alert owner + admin and (optional) auto restart it (since you already have last_run)
-    - If high CPU/RAM -> alert (cooldown)
+    - App exits arrive as ExitWatcher events -> alert owner + admin and auto restart it
+    - Every HEALTHCHECK_INTERVAL_SEC: restart last_run apps that have no live process
+      (failed launches, adopted apps without a pidfd) and check CPU/RAM (cooldown)
     """
     if not ENABLE_ALERTS:
         logger.info("Alerts disabled (ENABLE_ALERTS!=1).")
         return
 
+    exit_watcher.subscribe(lambda ev: spawn_background(handle_app_exit(app_bot, ev)))
     logger.info("Watchdog started.")
     while True:
         try:
-            ownership = load_ownership()
-            # only watch apps that are marked last_run True
-            watch_list = [tid for tid, meta in ownership.items() if meta.get("last_run") is True]
+            # only watch apps that are marked last_run True (Procfile apps: each instance)
+            watch_list = [key for tid in ownership_store.last_run_ids() for key in app_process_keys(tid)]
 
+            scan = None  # process table, read once per pass if any app is up
             for tid in watch_list:
-                # is it running?
-                rp = running_processes.get(tid)
-                is_running = False
-                pid = None
-                if rp and rp["process"].poll() is None:
-                    is_running = True
-                    pid = rp["process"].pid
-
-                # stopped/crashed
-                if not is_running:
-                    if can_alert(tid):
-                        owner_id = ownership.get(tid, {}).get("owner", ADMIN_ID)
-                        msg = (
-                            f"⚠️ App DOWN\n"
-                            f"App: {tid}\n"
-                            f"Owner: {owner_id}\n"
-                            f"Action: Restarting now..."
-                        )
-                        await send_alert(app_bot.bot, ADMIN_ID, msg)
-                        if owner_id and owner_id != ADMIN_ID:
-                            await send_alert(app_bot.bot, owner_id, msg)
-                        mark_alerted(tid)
-
-                    # auto-restart
-                    restart_process_background(tid)
+                if app_id(tid) in staged_pending or is_sleeping(tid) or lifecycle.busy(app_id(tid)):
+                    continue
+                # stopped/crashed without an exit event
+                if not is_running(tid):
+                    rp = running_processes.get(tid)
+                    rc = rp.process.poll() if rp else None
+                    await handle_app_down(app_bot, tid, rc, "not running" if rp else "failed to launch")
                     continue
 
-                # resource checks
+                pid = running_processes[tid].process.pid
+
+                # resource checks: totals over the app's whole process tree / cgroup
                 try:
-                    proc = psutil.Process(pid)
-                    cpu = proc.cpu_percent(interval=0.0)
-                    ram_mb = proc.memory_info().rss / (1024 * 1024)
+                    usage = usage_sampler.from_cgroup(tid)
+                    if usage is None:
+                        if scan is None:
+                            scan = await asyncio.to_thread(UsageSampler.sessions)
+                        usage = usage_sampler.tree(tid, pid, scan)
+                    if usage is None:
+                        continue
+                    cpu, ram_mb = usage.cpu_percent, usage.memory_mb
+                    core_spreader.sample(tid, cpu)
+                    if npm_launches.get(tid) == "npm":
+                        try:
+                            npm_wrapper_rss_mb.append(psutil.Process(pid).memory_info().rss / (1024 * 1024))
+                        except psutil.Error:
+                            pass
 
                     if (cpu >= CPU_ALERT_PERCENT or ram_mb >= RAM_ALERT_MB) and can_alert(tid):
-                        owner_id = ownership.get(tid, {}).get("owner", ADMIN_ID)
+                        owner_id = get_owner(tid) or ADMIN_ID
                         msg = (
                             f"🚨 High Resource Usage\n"
                             f"App: {tid}\n"
                             f"CPU: {cpu:.2f}% (threshold {CPU_ALERT_PERCENT}%)\n"
-                            f"RAM: {ram_mb:.2f} MB (threshold {RAM_ALERT_MB} MB)"
+                            f"RAM: {ram_mb:.2f} MB (threshold {RAM_ALERT_MB} MB)\n"
+                            f"Processes: {usage.procs}"
                         )
+                        if usage.threads is not None:
+                            msg += f" · threads: {usage.threads}"
+                        if usage.fds is not None:  # unknown when read from the cgroup
+                            msg += f" · FDs: {usage.fds}"
                         await send_alert(app_bot.bot, ADMIN_ID, msg)
                         if owner_id and owner_id != ADMIN_ID:
                             await send_alert(app_bot.bot, owner_id, msg)
@@ -595,11 +3467,44 @@ async def watchdog_loop(app_bot):
                 except Exception:
                     pass
 
+            for tid, cores in core_spreader.rebalance():
+                logger.info(f"Moving {tid} to cores {cores}")
+                set_app_affinity(tid, cores)
+
         except Exception as e:
             logger.error(f"Watchdog loop error: {e}")
 
         await asyncio.sleep(HEALTHCHECK_INTERVAL_SEC)
 
+_background_tasks = set()
+
+def spawn_background(coro):
+    # keep a reference so the task isn't garbage-collected mid-flight
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def post_init(application):
+    # runs inside the bot's event loop, before polling starts
+    exit_watcher.start(asyncio.get_running_loop())
+    if ZYGOTE_ENABLED:
+        zygote.start()  # warm up (preload) before the first app needs it
+
+    # adopt apps still alive from the previous run, start the rest in the background
+    # (staged, so polling doesn't wait for every app's readiness check)
+    try:
+        adopt_running_apps()
+        await restore_proxies()
+        spawn_background(auto_start_last_run_apps(skip_running=True))
+    except Exception as e:
+        logger.error(f"Auto-start on boot failed: {e}")
+
+    # on-demand apps scale to zero whether or not alerts are enabled
+    spawn_background(idle_sweep_loop())
+    # start watchdog/alerts (Feature F)
+    spawn_background(watchdog_loop(application))
+
 
 # ================= TELEGRAM FLOWS =================
 WAIT_FILE, WAIT_EXTRAS, WAIT_ENV_TEXT = range(3)
@@ -646,20 +3551,14 @@ async def receive_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     path = os.path.join(user_dir, fname)
     await tgfile.download_to_drive(path)
+    run_command_cache.invalidate(user_dir)
 
     unique_id = f"u{uid}|{fname}"
     key = secrets.token_urlsafe(16)
 
     save_ownership_record(
         unique_id,
-        {
-            "owner": uid,
-            "type": "file",
-            "key": key,
-            "last_run": False,
-            "entry": fname,
-            "created_at": int(time.time()),
-        },
+        AppRecord(owner=uid, type="file", key=key, last_run=False, entry=fname, created_at=int(time.time())),
     )
 
     context.user_data.update({"type": "file", "target_id": unique_id, "work_dir": user_dir})
@@ -761,6 +3660,7 @@ async def receive_extra_files(update: Update, context: ContextTypes.DEFAULT_TYPE
         await msg.edit_text("✅ Installed!")
     except Exception as e:
         await msg.edit_text(f"❌ Error: {e}")
+    run_command_cache.invalidate(work_dir)
 
     context.user_data["wait"] = None
     await update.message.reply_text("Next?", reply_markup=extras_keyboard())
@@ -791,6 +3691,7 @@ async def receive_git_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         subprocess.check_call(["git", "clone", url, repo_path])
+        run_command_cache.invalidate(repo_path)
         await install_dependencies(repo_path, update)
 
         # placeholder record
@@ -798,7 +3699,7 @@ async def receive_git_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
         key = secrets.token_urlsafe(16)
         save_ownership_record(
             tid,
-            {"owner": uid, "type": "repo", "key": key, "last_run": False, "entry": None, "created_at": int(time.time())},
+            AppRecord(owner=uid, type="repo", key=key, last_run=False, entry=None, created_at=int(time.time())),
         )
 
         context.user_data.update({"repo_path": repo_path, "repo_name": repo_name, "target_id": tid, "type": "repo", "work_dir": repo_path})
@@ -843,17 +3744,10 @@ async def select_git_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     old_tid = context.user_data.get("target_id")
     new_tid = f"{repo_name}|{filename}"
 
-    data = load_ownership()
-    old = data.get(old_tid, {})
-    if old:
-        data[new_tid] = old
-        data[new_tid]["entry"] = filename
-        del data[old_tid]
-        _write_json(OWNERSHIP_FILE, data)
-    else:
+    if not ownership_store.rename(old_tid, new_tid, entry=filename):
         save_ownership_record(
             new_tid,
-            {"owner": update.effective_user.id, "type": "repo", "key": secrets.token_urlsafe(16), "last_run": False, "entry": filename, "created_at": int(time.time())},
+            AppRecord(owner=update.effective_user.id, type="repo", key=secrets.token_urlsafe(16), last_run=False, entry=filename, created_at=int(time.time())),
         )
 
     context.user_data["target_id"] = new_tid
@@ -869,34 +3763,61 @@ async def execute_logic(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg_func("❌ No target selected.")
         return ConversationHandler.END
 
-    restart_process_background(tid)
+    reset_restart_state(tid)
+    if not await restart_process_background(tid):
+        await msg_func(
+            "❌ Launch failed (a running web app keeps its old instance). Check the logs.",
+            reply_markup=main_menu_keyboard(update.effective_user.id),
+        )
+        return ConversationHandler.END
     key = get_app_key(tid) or "no-key"
+    url = f"🔒 Secure URL:\n{safe_status_url(tid, key)}"
 
-    await msg_func(
-        "🚀 Launched!\n" f"🔒 Secure URL:\n{safe_status_url(tid, key)}",
+    check = ready_waits.get(tid)
+    msg = await msg_func(
+        "🚀 Launched! ⏳ Waiting for it to be ready...\n" + url,
         reply_markup=main_menu_keyboard(update.effective_user.id),
     )
+    if check is not None:
+        spawn_background(report_ready(msg, tid, check, url))
     return ConversationHandler.END
 
+async def report_ready(msg, tid: str, check, url: str):
+    """Edit the launch reply once the start's readiness check is settled."""
+    elapsed = await asyncio.shield(check)
+    if elapsed is not None:
+        text = f"✅ Ready in {elapsed:.1f}s"
+    elif ready_waits.get(tid) is not check:
+        text = "🛑 Stopped or restarted before it became ready."
+    elif not is_running(tid):
+        text = "❌ Exited before it became ready. Check the logs."
+    else:
+        text = "⚠️ Still running but not ready in time. Check the logs and its ready_* settings."
+    try:
+        await msg.edit_text(f"{text}\n{url}")
+    except Exception as e:
+        logger.error(f"Failed to edit launch reply for {tid}: {e}")
+
 
 # ---- List & Manage ----
 @restricted
 async def list_hosted(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    ownership = load_ownership()
+    if uid == ADMIN_ID:
+        ownership = load_ownership()
+    else:
+        ownership = {tid: ownership_store.get(tid) for tid in ownership_store.ids_for_owner(uid)}
     if not ownership:
         return await update.message.reply_text("📂 Empty.")
 
     keyboard = []
     for tid, meta in ownership.items():
-        owner_id = meta.get("owner")
-        if uid == ADMIN_ID or uid == owner_id:
-            is_running = tid in running_processes and running_processes[tid]["process"].poll() is None
-            status = "🟢" if is_running else "🔴"
-            label = f"{status} {tid}"
-            if uid == ADMIN_ID and uid != owner_id:
-                label += f" (👤 {owner_id})"
-            keyboard.append([InlineKeyboardButton(label, callback_data=f"man_{tid}")])
+        owner_id = meta.owner
+        status = "🟢" if is_running(tid) else "🔴"
+        label = f"{status} {tid}"
+        if uid == ADMIN_ID and uid != owner_id:
+            label += f" (👤 {owner_id})"
+        keyboard.append([InlineKeyboardButton(label, callback_data=f"man_{tid}")])
 
     if not keyboard:
         return await update.message.reply_text("📂 No apps.")
@@ -904,11 +3825,43 @@ async def list_hosted(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def app_manage_buttons(tid: str, uid: int):
     owner = get_owner(tid)
-    is_running = tid in running_processes and running_processes[tid]["process"].poll() is None
+    running = is_running(tid)
     key = get_app_key(tid) or ""
-    status = "🟢 Running" if is_running else "🔴 Stopped"
-
-    text = f"⚙️ App: {tid}\nStatus: {status}"
+    status = "🟢 Running" if running else "🔴 Stopped"
+    if not running and is_sleeping(tid):
+        status = "💤 Asleep (starts on the next request)"
+    st = restart_states.get(tid)
+    if st and st.quarantined:
+        status = f"⛔ Crash-looping ({len(st.restarts)} restarts in {CRASH_LOOP_WINDOW_SEC:.0f}s, auto-restart paused)"
+    elif st and st.task:
+        status += f" (auto-restart in {max(0, st.next_at - time.time()):.0f}s)"
+    policy = get_restart_policy(tid)
+
+    text = f"⚙️ App: {tid}\nStatus: {status}\nRestart policy: {policy}"
+    rec = ownership_store.get(tid)
+    if rec and rec.port:
+        text += f"\nPort: {rec.port}"
+        if rec.on_demand:
+            text += f" · on-demand, sleeps after {rec.idle_stop_sec or ON_DEMAND_IDLE_SEC:.0f}s idle"
+    ready = ready_summary(tid)
+    if ready:
+        text += f"\n⏱ Time to ready: {ready}"
+    if npm_launches.get(tid) == "direct":
+        text += f"\n📦 Start script exec'd directly (saves ~{npm_saving_mb():.0f} MB vs npm start)"
+    elif npm_launches.get(tid) == "npm":
+        text += "\n📦 Runs via npm start (script needs a shell or has pre/post hooks)"
+    types = procfile_types(tid)
+    if types:
+        text += "\n🧩 Procfile processes:"
+        for ptype in types:
+            keys = [k for k in (formations.get(tid) or desired_instances(tid)) if instance_name(k).split(".")[0] == ptype]
+            up = sum(1 for k in keys if is_running(k))
+            looping = [instance_name(k) for k in keys if restart_states.get(k) and restart_states[k].quarantined]
+            text += f"\n• {ptype}: {up}/{replica_count(tid, ptype)} running"
+            if looping:
+                text += f" (crash-looping: {', '.join(looping)})"
+    if lifecycle.busy(tid):
+        text += f"\n⏳ Queued: {lifecycle.describe(tid)}"
     if uid == ADMIN_ID:
         text += f"\nOwner: {owner}"
     if key:
@@ -916,15 +3869,21 @@ def app_manage_buttons(tid: str, uid: int):
 
     btns = []
     row1 = []
-    if is_running:
+    if running or is_sleeping(tid):
         row1.append(InlineKeyboardButton("🛑 Stop", callback_data=f"stop_{tid}"))
     row1.append(InlineKeyboardButton("🚀 Run/Restart", callback_data=f"rerun_{tid}"))
     btns.append(row1)
+    for ptype in types:
+        btns.append([
+            InlineKeyboardButton(f"➖ {ptype}", callback_data=f"scdn_{ptype}:{tid}"),
+            InlineKeyboardButton(f"➕ {ptype}", callback_data=f"scup_{ptype}:{tid}"),
+        ])
 
     btns.append([
         InlineKeyboardButton("📜 Logs (Web)", web_app=WebAppInfo(url=f"{BASE_URL}/logs?id={safe_q(tid)}&uid={uid}&lines=250")),
         InlineKeyboardButton("🧹 Clear Logs", callback_data=f"clrlog_{tid}"),
     ])
+    btns.append([InlineKeyboardButton(f"♻️ Policy: {policy}", callback_data=f"pol_{tid}")])
     btns.append([InlineKeyboardButton("🗑️ Delete", callback_data=f"del_{tid}")])
     return text, InlineKeyboardMarkup(btns)
 
@@ -947,7 +3906,7 @@ async def manage_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         owner = get_owner(tid)
         if uid != ADMIN_ID and uid != owner:
             return await q.message.reply_text("⛔ Not yours.")
-        stop_process(tid)
+        await stop_process(tid)
         return await q.edit_message_text(f"🛑 Stopped: {tid}")
 
     if data.startswith("rerun_"):
@@ -959,6 +3918,36 @@ async def manage_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.delete_message()
         return await execute_logic(update, context)
 
+    if data.startswith("scup_") or data.startswith("scdn_"):
+        ptype, _, tid = data[5:].partition(":")
+        owner = get_owner(tid)
+        if uid != ADMIN_ID and uid != owner:
+            return await q.message.reply_text("⛔ Not yours.")
+        n = replica_count(tid, ptype) + (1 if data.startswith("scup_") else -1)
+        if not 0 <= n <= MAX_REPLICAS:
+            return await q.message.reply_text(f"❌ Replicas must be 0..{MAX_REPLICAS}.")
+        rec = ownership_store.get(tid)
+        scale = {k: v for k, v in ((rec.scale if rec else None) or {}).items() if k != ptype}
+        if n != 1:
+            scale[ptype] = n
+        if uid != ADMIN_ID and n > replica_count(tid, ptype) and owner_instances(owner, tid, scale) > OWNER_MAX_INSTANCES:
+            return await q.message.reply_text(f"❌ At most {OWNER_MAX_INSTANCES} Procfile processes per owner; ask the admin for more.")
+        ownership_store.update(tid, scale=scale or None)
+        await scale_app(tid)
+        text, markup = app_manage_buttons(tid, uid)
+        return await q.edit_message_text(text, reply_markup=markup)
+
+    if data.startswith("pol_"):
+        tid = data.split("pol_")[1]
+        owner = get_owner(tid)
+        if uid != ADMIN_ID and uid != owner:
+            return await q.message.reply_text("⛔ Not yours.")
+        current = get_restart_policy(tid)
+        nxt = RESTART_POLICIES[(RESTART_POLICIES.index(current) + 1) % len(RESTART_POLICIES)]
+        ownership_store.update(tid, restart_policy=None if nxt == "always" else nxt)
+        text, markup = app_manage_buttons(tid, uid)
+        return await q.edit_message_text(text, reply_markup=markup)
+
     if data.startswith("clrlog_"):
         tid = data.split("clrlog_")[1]
         owner = get_owner(tid)
@@ -973,32 +3962,228 @@ async def manage_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if uid != ADMIN_ID and uid != owner:
             return await q.message.reply_text("⛔ Not yours.")
 
-        stop_process(tid)
-        delete_ownership(tid)
+        await delete_app(tid)
+        return await q.edit_message_text(f"🗑️ Deleted: {tid}")
 
-        work_dir, script_path, _, _, _ = resolve_paths(tid)
-        if is_repo_id(tid):
-            shutil.rmtree(work_dir, ignore_errors=True)
-        elif is_user_file_id(tid):
-            try:
-                os.remove(os.path.join(work_dir, script_path))
-            except Exception:
-                pass
-        else:
-            try:
-                os.remove(os.path.join(UPLOAD_DIR, tid))
-            except Exception:
-                pass
 
-        return await q.edit_message_text(f"🗑️ Deleted: {tid}")
+# ---- App Settings ----
+def _choice(*options):
+    def parse(raw: str):
+        if raw not in options:
+            raise ValueError(f"expected one of: {', '.join(options)}")
+        return raw
+    return parse
+
+def _number(lo: float, hi: float, cast=float):
+    def parse(raw: str):
+        v = cast(raw)
+        if not lo <= v <= hi:
+            raise ValueError(f"expected {lo}..{hi}")
+        return v
+    return parse
+
+def _id_list(raw: str):
+    return [t for t in raw.split(",") if t]
+
+def _on_off(raw: str):
+    if raw not in ("on", "off"):
+        raise ValueError("expected on or off")
+    return True if raw == "on" else None
+
+def _path(raw: str):
+    if not raw.startswith("/"):
+        raise ValueError("expected a path like /health")
+    return raw
+
+def _regex(raw: str):
+    if len(raw) > READY_LOG_MAX_PATTERN:
+        raise ValueError(f"at most {READY_LOG_MAX_PATTERN} characters")
+    try:
+        re.compile(raw)
+    except re.error as e:
+        raise ValueError(f"bad regex: {e}")
+    return raw
+
+def _procfile(raw: str):
+    if raw not in ("on", "off"):
+        raise ValueError("expected on or off")
+    return None if raw == "on" else False
+
+def _scale(raw: str):
+    scale = {}
+    for part in raw.split(","):
+        ptype, _, n = part.partition("=")
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", ptype) or not n.isdigit() or int(n) > MAX_REPLICAS:
+            raise ValueError(f"expected type=replicas pairs like web=1,worker=3 (0..{MAX_REPLICAS})")
+        scale[ptype] = int(n)
+    return scale
+
+def _ionice(raw: str):
+    cls, _, level = raw.partition(":")
+    if cls not in IONICE_CLASSES or (level and (cls == "idle" or level not in "01234567" or len(level) != 1)):
+        raise ValueError("expected idle, be[:0-7] or rt[:0-7]")
+    return raw
+
+def _cpu_list(raw: str):
+    if raw == "auto" or (raw.startswith("auto:") and raw[5:].isdigit() and int(raw[5:]) > 0):
+        return raw
+    cores = set()
+    for part in raw.split(","):
+        lo, _, hi = part.partition("-")
+        if not lo.isdigit() or (hi and not hi.isdigit()):
+            raise ValueError("expected auto, auto:N or a core list like 0,2-3")
+        cores.update(range(int(lo), int(hi or lo) + 1))
+    return sorted(cores)
+
+def _owner_lower(default: float):
+    """Owner check for a limit: only lower it below the APP_* default (0 = unlimited is admin only)."""
+    def check(v):
+        if default and (v == 0 or v > default):
+            raise ValueError(f"owners can only lower it (1..{default:g}); ask the admin for more")
+    return check
+
+def _owner_port(v):
+    if not PUBLIC_PORT_MIN <= v <= PUBLIC_PORT_MAX:
+        raise ValueError(f"owners can use ports {PUBLIC_PORT_MIN}..{PUBLIC_PORT_MAX}")
+
+def _owner_nice(v):
+    if v < 0:
+        raise ValueError("owners can only make an app nicer (0..19)")
+
+def _owner_ionice(v):
+    if v.startswith("rt"):
+        raise ValueError("the realtime class is admin only; use be or idle")
+
+# name -> (parser, help, owner); "default" resets a setting. owner: True = owners may set it,
+# False = admin only, or a check(value) that raises ValueError for values owners may not set
+APP_SETTINGS = {
+    "restart_policy": (_choice(*RESTART_POLICIES), "always | on-failure | never", True),
+    "stop_grace_sec": (_number(0, 600), f"seconds between SIGTERM and SIGKILL (default {STOP_GRACE_SEC:.0f})", True),
+    "priority": (_number(-1000, 1000, int), "boot / Restart ALL order, higher first (default 0)", True),
+    "start_after": (_id_list, "comma-separated app ids to start before this one", True),
+    "cpu_max": (_number(0, 6400), f"CPU limit, % of one core, 0 = unlimited (default {APP_CPU_MAX_PERCENT:g})", _owner_lower(APP_CPU_MAX_PERCENT)),
+    "memory_max_mb": (_number(0, 1 << 20, int), f"hard memory limit in MB, 0 = unlimited (default {APP_MEMORY_MAX_MB})", _owner_lower(APP_MEMORY_MAX_MB)),
+    "memory_high_mb": (_number(0, 1 << 20, int), "memory throttle point in MB (default 90% of max)", _owner_lower(APP_MEMORY_MAX_MB)),
+    "pids_max": (_number(0, 1 << 20, int), f"max processes/threads, 0 = unlimited (default {APP_PIDS_MAX})", _owner_lower(APP_PIDS_MAX)),
+    "nice": (_number(-20, 19, int), "CPU priority, higher = nicer; owners 0..19 (default: inherit)", _owner_nice),
+    "ionice": (_ionice, "I/O class: idle, be[:0-7] or rt[:0-7] (rt: admin only; default: inherit)", _owner_ionice),
+    "cpus": (_cpu_list, "core list like 0,2-3, or auto / auto:N to let the bot spread apps", True),
+    "port": (_number(1024, 65535, int), f"public port for a web app, owners {PUBLIC_PORT_MIN}..{PUBLIC_PORT_MAX}; the app must listen on $PORT (enables blue/green restarts)", _owner_port),
+    "health_path": (_path, "HTTP readiness path like /health (default: TCP connect)", True),
+    "on_demand": (_on_off, "on = stop when idle and start on the next request (needs port); see time to ready in the app view", True),
+    "idle_stop_sec": (_number(30, 7 * 86400), f"idle period before an on-demand app is stopped (default {ON_DEMAND_IDLE_SEC:.0f})", True),
+    "ready_port": (_number(1, 65535, int), "ready once this TCP port accepts connections", True),
+    "ready_log": (_regex, "ready once a log line matches this regex (no spaces, use \\s)", True),
+    "ready_after_sec": (_number(0, 3600), f"ready once alive this long (default {BOOT_READY_SEC:g} if no other signal)", True),
+    "ready_timeout_sec": (_number(1, 3600), f"give up on readiness after this long (default {READY_TIMEOUT_SEC:.0f})", True),
+    "procfile": (_procfile, "off = run the entry file even if the repo has a Procfile", True),
+    "scale": (_scale, "Procfile replicas like web=1,worker=3 (default 1 per type; replicas are spread over cores)", True),
+}
+
+@restricted
+async def appset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    if len(args) < 3:
+        lines = ["⚙️ Usage: /appset <app id> <setting> <value|default>", ""]
+        lines += [
+            f"• {name}: {hlp}" + (" (admin only)" if owner_ok is False else "")
+            for name, (_, hlp, owner_ok) in APP_SETTINGS.items()
+        ]
+        return await update.message.reply_text("\n".join(lines))
+
+    tid, name, raw = " ".join(args[:-2]), args[-2], args[-1]
+    uid = update.effective_user.id
+    owner = get_owner(tid)
+    if owner is None:
+        return await update.message.reply_text("❌ Unknown app.")
+    if uid != ADMIN_ID and uid != owner:
+        return await update.message.reply_text("⛔ Not yours.")
+    if name not in APP_SETTINGS:
+        return await update.message.reply_text(f"❌ Unknown setting. Known: {', '.join(APP_SETTINGS)}")
+
+    parse, _, owner_ok = APP_SETTINGS[name]
+    if uid != ADMIN_ID and owner_ok is False:
+        return await update.message.reply_text(f"⛔ {name} can only be changed by the admin.")
+    if raw == "default":
+        value = None
+    else:
+        try:
+            value = parse(raw)
+            if uid != ADMIN_ID and callable(owner_ok):
+                owner_ok(value)
+            if name == "port" and port_taken(tid, value):
+                raise ValueError(f"already used by {port_taken(tid, value)}")
+            if uid != ADMIN_ID and name == "scale" and owner_instances(owner, tid, value) > OWNER_MAX_INSTANCES:
+                raise ValueError(f"at most {OWNER_MAX_INSTANCES} Procfile processes per owner; ask the admin for more")
+        except ValueError as e:
+            return await update.message.reply_text(f"❌ Bad value for {name}: {e}")
+    ownership_store.update(tid, **{name: value})
+    if name == "scale":
+        await scale_app(tid)
+    await update.message.reply_text(f"✅ {tid}: {name} = {raw}")
 
 
 # ---- Server Stats ----
 @restricted
 async def server_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    total = len(load_ownership())
-    running = sum(1 for tid in running_processes if running_processes[tid]["process"].poll() is None)
-    await update.message.reply_text(f"📊 Apps: {total}\n🟢 Running: {running}")
+    uid = update.effective_user.id
+    total = ownership_store.count()
+    live = [tid for tid in running_processes if is_running(tid)]
+
+    # owners only see (and only pay for sampling) their own apps
+    pids = {
+        tid: rp.process.pid for tid, rp in running_processes.items()
+        if tid in live and (uid == ADMIN_ID or get_owner(tid) == uid)
+    }
+
+    def sample_all():
+        scan = UsageSampler.sessions()
+        samples = {tid: usage_sampler.sample(tid, pid, scan, full=True) for tid, pid in pids.items()}
+        return {tid: u for tid, u in samples.items() if u is not None}
+
+    usages = await asyncio.to_thread(sample_all)  # /proc walk + PSS reads, off the event loop
+
+    lines = [f"📊 Apps: {total}", f"🟢 Running: {len(live)}"]
+    if usages:
+        if uid == ADMIN_ID:
+            lines += [
+                "",
+                "All apps (every process, incl. children):",
+                f"🧠 CPU: {sum(u.cpu_percent for u in usages.values()):.1f}%",
+                f"💾 RAM: {sum(u.rss_mb for u in usages.values()):.0f} MB RSS · {sum(u.pss_mb for u in usages.values()):.0f} MB PSS",
+                f"🧵 Processes: {sum(u.procs for u in usages.values())} · threads: {sum(u.threads for u in usages.values())}"
+                f" · FDs: {sum(u.fds for u in usages.values())}",
+            ]
+        lines += ["", "Top apps by PSS:" if uid == ADMIN_ID else "Your apps:"]
+        for tid, u in sorted(usages.items(), key=lambda kv: -kv[1].pss_mb)[:10]:
+            lines.append(
+                f"• {tid}: {u.cpu_percent:.1f}% CPU, {u.pss_mb:.0f} MB PSS, "
+                f"{u.procs} proc / {u.threads} thr / {u.fds} fd"
+            )
+    visible = [tid for tid in ready_times if uid == ADMIN_ID or get_owner(tid) == uid]
+    times = [t for tid in visible for t in ready_times[tid]]
+    if times:
+        fails = sum(ready_failures.get(tid, 0) for tid in ready_failures if uid == ADMIN_ID or get_owner(tid) == uid)
+        lines += [
+            "",
+            f"⏱ Time to ready ({len(times)} starts): p50 {percentile(times, 50):.2f}s · p95 {percentile(times, 95):.2f}s"
+            + (f" · {fails} never ready" if fails else ""),
+        ]
+        slowest = sorted(visible, key=lambda tid: -percentile(ready_times[tid], 95))[:5]
+        lines += [
+            f"• {tid}: p50 {percentile(ready_times[tid], 50):.2f}s · p95 {percentile(ready_times[tid], 95):.2f}s"
+            for tid in slowest
+        ]
+    direct = [tid for tid in live if npm_launches.get(tid) == "direct" and (uid == ADMIN_ID or get_owner(tid) == uid)]
+    if direct:
+        saving = npm_saving_mb()
+        lines += [
+            "",
+            f"📦 Started without npm: {len(direct)} app(s), ~{saving * len(direct):.0f} MB saved (~{saving:.0f} MB each)",
+        ]
+    if uid == ADMIN_ID:
+        lines += ["", f"⚙️ Run-command cache: {run_command_cache.hits} hits / {run_command_cache.misses} misses"]
+    await update.message.reply_text("\n".join(lines))
 
 
 # ================= OWNER PANEL (what you asked) =================
@@ -1014,17 +4199,38 @@ async def owner_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
          InlineKeyboardButton("🔴 View Down", callback_data="own_down")],
         [InlineKeyboardButton("🛑 Stop ALL", callback_data="own_stop_all"),
          InlineKeyboardButton("🔄 Restart ALL last-run", callback_data="own_restart_all")],
+        [InlineKeyboardButton("⚖️ CPU Shares", callback_data="own_weights")],
     ])
     await update.message.reply_text("🛠 Owner Panel", reply_markup=kb)
 
+def owner_weights_view():
+    weights = owner_weights.all()
+    owners = sorted({m.owner for m in load_ownership().values() if m.owner is not None} | set(weights))
+    lines = [
+        "⚖️ CPU Shares (cpu.weight per owner)",
+        f"Under contention each owner gets weight / sum of active weights. Default {DEFAULT_OWNER_CPU_WEIGHT}.",
+    ]
+    if not cgroups.setup() or "cpu" not in cgroups.controllers:
+        lines.append("⚠️ cgroup cpu controller unavailable; weights are saved but not enforced.")
+    rows = []
+    for owner in owners[:30]:
+        w = weights.get(owner, DEFAULT_OWNER_CPU_WEIGHT)
+        rows.append([
+            InlineKeyboardButton("➖", callback_data=f"own_wdn_{owner}"),
+            InlineKeyboardButton(f"👤 {owner}: {w}", callback_data=f"own_wrs_{owner}"),
+            InlineKeyboardButton("➕", callback_data=f"own_wup_{owner}"),
+        ])
+    if not owners:
+        lines.append("No owners yet.")
+    lines.append("➖/➕ halve/double, tap the owner to reset.")
+    return "\n".join(lines), InlineKeyboardMarkup(rows)
+
 async def owner_panel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     if update.effective_user.id != ADMIN_ID:
         return await q.message.reply_text("⛔ Owner only.")
 
-    ownership = load_ownership()
-
     if q.data == "own_access":
         allowed = get_allowed_users()
         text = "👥 **Access List**\n"
@@ -1033,21 +4239,23 @@ async def owner_panel_callback(update: Update, context: ContextTypes.DEFAULT_TYP
             text += "- Allowed users:\n" + "\n".join([f"  • `{u}`" for u in allowed])
         else:
             text += "- Allowed users: *(none)*"
+        text += f"\n\n_Access cache: {allowed_users_cache.hits} hits / {allowed_users_cache.reloads} reloads_"
         return await q.message.reply_text(text, parse_mode="Markdown")
 
     if q.data == "own_apps":
+        ownership = load_ownership()
         if not ownership:
             return await q.message.reply_text("No apps.")
         lines = ["🧾 **Apps & Owners**"]
         for tid, meta in ownership.items():
-            lines.append(f"• `{tid}`  → 👤 `{meta.get('owner')}`  | last_run={meta.get('last_run')}")
+            lines.append(f"• `{tid}`  → 👤 `{meta.owner}`  | last_run={meta.last_run}")
         return await q.message.reply_text("\n".join(lines[:80]), parse_mode="Markdown")
 
     if q.data == "own_running":
         lines = ["🟢 **Running Apps**"]
         any_ = False
-        for tid in ownership.keys():
-            ok = tid in running_processes and running_processes[tid]["process"].poll() is None
+        for tid in ownership_store.all():
+            ok = is_running(tid)
             if ok:
                 any_ = True
                 lines.append(f"• `{tid}`")
@@ -1058,24 +4266,73 @@ async def owner_panel_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     if q.data == "own_down":
         lines = ["🔴 **Down Apps** (last_run=True but not running)"]
         any_ = False
-        for tid, meta in ownership.items():
-            if meta.get("last_run") is True:
-                ok = tid in running_processes and running_processes[tid]["process"].poll() is None
-                if not ok:
-                    any_ = True
-                    lines.append(f"• `{tid}`")
+        for tid in ownership_store.last_run_ids():
+            ok = is_running(tid)
+            if not ok:
+                any_ = True
+                lines.append(f"• `{tid}`")
         if not any_:
             lines.append("_None_")
         return await q.message.reply_text("\n".join(lines), parse_mode="Markdown")
 
+    if q.data == "own_weights":
+        text, kb = owner_weights_view()
+        return await q.message.reply_text(text, reply_markup=kb)
+
+    if q.data.startswith(("own_wdn_", "own_wup_", "own_wrs_")):
+        action, owner = q.data[4:7], int(q.data[8:])
+        w = owner_weights.get(owner)
+        if action == "wdn":
+            w = max(1, w // 2)
+        elif action == "wup":
+            w = min(10000, w * 2)
+        else:
+            w = None
+        owner_weights.set(owner, w)
+        if os.path.isdir(cgroups.owner_path(owner)):
+            cgroups.apply_owner_weight(owner)  # live owners only; others get it on next launch
+        text, kb = owner_weights_view()
+        try:
+            await q.edit_message_text(text, reply_markup=kb)
+        except Exception:
+            pass  # unchanged (already at the limit)
+        return
+
     if q.data == "own_stop_all":
-        for tid in list(running_processes.keys()):
-            stop_process(tid)
+        tids = {app_id(k) for k in running_processes.keys()}
+        # one store write for all records (the same fields _stop_app clears), so the stops write nothing
+        with ownership_store.batch():
+            for tid in tids:
+                ownership_store.update(
+                    tid, last_run=False, pid=None, pgid=None, started_at=None, create_time=None,
+                    backend_port=None, instances=None,
+                )
+        await asyncio.gather(*(stop_process(tid) for tid in tids))
         return await q.message.reply_text("🛑 Stopped all running apps.")
 
     if q.data == "own_restart_all":
-        auto_start_last_run_apps()
-        return await q.message.reply_text("🔄 Restart requested for last-run apps.")
+        msg = await q.message.reply_text("🔄 Restart requested for last-run apps.")
+        last_edit = [0.0]
+
+        async def progress(done, total, failed):
+            # Telegram rate-limits edits; report at most every 2s plus the final state
+            if done < total and time.time() - last_edit[0] < 2:
+                return
+            last_edit[0] = time.time()
+            text = f"🔄 Restart ALL: {done}/{total} started, {done - len(failed)} ready"
+            if failed:
+                text += "\n❌ Not ready: " + ", ".join(failed[:20])
+            if done == total:
+                text = "✅ " + text[2:]
+            await msg.edit_text(text)
+
+        async def restart_all():
+            done, _ = await auto_start_last_run_apps(progress=progress)
+            if not done:
+                await msg.edit_text("🔄 No last-run apps to restart.")
+
+        spawn_background(restart_all())
+        return
 
 
 # ---- Help ----
@@ -1093,19 +4350,7 @@ if __name__ == "__main__":
         print("❌ ERROR: TOKEN env var not set")
         sys.exit(1)
 
-    # auto-start apps
-    try:
-        auto_start_last_run_apps()
-    except Exception as e:
-        logger.error(f"Auto-start on boot failed: {e}")
-
-    app_bot = ApplicationBuilder().token(TOKEN).build()
-
-    # start watchdog/alerts (Feature F)
-    try:
-        app_bot.create_task(watchdog_loop(app_bot))
-    except Exception as e:
-        logger.error(f"Watchdog start failed: {e}")
+    app_bot = ApplicationBuilder().token(TOKEN).post_init(post_init).build()
 
     conv_file = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex("^📤 Upload File$"), upload_start)],
@@ -1150,6 +4395,7 @@ if __name__ == "__main__":
     )
 
     app_bot.add_handler(CommandHandler("start", start))
+    app_bot.add_handler(CommandHandler("appset", appset_command))
     app_bot.add_handler(conv_file)
     app_bot.add_handler(conv_git)
 
@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# bot.py opens its stores and scripts/ relative to the cwd at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A fresh JSON ownership store in place of the module's one."""
+    s = bot.OwnershipStore(str(tmp_path / "ownership.json"))
+    monkeypatch.setattr(bot, "ownership_store", s)
+    return s
+
+
+def record(owner=1, **fields):
+    return bot.AppRecord(owner=owner, type="repo", key="k", entry="main.py", **fields)
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import pytest
+
+import bot
+from conftest import record
+
+
+@pytest.fixture
+def apps(store, monkeypatch):
+    monkeypatch.setattr(bot, "BOOT_CONCURRENCY", 2)
+
+    def add(tid, **fields):
+        store.put(tid, record(**fields))
+        return tid
+
+    return add
+
+
+def test_batches_follow_priority_then_order(apps):
+    tids = [apps("a"), apps("b", priority=5), apps("c"), apps("d", priority=-1), apps("e")]
+    assert bot.plan_start_batches(tids) == [["b", "a"], ["c", "e"], ["d"]]
+
+
+def test_dependencies_start_in_an_earlier_batch(apps):
+    tids = [apps("web", priority=9, start_after=["db"]), apps("db"), apps("worker", start_after=["db", "web"])]
+    assert bot.plan_start_batches(tids) == [["db"], ["web"], ["worker"]]
+
+
+def test_dependencies_outside_the_run_are_ignored(apps):
+    tids = [apps("a", start_after=["not-started", "a"]), apps("b")]
+    assert bot.plan_start_batches(tids) == [["a", "b"]]
+
+
+def test_cycles_fall_back_to_priority(apps):
+    tids = [apps("a", start_after=["b"]), apps("b", start_after=["a"], priority=1), apps("c")]
+    assert bot.plan_start_batches(tids) == [["c"], ["b", "a"]]
+
+
+def test_deferred_writes_are_coalesced(store, monkeypatch, tmp_path):
+    writes = []
+    real = bot._write_json
+    monkeypatch.setattr(bot, "_write_json", lambda path, obj: (writes.append(path), real(path, obj)))
+
+    async def main():
+        with store.deferred(delay=0.05):
+            for n in range(20):
+                store.put(f"app{n}", record(pid=n))
+                await asyncio.sleep(0.01)  # launches awaiting readiness
+            assert store.get("app19").pid == 19  # visible before it is written
+        return len(writes)
+
+    total = asyncio.run(main())
+    assert 2 <= total <= 6  # one per flush interval plus the final one, not one per put
+    assert len(json.loads((tmp_path / "ownership.json").read_text())) == 20
+
+
+def test_deferred_write_from_another_thread_is_immediate(store, tmp_path):
+    async def main():
+        with store.deferred(delay=60):
+            store.put("loop", record())
+            await asyncio.to_thread(store.put, "thread", record())
+            return set(json.loads((tmp_path / "ownership.json").read_text()))
+
+    assert asyncio.run(main()) == {"loop", "thread"}
@@ -0,0 +1,122 @@
+import pytest
+
+import bot
+from conftest import record
+
+MB = 1024 * 1024
+
+
+def limits(**fields):
+    bot.ownership_store.put("a", record(**fields))
+    return bot.CgroupManager("/nonexistent", enabled=False).limits_for("a")
+
+
+def test_defaults(store):
+    assert limits() == {
+        "cpu.max": f"{int(bot.APP_CPU_MAX_PERCENT * 1000)} 100000",
+        "memory.max": str(bot.APP_MEMORY_MAX_MB * MB),
+        "memory.high": str(int(bot.APP_MEMORY_MAX_MB * 0.9) * MB),
+        "pids.max": str(bot.APP_PIDS_MAX),
+    }
+
+
+def test_record_overrides(store):
+    assert limits(cpu_max=250, memory_max_mb=100, memory_high_mb=64, pids_max=10) == {
+        "cpu.max": "250000 100000",
+        "memory.max": str(100 * MB),
+        "memory.high": str(64 * MB),
+        "pids.max": "10",
+    }
+
+
+def test_high_defaults_to_90_percent_of_max(store):
+    assert limits(memory_max_mb=200)["memory.high"] == str(180 * MB)
+
+
+def test_zero_is_unlimited(store):
+    assert limits(cpu_max=0, memory_max_mb=0, pids_max=0) == {
+        "cpu.max": "max 100000", "memory.max": "max", "memory.high": "max", "pids.max": "max",
+    }
+
+
+def test_instances_use_their_app_record(store):
+    bot.ownership_store.put("a", record(pids_max=7))
+    cg = bot.CgroupManager("/nonexistent", enabled=False)
+    assert cg.limits_for(bot.instance_key("a", "worker", 2))["pids.max"] == "7"
+
+
+def test_disabled_manager_is_a_no_op(store):
+    cg = bot.CgroupManager("/nonexistent", enabled=False)
+    assert not cg.setup() and cg.prepare("a") is None and cg.usage("a") is None
+
+
+def test_overlap_doubles_the_limits(store):
+    bot.ownership_store.put("a", record(cpu_max=50, memory_max_mb=100, pids_max=10))
+    cg = bot.CgroupManager("/nonexistent", enabled=False)
+    with cg.overlap("a"):
+        assert cg.limits_for("a") == {
+            "cpu.max": "100000 100000",
+            "memory.max": str(200 * MB),
+            "memory.high": str(180 * MB),
+            "pids.max": "20",
+        }
+    assert cg.limits_for("a")["pids.max"] == "10"
+
+
+def test_overlap_keeps_unlimited_unlimited(store):
+    bot.ownership_store.put("a", record(memory_max_mb=0, pids_max=0))
+    cg = bot.CgroupManager("/nonexistent", enabled=False)
+    with cg.overlap("a"):
+        assert cg.limits_for("a")["memory.max"] == "max" and cg.limits_for("a")["pids.max"] == "max"
+
+
+@pytest.fixture
+def fake_tree(tmp_path, monkeypatch):
+    """A stand-in cgroup tree: plain files instead of cgroupfs."""
+    (tmp_path / "cgroup.controllers").write_text("cpu memory pids")
+
+    def enable(self, path):
+        with open(f"{path}/cgroup.subtree_control", "w") as f:
+            f.write("cpu memory pids")
+
+    monkeypatch.setattr(bot.CgroupManager, "_enable_controllers", enable)
+    return tmp_path / "mega"
+
+
+def test_overlap_rewrites_the_leaf_on_exit(store, fake_tree, monkeypatch):
+    monkeypatch.setattr(bot, "OWNER_MEMORY_MAX_MB", 0)
+    monkeypatch.setattr(bot, "OWNER_PIDS_MAX", 0)
+    bot.ownership_store.put("a", record(pids_max=10))
+    cg = bot.CgroupManager(str(fake_tree))
+    leaf = fake_tree / "owner-1" / "app-a"
+
+    with cg.overlap("a"):
+        assert cg.prepare("a") == str(leaf / "cgroup.procs")
+        assert (leaf / "pids.max").read_text() == "20"
+    assert (leaf / "pids.max").read_text() == "10"
+
+
+def test_sample_reads_the_cgroup_without_walking_processes(store, fake_tree, monkeypatch):
+    bot.ownership_store.put("a", record())
+    cg = bot.CgroupManager(str(fake_tree))
+    leaf = fake_tree / "owner-1" / "app-a"
+    cg.prepare("a")
+    (leaf / "cpu.stat").write_text("usage_usec 5000000\nuser_usec 4000000\n")
+    (leaf / "memory.current").write_text(str(64 * 1024 * 1024))
+    (leaf / "pids.current").write_text("12")
+    (leaf / "cgroup.procs").write_text("100\n101\n102\n")
+    monkeypatch.setattr(bot, "cgroups", cg)
+
+    def no_walk(*args):
+        raise AssertionError("walked /proc")
+
+    monkeypatch.setattr(bot.UsageSampler, "sessions", staticmethod(no_walk))
+    monkeypatch.setattr(bot.UsageSampler, "tree", no_walk)
+    u = bot.UsageSampler().sample("a", 100)
+    assert (u.source, u.memory_mb, u.procs, u.threads, u.fds) == ("cgroup", 64, 3, 12, None)
+
+
+def test_sample_without_a_leaf_walks_processes(store, monkeypatch):
+    monkeypatch.setattr(bot, "cgroups", bot.CgroupManager("/nonexistent", enabled=False))
+    u = bot.UsageSampler().sample("a", bot.os.getpid())
+    assert u.source == "tree" and u.procs >= 1 and u.threads >= 1 and u.fds >= 1
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+import bot
+from conftest import record
+
+
+@pytest.fixture
+def queue(store):
+    store.put("a", record())
+    return bot.LifecycleQueue()
+
+
+def run_ops(queue, *ops, log=None):
+    """Start ops on app "a" 10 ms apart (the first one is running when the rest arrive)."""
+    log = [] if log is None else log
+
+    async def main():
+        tasks = []
+        for i, op in enumerate(ops):
+            async def fn(i=i, op=op):
+                log.append((i, op))
+                await asyncio.sleep(0.05)
+                return i
+
+            tasks.append(asyncio.create_task(queue.run("a", op, fn)))
+            await asyncio.sleep(0.01)
+        return await asyncio.gather(*tasks)
+
+    return asyncio.run(main()), log
+
+
+def test_same_op_joins_the_queued_one(queue):
+    results, log = run_ops(queue, "restart", "restart", "restart")
+    # the running op is never joined; the two arriving behind it run once
+    assert results == [0, 1, 1]
+    assert log == [(0, "restart"), (1, "restart")]
+
+
+def test_different_ops_run_in_order(queue):
+    results, log = run_ops(queue, "start", "scale", "restart")
+    assert results == [0, 1, 2]
+    assert [op for _, op in log] == ["start", "scale", "restart"]
+
+
+def test_stop_drops_queued_starts(queue):
+    results, log = run_ops(queue, "stop", "start", "restart", "stop")
+    assert results == [0, False, False, 3]
+    assert [op for _, op in log] == ["stop", "stop"]
+
+
+def test_ops_on_a_deleted_app_report_false(queue, store):
+    store.delete("a")
+    results, log = run_ops(queue, "start")
+    assert results == [False] and log == []
+
+
+def test_failing_op_reports_false_and_the_queue_goes_on(queue):
+    async def boom():
+        raise RuntimeError("boom")
+
+    async def ok():
+        return True
+
+    async def main():
+        first = asyncio.create_task(queue.run("a", "start", boom))
+        second = asyncio.create_task(queue.run("a", "stop", ok))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(main()) == [False, True]
+    assert not queue.busy("a")
+
+
+def test_describe_shows_running_and_queued(queue):
+    async def main():
+        gate = asyncio.Event()
+
+        async def wait():
+            await gate.wait()
+            return True
+
+        tasks = [asyncio.create_task(queue.run("a", op, wait)) for op in ("start", "scale", "restart")]
+        await asyncio.sleep(0.01)
+        text = queue.describe("a")
+        gate.set()
+        await asyncio.gather(*tasks)
+        return text
+
+    assert asyncio.run(main()) == "start (running) → scale → restart"
+    assert not queue.busy("a") and queue.describe("a") == ""
@@ -0,0 +1,61 @@
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def spreader(monkeypatch):
+    monkeypatch.setattr(bot.CoreSpreader, "cores", staticmethod(lambda: [0, 1, 2, 3]))
+    monkeypatch.setattr(bot, "SPREAD_IMBALANCE_PERCENT", 50)
+    return bot.CoreSpreader(alpha=1.0)
+
+
+def test_cold_start_spreads_by_app_count(spreader):
+    assert [spreader.place(t)[0] for t in "abcde"] == [0, 1, 2, 3, 0]
+
+
+def test_place_prefers_the_least_loaded_cores(spreader):
+    for tid, cpu in (("a", 90), ("b", 10), ("c", 50)):
+        spreader.place(tid)  # cores 0, 1, 2
+        spreader.sample(tid, cpu)
+    spreader.pin("d", [3])
+    spreader.sample("d", 80)
+    assert spreader.place("new", 2) == [1, 2]
+
+
+def test_replacing_an_app_ignores_its_own_load(spreader):
+    spreader.place("a")
+    spreader.sample("a", 100)
+    assert spreader.place("a") == [0]
+
+
+def test_sample_is_an_ewma():
+    s = bot.CoreSpreader(alpha=0.5)
+    s.placement["a"] = [0]
+    s.sample("a", 100)
+    s.sample("a", 0)
+    assert s.load["a"] == 50
+    s.sample("unplaced", 100)
+    assert "unplaced" not in s.load
+
+
+def test_rebalance_moves_one_app_off_the_hot_core(spreader):
+    for tid in ("a", "b"):
+        spreader.placement[tid] = [0]
+        spreader.sample(tid, 60)
+    spreader.placement["c"] = [1]
+    spreader.placement["d"] = [2]
+    spreader.placement["e"] = [3]
+    moves = spreader.rebalance()
+    assert len(moves) == 1 and moves[0][1] in ([1], [2], [3])
+    assert spreader.rebalance() == []  # 60 vs 60: balanced now
+
+
+def test_rebalance_leaves_pinned_apps_and_small_gaps(spreader):
+    spreader.pin("a", [0])
+    spreader.sample("a", 100)
+    assert spreader.rebalance() == []
+    spreader.forget("a")
+    spreader.placement["b"] = [0]
+    spreader.sample("b", 40)  # gap below SPREAD_IMBALANCE_PERCENT
+    assert spreader.rebalance() == []
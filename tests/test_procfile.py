@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+import bot
+from conftest import record
+
+PROCFILE = """\
+# comment
+web: gunicorn app:app --bind 0.0.0.0:$PORT
+
+worker:python -u worker.py
+bad name: ignored
+empty:
+release: python manage.py migrate
+"""
+
+
+def test_parse_procfile(tmp_path):
+    (tmp_path / "Procfile").write_text(PROCFILE)
+    assert bot.parse_procfile(str(tmp_path)) == {
+        "web": "gunicorn app:app --bind 0.0.0.0:$PORT",
+        "worker": "python -u worker.py",
+        "release": "python manage.py migrate",
+    }
+
+
+def test_parse_procfile_missing(tmp_path):
+    assert bot.parse_procfile(str(tmp_path)) == {}
+
+
+def test_scale_parses_pairs():
+    assert bot._scale("web=1,worker=3") == {"web": 1, "worker": 3}
+    assert bot._scale("worker=0") == {"worker": 0}
+
+
+@pytest.mark.parametrize("raw", ["web", "web=", "web=-1", "web=x", "we b=1", f"web={bot.MAX_REPLICAS + 1}", ""])
+def test_scale_rejects(raw):
+    with pytest.raises(ValueError):
+        bot._scale(raw)
+
+
+def test_instance_keys():
+    key = bot.instance_key("repo|main.py", "worker", 2)
+    assert bot.app_id(key) == "repo|main.py"
+    assert bot.instance_name(key) == "worker.2"
+    assert bot.instance_name("repo|main.py") is None
+
+
+@pytest.fixture
+def repo(store):
+    work_dir = os.path.join(bot.UPLOAD_DIR, "procrepo")
+    os.makedirs(work_dir, exist_ok=True)
+    with open(os.path.join(work_dir, "Procfile"), "w") as f:
+        f.write("web: sh web.sh\nworker: sh worker.sh\n")
+    store.put("procrepo|main.py", record(owner=7))
+    return "procrepo|main.py"
+
+
+def test_desired_instances_follow_scale(repo, store):
+    assert bot.desired_instances(repo) == [f"{repo}#web.1", f"{repo}#worker.1"]
+    store.update(repo, scale={"web": 0, "worker": 2})
+    assert bot.desired_instances(repo) == [f"{repo}#worker.1", f"{repo}#worker.2"]
+
+
+def test_procfile_off_runs_the_entry_file(repo, store):
+    store.update(repo, procfile=False)
+    assert bot.procfile_types(repo) == {} and bot.desired_instances(repo) == []
+
+
+def test_owner_instances_counts_the_proposed_scale(repo, store):
+    store.update(repo, scale={"worker": 3})
+    assert bot.owner_instances(7) == 4
+    assert bot.owner_instances(7, repo, {"web": 2, "worker": 5}) == 7
+
+
+def test_command_without_plain_argv_uses_sh(tmp_path):
+    assert bot.procfile_argv(str(tmp_path), "sh a.sh | tee x") == ["/bin/sh", "-c", "sh a.sh | tee x"]
+
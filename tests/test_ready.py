@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import pytest
+
+import bot
+
+SLOW = r"\w*\w*\w*\w*b"  # polynomial backtracking: many seconds on one 500 character line
+
+
+class Running:
+    def poll(self):
+        return None
+
+
+def search(pattern, lines):
+    async def main():
+        matcher = bot.LogMatcher(pattern)
+        try:
+            return await matcher.search(lines)
+        finally:
+            await matcher.close()
+
+    return asyncio.run(main())
+
+
+def test_matcher_searches_every_line():
+    assert search(r"listening on \d+", ["starting", "listening on 8080"])
+    assert not search(r"listening on \d+", ["starting", "listening on port"])
+
+
+def test_matcher_is_killed_when_too_slow(monkeypatch):
+    monkeypatch.setattr(bot, "READY_LOG_MATCH_SEC", 0.5)
+    t0 = time.monotonic()
+    with pytest.raises(ValueError):
+        search(SLOW, ["a" * bot.READY_LOG_MAX_LINE])
+    assert time.monotonic() - t0 < 3
+
+
+def wait(log, pattern, timeout=5):
+    async def main():
+        deadline = asyncio.get_running_loop().time() + timeout
+        return await bot.wait_for_log(Running(), str(log), 0, pattern, deadline)
+
+    return asyncio.run(main())
+
+
+def test_wait_for_log_matches_a_complete_line(tmp_path):
+    log = tmp_path / "app.log"
+    log.write_text("booting\nserver ready\n")
+    assert wait(log, "server (started|ready)")
+    log.write_text("server ready")  # no newline yet: the line may still grow
+    assert not wait(log, "ready$", timeout=0.5)
+
+
+def test_wait_for_log_gives_up_on_a_slow_pattern(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "READY_LOG_MATCH_SEC", 0.5)
+    log = tmp_path / "app.log"
+    log.write_text("a" * 5000 + "\n")
+    t0 = time.monotonic()
+    assert not wait(log, SLOW, timeout=30)
+    assert time.monotonic() - t0 < 3
+
+
+def test_percentile_is_nearest_rank():
+    values = [5, 1, 4, 2, 3]
+    assert [bot.percentile(values, p) for p in (0, 20, 50, 95, 100)] == [1, 1, 3, 5, 5]
+    assert bot.percentile([7], 95) == 7
+
+
+def test_ready_summary(monkeypatch):
+    monkeypatch.setattr(bot, "ready_times", {"a": bot.deque([1.0, 3.0, 2.0])})
+    monkeypatch.setattr(bot, "ready_failures", {"a": 1, "b": 2})
+    assert bot.ready_summary("a") == "last 2.00s · p50 2.00s · p95 3.00s (n=3), 1 failed"
+    assert bot.ready_summary("b") == "never ready (2 failed)"
+    assert bot.ready_summary("c") == ""
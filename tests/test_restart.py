@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+import bot
+from conftest import record
+
+
+@pytest.fixture
+def down(store, monkeypatch):
+    """handle_app_down for app "a" with alerts and background restarts stubbed out."""
+    store.put("a", record(last_run=True))
+    monkeypatch.setattr(bot, "restart_states", {})
+    alerts = []
+
+    async def alert(app_bot, tid, reason="", action="", title=""):
+        alerts.append(title or action)
+
+    def spawn(coro):
+        coro.close()
+        return "restart-task"
+
+    monkeypatch.setattr(bot, "alert_app_down", alert)
+    monkeypatch.setattr(bot, "spawn_background", spawn)
+
+    def run(returncode=1):
+        asyncio.run(bot.handle_app_down(None, "a", returncode, "exited"))
+        return bot.restart_states.get("a")
+
+    run.alerts = alerts
+    return run
+
+
+def test_backoff_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(bot.random, "uniform", lambda lo, hi: 0)
+    delays = [bot.backoff_delay(n) for n in range(12)]
+    assert delays[:3] == [bot.RESTART_BACKOFF_BASE_SEC * 2 ** n for n in range(3)]
+    assert max(delays) == bot.RESTART_BACKOFF_MAX_SEC
+
+
+def test_backoff_jitter_is_bounded():
+    for _ in range(100):
+        d = bot.backoff_delay(0)
+        assert bot.RESTART_BACKOFF_BASE_SEC <= d <= bot.RESTART_BACKOFF_BASE_SEC * (1 + bot.RESTART_BACKOFF_JITTER)
+
+
+def test_crash_schedules_a_delayed_restart(down):
+    st = down()
+    assert st.attempt == 1 and st.task == "restart-task" and not st.quarantined
+    assert st.next_at > time.time()
+
+
+def test_pending_restart_is_not_scheduled_twice(down):
+    down()
+    st = down()
+    assert st.attempt == 1 and len(down.alerts) == 1
+
+
+def test_crash_loop_quarantines(down):
+    st = bot.RestartState()
+    st.restarts.extend([time.time()] * bot.CRASH_LOOP_RESTARTS)
+    bot.restart_states["a"] = st
+    assert down().quarantined and st.task is None
+    assert down.alerts == ["⛔ App CRASH-LOOPING"]
+    down()  # quarantined: no further restarts or alerts
+    assert len(down.alerts) == 1
+
+
+def test_old_restarts_leave_the_window(down):
+    st = bot.RestartState()
+    st.restarts.extend([time.time() - bot.CRASH_LOOP_WINDOW_SEC - 1] * bot.CRASH_LOOP_RESTARTS)
+    bot.restart_states["a"] = st
+    assert not down().quarantined and not st.restarts
+
+
+def test_on_failure_policy_stops_after_a_clean_exit(down, store, monkeypatch):
+    store.update("a", restart_policy="on-failure")
+    stopped = []
+
+    async def stop(tid):
+        stopped.append(tid)
+
+    monkeypatch.setattr(bot, "stop_process", stop)
+    st = down(returncode=0)
+    assert stopped == ["a"] and st.task is None
+
+
+def test_reset_lifts_quarantine(down):
+    st = bot.RestartState()
+    st.quarantined = True
+    bot.restart_states["a"] = st
+    bot.reset_restart_state("a")
+    assert "a" not in bot.restart_states
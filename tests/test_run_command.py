@@ -0,0 +1,121 @@
+import json
+import os
+
+import pytest
+
+import bot
+
+
+def touch(path, ns):
+    os.utime(path, ns=(ns, ns))
+
+
+@pytest.fixture
+def app_dir(tmp_path):
+    (tmp_path / "main.py").write_text("print('hi')\n")
+    return tmp_path
+
+
+def test_cache_reuses_until_the_fingerprint_changes(app_dir):
+    cache = bot.RunCommandCache()
+    assert cache.resolve(str(app_dir), None) == (["python", "-u", "main.py"], "main.py")
+    assert cache.resolve(str(app_dir), None) == (["python", "-u", "main.py"], "main.py")
+    assert (cache.misses, cache.hits) == (1, 1)
+    (app_dir / "package.json").write_text(json.dumps({"scripts": {"start": "npm run serve"}}))
+    touch(app_dir, 10**18)  # a new file changes the directory mtime
+    cmd, chosen = cache.resolve(str(app_dir), None)
+    assert cmd == ["npm", "start"] and chosen is None and cache.misses == 2
+
+
+def test_cache_sees_an_edited_package_json(app_dir):
+    pkg = app_dir / "package.json"
+    pkg.write_text(json.dumps({"scripts": {}}))
+    cache = bot.RunCommandCache()
+    assert cache.resolve(str(app_dir), "index.js") == (["node", "index.js"], "index.js")
+    pkg.write_text(json.dumps({"scripts": {"start": "npm run serve"}}))
+    touch(pkg, 10**18)
+    assert cache.resolve(str(app_dir), "index.js") == (["npm", "start"], None)
+
+
+def test_cache_returns_a_fresh_argv(app_dir):
+    cache = bot.RunCommandCache()
+    cache.resolve(str(app_dir), None)[0].append("--mutated")
+    assert cache.resolve(str(app_dir), None)[0] == ["python", "-u", "main.py"]
+
+
+def test_cache_invalidate(app_dir, tmp_path_factory):
+    other = tmp_path_factory.mktemp("other")
+    (other / "app.py").write_text("")
+    cache = bot.RunCommandCache()
+    for d in (app_dir, other):
+        cache.resolve(str(d), None)
+    cache.invalidate(str(app_dir) + "/")  # same directory, other spelling
+    cache.resolve(str(app_dir), None)
+    cache.resolve(str(other), None)
+    assert (cache.misses, cache.hits) == (3, 1)
+    cache.invalidate()
+    cache.resolve(str(other), None)
+    assert cache.misses == 4
+
+
+@pytest.fixture
+def work_dir(tmp_path):
+    bin_dir = tmp_path / "node_modules" / ".bin"
+    bin_dir.mkdir(parents=True)
+    (bin_dir / "next").write_text("#!/bin/sh\n")
+    return str(tmp_path)
+
+
+def test_plain_command_is_split(work_dir):
+    assert bot.plain_argv(work_dir, "sh server.sh --port 80") == ["sh", "server.sh", "--port", "80"]
+
+
+def test_quotes_are_honoured(work_dir):
+    assert bot.plain_argv(work_dir, "sh -c 'echo hi'") == ["sh", "-c", "echo hi"]
+
+
+def test_local_bin_is_resolved(work_dir):
+    argv = bot.plain_argv(work_dir, "next start")
+    assert argv == [os.path.join(work_dir, "node_modules", ".bin", "next"), "start"]
+
+
+def test_assignments_go_through_env(work_dir):
+    assert bot.plain_argv(work_dir, "NODE_ENV=production sh a.sh") == ["env", "NODE_ENV=production", "sh", "a.sh"]
+
+
+@pytest.mark.parametrize("command", [
+    "sh a.sh && sh b.sh",
+    "sh a.sh | tee log",
+    "sh $SCRIPT",
+    "sh *.sh",
+    "sh 'unterminated",
+    "",
+    "no-such-program-here --flag",
+])
+def test_commands_needing_a_shell_or_unknown(work_dir, command):
+    assert bot.plain_argv(work_dir, command) is None
+
+
+def test_rejected_runner(work_dir):
+    assert bot.plain_argv(work_dir, "sh a.sh", reject=("sh",)) is None
+
+
+def test_npm_start_execs_the_command(work_dir):
+    assert bot.npm_start_argv(work_dir, {"start": "next start -p 3000"})[1:] == ["start", "-p", "3000"]
+
+
+@pytest.mark.parametrize("scripts", [
+    {"start": "next start", "prestart": "next build"},
+    {"start": "next start", "poststart": "echo done"},
+    {"start": "npm run serve"},
+    {"start": "next build && next start"},
+    {"start": "no-such-program-here"},
+    {},
+])
+def test_npm_start_falls_back_to_npm(work_dir, scripts):
+    assert bot.npm_start_argv(work_dir, scripts) == ["npm", "start"]
+
+
+def test_npm_direct_exec_can_be_disabled(work_dir, monkeypatch):
+    monkeypatch.setattr(bot, "NPM_DIRECT_EXEC", False)
+    assert bot.npm_start_argv(work_dir, {"start": "next start"}) == ["npm", "start"]
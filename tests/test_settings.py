@@ -0,0 +1,149 @@
+import pytest
+
+import bot
+from conftest import record
+
+
+def parse(name, raw):
+    return bot.APP_SETTINGS[name][0](raw)
+
+
+def owner_check(name, value):
+    rule = bot.APP_SETTINGS[name][2]
+    if rule is False:
+        raise ValueError("admin only")
+    if callable(rule):
+        rule(value)
+
+
+def test_every_setting_is_a_record_field():
+    assert set(bot.APP_SETTINGS) <= set(bot.AppRecord.OPTIONAL)
+
+
+@pytest.mark.parametrize("name, raw, value", [
+    ("restart_policy", "on-failure", "on-failure"),
+    ("stop_grace_sec", "2.5", 2.5),
+    ("priority", "-3", -3),
+    ("start_after", "a,,b", ["a", "b"]),
+    ("cpu_max", "150", 150.0),
+    ("memory_max_mb", "256", 256),
+    ("pids_max", "0", 0),
+    ("on_demand", "on", True),
+    ("on_demand", "off", None),
+    ("procfile", "off", False),
+    ("procfile", "on", None),
+])
+def test_valid_values(name, raw, value):
+    assert parse(name, raw) == value
+
+
+@pytest.mark.parametrize("name, raw", [
+    ("restart_policy", "sometimes"),
+    ("stop_grace_sec", "601"),
+    ("priority", "1.5"),
+    ("cpu_max", "-1"),
+    ("memory_max_mb", "1.5"),
+    ("on_demand", "yes"),
+    ("procfile", "maybe"),
+])
+def test_invalid_values(name, raw):
+    with pytest.raises(ValueError):
+        parse(name, raw)
+
+
+@pytest.mark.parametrize("name, value", [
+    ("cpu_max", bot.APP_CPU_MAX_PERCENT / 2),
+    ("memory_max_mb", bot.APP_MEMORY_MAX_MB),
+    ("restart_policy", "never"),
+])
+def test_owner_may_set(name, value):
+    owner_check(name, value)
+
+
+@pytest.mark.parametrize("name, value", [
+    ("cpu_max", 0),
+    ("memory_max_mb", bot.APP_MEMORY_MAX_MB + 1),
+    ("pids_max", bot.APP_PIDS_MAX * 2),
+])
+def test_owner_may_not_set(name, value):
+    with pytest.raises(ValueError):
+        owner_check(name, value)
+
+
+def test_owner_may_only_lower_limits():
+    check = bot._owner_lower(100)
+    check(50)
+    for v in (0, 101):  # 0 = unlimited
+        with pytest.raises(ValueError):
+            check(v)
+    bot._owner_lower(0)(500)  # no default limit: nothing to protect
+
+
+@pytest.mark.parametrize("raw, value", [
+    ("0,2-3", [0, 2, 3]),
+    ("auto", "auto"),
+    ("auto:2", "auto:2"),
+])
+def test_cpus(raw, value):
+    assert parse("cpus", raw) == value
+
+
+@pytest.mark.parametrize("name, raw", [
+    ("cpus", "auto:0"),
+    ("cpus", "a-b"),
+    ("nice", "20"),
+    ("ionice", "idle:3"),
+    ("ionice", "be:8"),
+    ("ionice", "rt:12"),
+    ("ionice", "fast"),
+])
+def test_invalid_scheduling(name, raw):
+    with pytest.raises(ValueError):
+        parse(name, raw)
+
+
+def test_owner_scheduling_rules():
+    owner_check("nice", 10)
+    owner_check("ionice", "be:4")
+    owner_check("ionice", "idle")
+    for name, value in (("nice", -5), ("ionice", "rt:0"), ("ionice", "rt")):
+        with pytest.raises(ValueError):
+            owner_check(name, value)
+
+
+def test_port():
+    assert parse("port", "12000") == 12000
+    for raw in ("80", "1023", "65536"):
+        with pytest.raises(ValueError):
+            parse("port", raw)
+    owner_check("port", bot.PUBLIC_PORT_MIN)
+    for value in (bot.PUBLIC_PORT_MIN - 1, bot.PUBLIC_PORT_MAX + 1):
+        with pytest.raises(ValueError):
+            owner_check("port", value)
+
+
+def test_health_path():
+    assert parse("health_path", "/health") == "/health"
+    with pytest.raises(ValueError):
+        parse("health_path", "health")
+
+
+@pytest.mark.parametrize("raw", [r"listening on \d+", "server (started|ready)", "(a+)+$"])
+def test_ready_log(raw):
+    assert parse("ready_log", raw) == raw
+
+
+@pytest.mark.parametrize("raw", ["(unclosed", "x" * (bot.READY_LOG_MAX_PATTERN + 1)])
+def test_invalid_ready_log(raw):
+    with pytest.raises(ValueError):
+        parse("ready_log", raw)
+
+
+def test_port_taken(store, monkeypatch):
+    monkeypatch.setenv("PORT", "8080")
+    store.put("a", record(port=12000, backend_port=40000))
+    assert bot.port_taken("b", 8080) == "the bot's web server"
+    assert bot.port_taken("b", 12000) == "a"
+    assert bot.port_taken("b", 40000) == "a"
+    assert bot.port_taken("a", 12000) is None
+    assert bot.port_taken("b", 12001) is None
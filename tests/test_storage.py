@@ -0,0 +1,287 @@
+import json
+
+import pytest
+
+import bot
+from conftest import record
+
+
+def _json(path):
+    return bot.OwnershipStore(str(path / "ownership.json"))
+
+
+def _journal(path):
+    return bot.JournaledOwnershipStore(str(path / "ownership.json"))
+
+
+def _sqlite(path):
+    return bot.SqliteOwnershipStore(bot.SqliteDB(str(path / "hosting.db")))
+
+
+@pytest.fixture(params=[_json, _journal, _sqlite], ids=["json", "journal", "sqlite"])
+def open_store(request, tmp_path):
+    opened = []
+
+    def make():
+        s = request.param(tmp_path)
+        opened.append(s)
+        return s
+
+    yield make
+    for s in opened:
+        if isinstance(s, bot.JournaledOwnershipStore):
+            s.flush()
+
+
+def test_store_put_get_update_delete(open_store):
+    s = open_store()
+    s.put("a", record())
+    assert s.get("a") == record()
+    assert s.get("missing") is None
+    s.update("a", pid=9)
+    assert s.get("a").pid == 9
+    s.update("missing", pid=9)  # no-op
+    assert s.get("missing") is None
+    s.delete("a")
+    assert s.get("a") is None and s.count() == 0
+
+
+def test_store_indexes(open_store):
+    s = open_store()
+    s.put("a", record(owner=1, last_run=True))
+    s.put("b", record(owner=1))
+    s.put("c", record(owner=2, last_run=True))
+    assert sorted(s.ids_for_owner(1)) == ["a", "b"]
+    assert sorted(s.last_run_ids()) == ["a", "c"]
+    s.update("a", last_run=False, owner=2)
+    assert s.ids_for_owner(1) == ["b"]
+    assert sorted(s.ids_for_owner(2)) == ["a", "c"]
+    assert s.last_run_ids() == ["c"]
+    assert s.count() == 3 and set(s.all()) == {"a", "b", "c"}
+
+
+def test_store_rename(open_store):
+    s = open_store()
+    s.put("old", record(last_run=True))
+    assert s.rename("old", "new", entry="app.py")
+    assert s.get("old") is None
+    assert s.get("new").entry == "app.py" and s.last_run_ids() == ["new"]
+    assert not s.rename("old", "other")
+
+
+def test_store_survives_reopen(open_store):
+    s = open_store()
+    s.put("a", record(scale={"worker": 2}))
+    s.delete("a")
+    s.put("b", record(pid=1))
+    reopened = open_store()
+    assert reopened.get("a") is None
+    assert reopened.get("b") == record(pid=1)
+
+
+@pytest.fixture
+def json_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "OWNERSHIP_FILE", str(tmp_path / "ownership.json"))
+    monkeypatch.setattr(bot, "USERS_FILE", str(tmp_path / "allowed_users.json"))
+    (tmp_path / "ownership.json").write_text(json.dumps({
+        "a": record(owner=1, last_run=True).to_dict(),
+        "b": dict(record(owner=2).to_dict(), legacy_key="kept"),
+    }))
+    (tmp_path / "allowed_users.json").write_text(json.dumps([5, 6]))
+    return tmp_path
+
+
+def test_migrate_json_to_sqlite(json_files):
+    db = bot.SqliteDB(str(json_files / "hosting.db"))
+    bot.migrate_json_to_sqlite(db)
+    apps, users = bot.SqliteOwnershipStore(db), bot.SqliteUserStore(db)
+    assert apps.get("a") == record(owner=1, last_run=True)
+    assert apps.get("b").opt("legacy_key") == "kept"
+    assert apps.last_run_ids() == ["a"] and apps.ids_for_owner(2) == ["b"]
+    assert users.all() == [5, 6]
+
+
+def test_migrate_json_to_sqlite_runs_once(json_files):
+    db = bot.SqliteDB(str(json_files / "hosting.db"))
+    bot.migrate_json_to_sqlite(db)
+    bot.SqliteOwnershipStore(db).delete("a")
+    bot.migrate_json_to_sqlite(db)  # the JSON files are left in place but not imported again
+    assert bot.SqliteOwnershipStore(db).get("a") is None
+
+
+def test_journal_replays_over_the_snapshot(tmp_path):
+    s = _journal(tmp_path)
+    s.put("a", record())
+    s.compact()  # a is in ownership.json now
+    s.put("b", record())
+    s.update("a", pid=4)
+    s.delete("b")
+    s.flush()
+    assert json.loads((tmp_path / "ownership.json").read_text()) == {"a": record().to_dict()}
+    reopened = _journal(tmp_path)
+    assert reopened.all() == {"a": record(pid=4)}
+
+
+def test_journal_torn_tail_is_cut(tmp_path):
+    s = _journal(tmp_path)
+    s.put("a", record())
+    s.flush()
+    with open(tmp_path / "ownership.json.journal", "a") as f:
+        f.write('{"t": "b", "r": {"ow')  # crash mid-append
+    s = _journal(tmp_path)
+    assert set(s.all()) == {"a"}
+    s.put("c", record())
+    s.put("d", record())
+    s.flush()
+    assert set(_journal(tmp_path).all()) == {"a", "c", "d"}
+
+
+def test_journal_line_without_newline_is_torn(tmp_path):
+    s = _journal(tmp_path)
+    s.put("a", record())
+    s.flush()
+    with open(tmp_path / "ownership.json.journal", "a") as f:
+        f.write(json.dumps({"t": "b", "r": None}))
+    s = _journal(tmp_path)
+    s.put("c", record())
+    s.flush()
+    assert set(_journal(tmp_path).all()) == {"a", "c"}
+
+
+def test_store_batch_is_visible_and_persisted(open_store):
+    s = open_store()
+    with s.batch():
+        for tid in ("a", "b"):
+            s.put(tid, record())
+        s.update("a", pid=3)
+        assert s.get("a").pid == 3
+    reopened = open_store()
+    assert reopened.get("a").pid == 3 and reopened.get("b") == record()
+
+
+def test_json_batch_writes_once(tmp_path, monkeypatch):
+    s = _json(tmp_path)
+    writes = []
+    real = bot._write_json
+    monkeypatch.setattr(bot, "_write_json", lambda path, obj: (writes.append(path), real(path, obj)))
+    with s.batch():
+        with s.batch():  # nested: only the outermost one writes
+            for n in range(10):
+                s.put(f"app{n}", record())
+        s.update("app0", pid=1)
+    assert len(writes) == 1
+    s.update("app0", pid=1)  # unchanged: no write at all
+    assert len(writes) == 1
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def users(request, tmp_path):
+    if request.param == "sqlite":
+        return bot.SqliteUserStore(bot.SqliteDB(str(tmp_path / "hosting.db")))
+    return bot.UserStore(str(tmp_path / "allowed_users.json"))
+
+
+def test_allowed_users_cache_hits(users):
+    users.add(5)
+    cache = bot.AllowedUsersCache(users)
+    assert cache.is_allowed(5) and not cache.is_allowed(6)
+    for _ in range(10):
+        assert cache.is_allowed(5)
+    assert (cache.reloads, cache.hits) == (1, 11)
+
+
+def test_allowed_users_cache_reloads_on_invalidate(users):
+    cache = bot.AllowedUsersCache(users)
+    assert not cache.is_allowed(5)
+    users.add(5)
+    cache.invalidate()
+    assert cache.is_allowed(5) and cache.reloads == 2
+
+
+def test_allowed_users_cache_sees_other_writers(users, tmp_path):
+    cache = bot.AllowedUsersCache(users)
+    assert not cache.is_allowed(7)
+    # another process edits the file / database
+    if isinstance(users, bot.SqliteUserStore):
+        other = bot.SqliteUserStore(bot.SqliteDB(users.db.path))
+    else:
+        other = bot.UserStore(users.path)
+        bot.time.sleep(0.01)  # distinct mtime
+    other.add(7)
+    other.add(8)
+    assert cache.is_allowed(7) and cache.is_allowed(8)
+
+
+def test_sqlite_stamp_is_stable_across_pooled_readers(tmp_path):
+    users = bot.SqliteUserStore(bot.SqliteDB(str(tmp_path / "hosting.db")))
+    stamps = set()
+
+    def read():
+        stamps.add(users.stamp())
+        users.db.query("SELECT 1")
+
+    other = bot.SqliteUserStore(bot.SqliteDB(users.db.path))
+    other.add(1)  # some connections have now seen a foreign commit, others not
+    threads = [bot.threading.Thread(target=read) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(stamps) == 1
+
+
+def test_json_reads_do_not_wait_for_a_write(tmp_path, monkeypatch):
+    s = _json(tmp_path)
+    s.put("a", record())
+    writing, release = bot.threading.Event(), bot.threading.Event()
+    real = bot._write_json
+
+    def slow_write(path, obj):
+        real(path, obj)
+        writing.set()
+        release.wait(5)  # the file is replaced, its new sig not recorded yet
+
+    monkeypatch.setattr(bot, "_write_json", slow_write)
+    writer = bot.threading.Thread(target=s.put, args=("b", record()))
+    writer.start()
+    writing.wait(5)
+    seen = []
+    reader = bot.threading.Thread(target=lambda: seen.append(set(s.all())))
+    reader.start()
+    reader.join(1)
+    finished = not reader.is_alive()
+    release.set()
+    writer.join()
+    assert finished and seen == [{"a", "b"}]
+
+
+def test_json_store_picks_up_external_edits(tmp_path):
+    s = _json(tmp_path)
+    s.put("a", record())
+    bot.time.sleep(0.01)  # distinct mtime
+    (tmp_path / "ownership.json").write_text(json.dumps({"z": record().to_dict()}))
+    assert set(s.all()) == {"z"}
+
+
+def test_app_record_round_trip():
+    rec = record(pid=42, scale={"web": 2}, ready_log="up", last_run=True)
+    d = rec.to_dict()
+    assert "pid" in d and "cpu_max" not in d  # optional fields only when set
+    assert bot.AppRecord.from_dict(d) == rec
+
+
+def test_app_record_keeps_unknown_keys():
+    rec = bot.AppRecord.from_dict({"owner": 1, "type": "file", "future_field": [1, 2]})
+    assert rec.opt("future_field") == [1, 2]
+    assert rec.replace(pid=7).to_dict()["future_field"] == [1, 2]
+
+
+def test_app_record_rejects_unknown_fields():
+    with pytest.raises(TypeError):
+        bot.AppRecord(owner=1, no_such_field=1)
+
+
+def test_app_record_replace_leaves_original():
+    rec = record()
+    assert rec.replace(pid=5).pid == 5
+    assert rec.pid is None
@@ -0,0 +1,201 @@
+"""
+Pre-forked Python launcher for hosted apps (bot.py, ZYGOTE_ENABLED=1).
+
+The zygote imports ZYGOTE_PRELOAD once and then forks one child per app, so
+a start skips interpreter start-up and the heavy imports, and the preloaded
+modules' pages stay shared copy-on-write between apps.
+
+Stdlib only. It speaks JSON lines on stdin/stdout:
+
+  -> {"id": 1, "op": "spawn", "script": "main.py", "cwd": "...", "env": {...},
+      "log": "...", "cgroup_procs": "..." | null, "nice": 5 | null, "cores": [0] | null}
+  <- {"id": 1, "pid": 1234}                   or {"id": 1, "error": "..."}
+  -> {"id": 2, "op": "ping"}
+  <- {"id": 2, "pong": true, "preloaded": ["telegram", ...]}
+  <- {"event": "exit", "pid": 1234, "returncode": 0}   (negative = killed by signal)
+
+The reply to a spawn is written once the child has placed itself (session,
+cgroup, nice, cores), and always before that child's exit event. On EOF
+(the bot went away) the zygote exits and leaves running apps alone.
+"""
+import importlib
+import io
+import json
+import os
+import runpy
+import select
+import signal
+import sys
+import traceback
+
+
+class _Child(BaseException):
+    """Raised in a freshly forked child to unwind out of the zygote loop."""
+
+    def __init__(self, req):
+        self.req = req
+
+
+def preload(spec: str) -> list:
+    loaded = []
+    for name in filter(None, (m.strip() for m in spec.split(","))):
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as e:
+            print(f"zygote: preload {name} failed: {e}", file=sys.stderr, flush=True)
+    return loaded
+
+
+class Zygote:
+    def __init__(self, preloaded: list):
+        self.preloaded = preloaded
+        self.out = sys.stdout
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+
+    def send(self, msg: dict):
+        try:
+            self.out.write(json.dumps(msg) + "\n")
+            self.out.flush()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.send({"event": "exit", "pid": pid, "returncode": os.waitstatus_to_exitcode(status)})
+
+    def handle(self, req: dict):
+        op = req.get("op")
+        if op == "ping":
+            self.send({"id": req.get("id"), "pong": True, "preloaded": self.preloaded})
+        elif op == "spawn":
+            placed_r, placed_w = os.pipe()
+            try:
+                pid = os.fork()
+            except OSError as e:
+                os.close(placed_r)
+                os.close(placed_w)
+                self.send({"id": req.get("id"), "error": str(e)})
+                return
+            if pid == 0:
+                os.close(placed_r)
+                raise _Child(dict(req, placed_fd=placed_w))
+            # the child closes its end after placing itself (or dies); the bot checks the cgroup on reply
+            os.close(placed_w)
+            os.read(placed_r, 1)
+            os.close(placed_r)
+            self.send({"id": req.get("id"), "pid": pid})
+        else:
+            self.send({"id": req.get("id"), "error": f"unknown op {op!r}"})
+
+    def serve(self):
+        signal.set_wakeup_fd(self.wake_w)
+        signal.signal(signal.SIGCHLD, lambda *a: None)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C on the bot's terminal; EOF stops us
+        stdin_fd = sys.stdin.fileno()
+        buf = b""
+        while True:
+            ready, _, _ = select.select([stdin_fd, self.wake_r], [], [])
+            if self.wake_r in ready:
+                try:
+                    while os.read(self.wake_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            self.reap()
+            if stdin_fd not in ready:
+                continue
+            chunk = os.read(stdin_fd, 65536)
+            if not chunk:
+                return
+            buf += chunk
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                if not line.strip():
+                    continue
+                try:
+                    req = json.loads(line)
+                except ValueError as e:
+                    self.send({"error": f"bad request: {e}"})
+                    continue
+                self.handle(req)
+
+    def close_in_child(self):
+        signal.set_wakeup_fd(-1)
+        for sig in (signal.SIGCHLD, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
+
+def setup_child(req: dict):
+    """Same placement as bot.make_preexec, then cwd/env/stdio like Popen would set up."""
+    os.setsid()
+    if req.get("cgroup_procs"):
+        try:
+            with open(req["cgroup_procs"], "w") as f:
+                f.write(str(os.getpid()))
+        except OSError:
+            pass
+    if req.get("nice") is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, req["nice"])
+        except OSError:
+            pass
+    if req.get("cores"):
+        try:
+            os.sched_setaffinity(0, req["cores"])
+        except OSError:
+            pass
+    os.close(req["placed_fd"])  # lets the zygote reply
+
+    log_fd = os.open(req["log"], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.chdir(req["cwd"])
+    os.environ.clear()
+    os.environ.update(req.get("env") or {})
+
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(null_fd)
+    os.close(log_fd)
+    # unbuffered, like `python -u`
+    sys.stdin = io.TextIOWrapper(io.FileIO(0, "r", closefd=False))
+    sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False), line_buffering=True, write_through=True)
+    sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False), line_buffering=True, write_through=True)
+
+    script = req["script"]
+    sys.argv = [script] + list(req.get("args") or [])
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    return script
+
+
+def main():
+    zygote = Zygote(preload(os.environ.get("ZYGOTE_PRELOAD", "")))
+    try:
+        zygote.serve()
+        return
+    except _Child as child:
+        req = child.req
+
+    # forked child, now outside the zygote loop: become the app
+    try:
+        zygote.close_in_child()
+        script = setup_child(req)
+    except BaseException:
+        traceback.print_exc()
+        os._exit(127)
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()